@@ -5,13 +5,13 @@ import openai
 import time
 import os
 import tempfile
-import requests
 import random
 import sys
 import subprocess
 import config
 
 from ble_sender_pico import send_cmd  # ← これは worker の中だけで使う
+from voicevox_client import get_client
 
 import queue
 import threading
@@ -207,22 +207,20 @@ def get_assistant_response(thread_id, user_input):
 # =========================
 # VoiceVox
 # =========================
+VOICE_PARAMS = {
+    "speedScale": 1.1,
+    "intonationScale": 1.6,
+    "pitchScale": 0,
+    "volumeScale": 1.0,
+}
+
+
 def synthesize_voice(text, speaker):
+    # クエリ作成 → 音声合成（keep-alive接続・タイムアウト付き）
     try:
-        params = {"text": text, "speaker": speaker}
-        query_res = requests.post(f"{VOICEVOX_URL}/audio_query", params=params)
-        query = query_res.json()
-        query.update({
-            "speedScale": 1.1,
-            "intonationScale": 1.6,
-            "pitchScale": 0,
-            "volumeScale": 1.0,
-        })
-        synth_res = requests.post(
-            f"{VOICEVOX_URL}/synthesis", params=params, json=query
-        )
-        return synth_res.content
-    except:
+        return get_client(VOICEVOX_URL).synthesize(text, speaker, VOICE_PARAMS)
+    except Exception as e:
+        print(f"⚠ VoiceVox 合成エラー: {e}")
         return None
 
 
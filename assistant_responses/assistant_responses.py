@@ -1,18 +1,33 @@
 import sounddevice as sd
-import numpy as np
-import scipy.io.wavfile as wav
 import openai
 import time
-import os
-import tempfile
-import requests
 import random
 import sys
-import subprocess
 import config
 
-from ble_sender_pico import send_cmd  # ← これは worker の中だけで使う
-
+from audio_capture import MUTE_TAIL_SEC, ContinuousCapture, record_utterance
+from barge_in import BargeInMonitor
+from audio_output import (
+    PlaybackEngine,
+    load_wake_latency,
+    measure_wake_latency,
+    save_wake_latency,
+    to_pcm,
+)
+from choreography import ChoreographyRegistry, legacy_commands
+from conversation_pipeline import ConversationPipeline
+from motion_scheduler import MotionScheduler
+from speech_pipeline import SentenceChunker
+from phrase_bank import PhraseBank
+from session_recorder import SessionRecorder
+from stt_backend import SocketStreamingBackend, TranscriptFilter, WhisperBackend
+from tts_cache import TtsCache
+from turn_trace import current_turn, tracer
+from voicevox_client import get_client
+from word_matcher import WordMatcher
+from ble_sender_pico import connect_early, send_cmd, stats as ble_stats  # ← send_cmd は worker の中だけで使う
+
+import asyncio
 import queue
 import threading
 from pathlib import Path
@@ -39,18 +54,71 @@ NICO_INSTRUCTIONS = PROMPT_FILE.read_text(
 INACTIVITY_TIMEOUT = 1800
 SAMPLERATE = 48000
 DURATION = 5
-FILENAME = "input.wav"
 SPEAKER_ID = config.SPEAKER_ID
 
-STOP_WORDS = ["stop", "ストップ", "すとっぷ", "Stop"]
-
-IGNORE_WORDS = [
-    "ご視聴ありがとうございました","ご清聴ありがとうございました",
-    "最後まで視聴してくださって本当にありがとうございます",
-    "おしまい。ご視聴ありがとうございました。",
-    "字幕視聴ありがとうございました", "おやすみなさい",
-    "最後まで視聴してくださって 本当にありがとうございます。"
-]
+# Whisperへ送る音声（メモリ上で16kHzに落として圧縮する）
+UPLOAD_FORMAT = getattr(config, "UPLOAD_FORMAT", "flac")
+UPLOAD_SAMPLERATE = getattr(config, "UPLOAD_SAMPLERATE", 16000)
+
+# 文字起こし方式: "whisper"=発話後に一括アップロード / "stream"=話している最中から送る
+STT_BACKEND = getattr(config, "STT_BACKEND", "whisper")
+STT_STREAM_ADDR = getattr(config, "STT_STREAM_ADDR", "127.0.0.1:8765")
+# Whisper の「幻聴」よけ（whisper のときだけ）。None にするとそのふるいは使わない
+#   STT_SILENCE_DBFS      : 一番大きい20msの音量がこれ未満なら送らない
+#   STT_NO_SPEECH_PROB    : 「話していない」確率がこれを超え、
+#   STT_LOGPROB_THRESHOLD :   かつ平均対数確率がこれ未満の区間は捨てる
+#   STT_MIN_LOGPROB       : 平均対数確率がこれ未満の区間は、それだけで捨てる（既定 None = 使わない）
+#   STT_COMPRESSION_RATIO : 圧縮率がこれを超える区間（同じ言葉の繰り返し）は捨てる
+STT_FILTER = getattr(config, "STT_FILTER", True)
+STT_SILENCE_DBFS = getattr(config, "STT_SILENCE_DBFS", -50.0)
+STT_NO_SPEECH_PROB = getattr(config, "STT_NO_SPEECH_PROB", 0.6)
+STT_LOGPROB_THRESHOLD = getattr(config, "STT_LOGPROB_THRESHOLD", -1.0)
+STT_MIN_LOGPROB = getattr(config, "STT_MIN_LOGPROB", None)
+STT_COMPRESSION_RATIO = getattr(config, "STT_COMPRESSION_RATIO", 2.4)
+
+# 返答の受け取り方: True=生成中の文章を句読点ごとに合成・再生していく
+LLM_STREAMING = getattr(config, "LLM_STREAMING", True)
+MAX_REPLY_CHARS = 50
+FALLBACK_REPLY = "うまく答えられなかったよ。"
+GOODBYE_REPLY = "楽しかった！またあそんでね！"
+# 断片を同時に合成するVoiceVoxリクエスト数（EC2側のコアを遊ばせない）
+TTS_WORKERS = getattr(config, "TTS_WORKERS", 2)
+# 会話パイプラインの段ごとのタイムアウト（秒）。指定した段だけ上書きされる
+PIPELINE_TIMEOUTS = getattr(config, "PIPELINE_TIMEOUTS", {})
+
+# 再生: 待機中もごく小さいノイズを流してBluetoothスピーカーを寝かせない
+OUTPUT_KEEPALIVE = getattr(config, "OUTPUT_KEEPALIVE", True)
+# スピーカーの立ち上がり遅延を（初回だけ）マイクで測って保存しておく
+OUTPUT_CALIBRATE_WAKE = getattr(config, "OUTPUT_CALIBRATE_WAKE", True)
+WAKE_CALIBRATION_FILE = BASE_DIR / "output_calibration.json"
+
+# ターンごとの処理時間を JSONL に記録する（None で記録しない）
+# 集計: python turn_trace.py turn_trace.jsonl
+TRACE_FILE = getattr(config, "TRACE_FILE", BASE_DIR / "turn_trace.jsonl")
+TRACE_MAX_BYTES = getattr(config, "TRACE_MAX_BYTES", 5 * 1024 * 1024)
+
+# 会話をまるごと（マイクの音・文字起こし・返答・合成音声・各段の時刻）zip に記録する（None で記録しない）
+# 子どもの声が残るので既定は記録しない。リプレイ: benchmarks/bench_e2e.py --replay session-xxxx.zip
+SESSION_RECORD_DIR = getattr(config, "SESSION_RECORD_DIR", None)
+
+# 録音方式:
+#   "always_on"=マイクを開きっぱなしにしてリングバッファから発話を切り出す
+#   "vad"=録音のたびにマイクを開き、話し終わりを検出して止める
+#   "fixed"=従来どおりDURATION秒固定
+CAPTURE_MODE = getattr(config, "CAPTURE_MODE", "always_on")
+CAPTURE_PRE_ROLL_SEC = getattr(config, "CAPTURE_PRE_ROLL_SEC", 0.3)
+VAD_TRAILING_SILENCE_SEC = getattr(config, "VAD_TRAILING_SILENCE_SEC", 0.8)
+VAD_MAX_UTTERANCE_SEC = getattr(config, "VAD_MAX_UTTERANCE_SEC", 15.0)
+# 割り込み: ニコがしゃべっている途中でも、子どもが話し始めたら止めて聞く（always_on のときだけ）
+BARGE_IN = getattr(config, "BARGE_IN", False) and CAPTURE_MODE == "always_on"
+
+# STOP / 無視 / 良い言葉の単語リスト（書き換えると次の発話から使われる）
+# 幻聴はふつう STT_FILTER で落ちる。"ignore" はすり抜けたとき用の最後の保険
+WORDS_FILE = getattr(config, "WORDS_FILE", BASE_DIR / "nico_words.json")
+words = WordMatcher(WORDS_FILE)
+# 良い言葉の動きは、その言葉が鳴る時刻（VoiceVox のモーラの長さから計算）に合わせる。
+# BLE で届いてモーターが動き出すまでのぶんだけ早めに送る（秒）
+MOTION_LEAD_SEC = getattr(config, "MOTION_LEAD_SEC", 0.1)
 
 GREETINGS = [
     "あそぼ！あそぼー！", "やったー！おしゃべりしよー", "やっほー！こんにちは",
@@ -58,11 +126,8 @@ GREETINGS = [
     "どうしたの？", "よく寝た～!", "わーい！わーい！おねえちゃん！", "おなかしゅいた"
 ]
 
-GOOD_WORDS = [
-    "大好き", "ありがとう", "うれしい", "やった", "楽しい", "ねえね",
-    "すごい", "わーい", "うれし", "だいすき", "だいしゅき",
-    "幸せ", "しあわせ", "ありがと～","うれちい","たのしい",
-]
+# 起動時に前もって合成しておく定型文（GREETINGS と合わせてフレーズバンクに入れる）
+STOCK_REPLIES = [FALLBACK_REPLY, GOODBYE_REPLY]
 
 def pick_input_device():
     keywords = ["UACDemoV1.0", "USB Audio"]
@@ -78,6 +143,55 @@ sd.default.device = (INPUT_DEVICE, None)
 sd.default.samplerate = SAMPLERATE
 sd.default.channels = 1
 
+if STT_BACKEND == "stream":
+    stt = SocketStreamingBackend(STT_STREAM_ADDR)
+else:
+    stt = WhisperBackend(
+        client, fmt=UPLOAD_FORMAT, target_rate=UPLOAD_SAMPLERATE,
+        transcript_filter=TranscriptFilter(
+            silence_dbfs=STT_SILENCE_DBFS,
+            no_speech_prob=STT_NO_SPEECH_PROB,
+            logprob_threshold=STT_LOGPROB_THRESHOLD,
+            min_logprob=STT_MIN_LOGPROB,
+            compression_ratio=STT_COMPRESSION_RATIO,
+        ) if STT_FILTER else None,
+    )
+
+# 常時録音（always_on のときだけ使う）
+mic_capture = ContinuousCapture(
+    SAMPLERATE, device=INPUT_DEVICE, pre_roll_sec=CAPTURE_PRE_ROLL_SEC
+)
+
+# 再生は OutputStream を開きっぱなしにして、メモリから直接流す
+speaker = PlaybackEngine(
+    samplerate=24000,
+    keepalive=OUTPUT_KEEPALIVE,
+    wake_latency_sec=load_wake_latency(WAKE_CALIBRATION_FILE),
+)
+
+motions = MotionScheduler(words, lead_sec=MOTION_LEAD_SEC, output_latency=lambda: speaker.latency)
+
+# 常時録音中は、自分（ニコ）が鳴っている間と直後はマイクをミュート
+mic_capture.mute_source = lambda: speaker.is_busy(tail_sec=MUTE_TAIL_SEC)
+
+# =========================
+# 割り込み（barge-in）
+# =========================
+def on_barge_in(onset):
+    """
+    再生中に子どもが話し始めた: 返答を止め、話し始め（＋プリロール）からマイクのミュートを外す。
+    続きは録音段がリングバッファから切り出す。
+    """
+    print("✋ 割り込み検出")
+    mic_capture.unmute_from(onset - mic_capture.pre_roll)
+    conversation.interrupt()
+    speaker.clear()
+
+
+barge_in_monitor = BargeInMonitor(mic_capture, speaker, on_barge_in) if BARGE_IN else None
+
+recorder = SessionRecorder()
+
 # =========================
 # BLE送信 1本化（対策②）
 # =========================
@@ -86,10 +200,10 @@ ble_queue = queue.Queue()
 def ble_worker():
     """BLE送信はこのスレッド1本だけが担当する（同時接続事故を防ぐ）"""
     while True:
-        cmd = ble_queue.get()
+        cmd, enqueued_at, turn = ble_queue.get()
         try:
             # ここだけが send_cmd を呼ぶ
-            send_cmd(cmd)
+            send_cmd(cmd, enqueued_at=enqueued_at, turn=turn)
             print(f"📤 BLE送信(worker): {cmd}")
         except Exception as e:
             print(f"⚠ BLE送信(worker)失敗: {cmd} / {e}")
@@ -97,92 +211,209 @@ def ble_worker():
             ble_queue.task_done()
 
 threading.Thread(target=ble_worker, daemon=True).start()
+# 最初の動き（あいさつ）を待たせないよう、起動したらすぐ Pico につなぎ始める
+connect_early()
 
 def ble_send(cmd: str):
     """キューに積むだけ（呼び出し側は絶対にsend_cmdしない）"""
-    ble_queue.put(cmd)
+    ble_queue.put((cmd, time.monotonic(), current_turn()))
 
 
 # =========================
-# 動作中フラグ（対策③）
+# Motor Control（振り付けを1回の書き込みで送る）
 # =========================
-is_moving_lock = threading.Lock()
-is_moving = False
+# 名前つきの振り付けは choreography.py の DEFAULT_CHOREOGRAPHIES。config で足したり上書きしたりできる
+#   例: CHOREOGRAPHIES = {"goodword": "F1,W0.2,R1,F1"}
+choreographies = ChoreographyRegistry(getattr(config, "CHOREOGRAPHIES", None))
+# True: 振り付けを SEQ パケット1回で送る（Pico のファームウェアが SEQ を読めるようになってから）
+# False: ステップを1つずつ送る（いまの Pico。送る間スレッドが待つ）
+BLE_CHOREOGRAPHY = getattr(config, "BLE_CHOREOGRAPHY", False)
 
-
-# =========================
-# Motor Control（finally STOP保証 + 送信1本化）
-# =========================
-def nico_action_greeting():
-    try:
-        ble_send("FORWARD:1.5")
-        time.sleep(1.7)
-    finally:
-        ble_send("STOP")
+moving_lock = threading.Lock()
+moving_until = 0.0
 
 
-def nico_action_goodword():
+def perform(name):
     """
-    良い言葉で喜びダンス：前進2s → stop0.5s → 後退2s → stop
-    ・同時実行禁止（is_moving）
-    ・例外でも最後にSTOP（対策①）
+    名前つきの振り付けを Pico に送る。
+    ・動き終わるまでは次の振り付けを送らない（連打防止）
+    ・止めるのは Pico 側（最後に必ず STOP する）
     """
-    global is_moving
-
-    # --- 連打防止 ---
-    with is_moving_lock:
-        if is_moving:
-            return
-        is_moving = True
-
+    global moving_until
+    with moving_lock:
+        now = time.monotonic()
+        if now < moving_until:
+            return False
+        moving_until = now + choreographies.duration(name)
+
+    if BLE_CHOREOGRAPHY:
+        ble_send(choreographies.packet(name))
+    else:
+        threading.Thread(target=perform_steps, args=(name,), daemon=True).start()
+    return True
+
+
+def perform_steps(name):
+    """振り付けを1ステップずつ送る（古い Pico 用。例外でも最後にSTOP）"""
     try:
-        ble_send("FORWARD:2.0")  # Picoが1.2秒動かして自動STOP
-        time.sleep(2.1)         # 次コマンド間の余裕（0でもOK）
-        ble_send("REVERSE:2.0")  # Picoが1.2秒動かして自動STOP
-        time.sleep(2.1)
-        
+        for cmd, seconds in legacy_commands(choreographies.steps(name)):
+            if cmd:
+                ble_send(cmd)
+            time.sleep(seconds)
     except Exception as e:
         print("⚠ 動作中エラー:", e)
-
     finally:
         ble_send("STOP")
-        with is_moving_lock:
-            is_moving = False
 
 
 # =========================
 # 音声
 # =========================
-def record_audio():
-    try:
-        if os.path.exists(FILENAME):
-            os.remove(FILENAME)
-
-        audio = sd.rec(
-            int(SAMPLERATE * DURATION),
-            dtype='int16'
-        )
-        sd.wait()
+def record_audio(should_stop=None):
+    """
+    1回分の発話を録音する（ファイルには保存しない）。
+    should_stop は常時録音のときだけ使う（ほかの方式は DURATION などで自然に終わる）。
 
-        # (frames,1) → (frames,) にして保存（安全）
-        wav.write(FILENAME, SAMPLERATE, audio.reshape(-1))
+    戻り値:
+        録音したint16配列。声が検出されなかったときは長さ0の配列。
+        録音エラーのときはNone。
+    """
+    try:
+        if CAPTURE_MODE == "always_on":
+            audio = mic_capture.next_utterance(
+                trailing_silence_sec=VAD_TRAILING_SILENCE_SEC,
+                max_utterance_sec=VAD_MAX_UTTERANCE_SEC,
+                start_timeout_sec=DURATION,
+                should_stop=should_stop,
+            )
+        elif CAPTURE_MODE == "vad":
+            audio = record_utterance(
+                SAMPLERATE,
+                device=INPUT_DEVICE,
+                trailing_silence_sec=VAD_TRAILING_SILENCE_SEC,
+                max_utterance_sec=VAD_MAX_UTTERANCE_SEC,
+                start_timeout_sec=DURATION,
+                pre_roll_sec=CAPTURE_PRE_ROLL_SEC,
+            )
+        else:
+            audio = sd.rec(
+                int(SAMPLERATE * DURATION),
+                dtype='int16'
+            )
+            sd.wait()
 
-        return True
+        # (frames,1) → (frames,)
+        return audio.reshape(-1)
     except Exception as e:
         print("❌ 録音エラー:", e)
-        return False
+        return None
 
-def transcribe_audio():
+def transcribe_audio(audio):
     try:
-        with open(FILENAME, "rb") as f:
-            response = client.audio.transcriptions.create(
-                model="whisper-1", file=f, language="ja", temperature=0.0
-            )
-        return response.text.strip()
-    except:
+        return stt.transcribe(audio, SAMPLERATE)
+    except Exception as e:
+        print("❌ 文字起こしエラー:", e)
         return ""
 
 
+def capture_utterance(should_stop=None):
+    """
+    1発話ぶんを切り出す（会話パイプラインの録音段）。
+
+    ストリーミングSTTかつ常時録音のときは、話している最中から音声を送っておき、
+    文字起こし段ではストリームを閉じるだけにする。
+    should_stop() が True になったら（録音段のタイムアウト）切り出しをやめる。
+
+    戻り値:
+        (録音したint16配列, STTストリーム or None)。録音エラーのときはNone。
+    """
+    if CAPTURE_MODE != "always_on":
+        # 録音のたびにマイクを開く方式では、自分（ニコ）の声を録らないよう鳴り終わってから録る
+        speaker.wait_idle()
+        time.sleep(0.3)
+
+    if not (stt.streaming and CAPTURE_MODE == "always_on"):
+        audio = record_audio(should_stop)
+        if audio is None:
+            return None
+        trace_capture(audio)
+        return audio, None
+
+    stream = None
+
+    def on_speech(chunk):
+        nonlocal stream
+        if stream is None:
+            stream = stt.open_stream(
+                SAMPLERATE, on_partial=lambda t: print(f"… {t}")
+            )
+        stream.push(chunk)
+
+    try:
+        audio = mic_capture.next_utterance(
+            trailing_silence_sec=VAD_TRAILING_SILENCE_SEC,
+            max_utterance_sec=VAD_MAX_UTTERANCE_SEC,
+            start_timeout_sec=DURATION,
+            on_speech=on_speech,
+            should_stop=should_stop,
+        )
+    except Exception as e:
+        print("❌ 録音エラー:", e)
+        if stream is not None:
+            stream.cancel()
+        return None
+    if not audio.size and stream is not None:
+        # 話している途中でやめた（送りかけの音声は文字にしない）
+        stream.cancel()
+        stream = None
+    trace_capture(audio)
+    return audio, stream
+
+
+def trace_capture(audio):
+    """切り出した発話の長さを capture スパンとして記録する（話し終わり判定の時刻で終わる）"""
+    if audio.size:
+        end = time.monotonic()
+        tracer.record("capture", end - audio.size / SAMPLERATE, end, mode=CAPTURE_MODE)
+        recorder.utterance(audio, mic_capture.last_span if CAPTURE_MODE == "always_on" else None)
+
+
+def transcribe_utterance(utterance):
+    """
+    capture_utterance() の結果を文字にする（会話パイプラインの文字起こし段）。
+    戻り値: 文字列（無音なら ""）
+    """
+    audio, stream = utterance
+    if stream is None:
+        # 声が検出されなかったときはアップロードしない
+        text = transcribe_audio(audio) if audio.size else ""
+    elif audio.size == 0:
+        stream.cancel()
+        text = ""
+    else:
+        try:
+            text = stream.finish()
+        except Exception as e:
+            print("❌ 文字起こしエラー:", e)
+            text = ""
+    if audio.size:
+        recorder.transcript(text)
+    return text
+
+
+def listen():
+    """
+    1ターン分を聞き取って文字にする。
+
+    戻り値:
+        文字列（無音なら ""）。録音エラーのときはNone。
+    """
+    utterance = capture_utterance()
+    if utterance is None:
+        return None
+    return transcribe_utterance(utterance)
+
+
 # =========================
 # Responses API
 # =========================
@@ -205,139 +436,308 @@ def get_assistant_response(previous_response_id, user_input):
         if previous_response_id:
             request_params["previous_response_id"] = previous_response_id
 
-        response = client.responses.create(**request_params)
+        with tracer.span("llm", streaming=False):
+            response = client.responses.create(**request_params)
 
         reply = response.output_text.strip()
 
         if not reply:
             print("⚠ Responses APIから返答テキストがありません。")
-            return "うまく答えられなかったよ。", previous_response_id
+            return FALLBACK_REPLY, previous_response_id
 
         # プロンプト指示だけで50文字を超えた場合の安全対策
-        if len(reply) > 50:
-            reply = reply[:50]
+        if len(reply) > MAX_REPLY_CHARS:
+            reply = reply[:MAX_REPLY_CHARS]
 
         return reply, response.id
 
     except Exception as e:
         print("❌ Responses API エラー:", e)
-        return "うまく答えられなかったよ。", previous_response_id
+        return FALLBACK_REPLY, previous_response_id
+
+
+def stream_assistant_response(previous_response_id, user_input, on_fragment, should_stop=None):
+    """
+    Responses APIをストリーミングで呼び、句読点で区切れるたびに on_fragment(text) を呼ぶ。
+    最初の文を合成・再生している間に、続きの文章の生成が進む。
+
+    should_stop() が True になったら（割り込み）、そこで受け取りをやめる。
+    途中で止めた返答は会話の続きに使わず、前回の Response ID を返す。
+
+    戻り値:
+        (返答全文, Response ID)。
+        1文字も届かなかったときだけ FALLBACK_REPLY を on_fragment に渡す。
+    """
+    request_params = {
+        "model": config.OPENAI_MODEL,
+        "instructions": NICO_INSTRUCTIONS,
+        "input": user_input,
+        "stream": True,
+    }
+    if previous_response_id:
+        request_params["previous_response_id"] = previous_response_id
+
+    chunker = SentenceChunker(max_chars=MAX_REPLY_CHARS)
+    reply = ""
+    response_id = previous_response_id
+
+    started = time.monotonic()
+    first_token = None
+    try:
+        stream = client.responses.create(**request_params)
+        for event in stream:
+            if should_stop is not None and should_stop():
+                stream.close()
+                print("✋ 返答の生成を打ち切りました")
+                tracer.record("llm", started, time.monotonic(), streaming=True, stopped=True)
+                return reply, previous_response_id
+            if event.type == "response.output_text.delta":
+                if first_token is None:
+                    first_token = time.monotonic()
+                    tracer.record("llm_ttft", started, first_token)
+                for fragment in chunker.feed(event.delta):
+                    reply += fragment
+                    on_fragment(fragment)
+            elif event.type == "response.completed":
+                response_id = event.response.id
+            elif event.type in ("response.failed", "error"):
+                print("❌ Responses API ストリームエラー:", event)
+                break
+    except Exception as e:
+        print("❌ Responses API エラー:", e)
+    tracer.record("llm", started, time.monotonic(), streaming=True, chars=len(reply) + len(chunker.buffer))
+
+    rest = chunker.flush()
+    if rest:
+        reply += rest
+        on_fragment(rest)
+
+    if not reply:
+        print("⚠ Responses APIから返答テキストがありません。")
+        on_fragment(FALLBACK_REPLY)
+        return FALLBACK_REPLY, previous_response_id
+
+    return reply, response_id
 
 
 # =========================
 # VoiceVox
 # =========================
-def synthesize_voice(text, speaker):
-    try:
-        params = {"text": text, "speaker": speaker}
-        query_res = requests.post(f"{VOICEVOX_URL}/audio_query", params=params)
-        query = query_res.json()
-        query.update({
-            "speedScale": 1.1,
-            "intonationScale": 1.6,
-            "pitchScale": 0,
-            "volumeScale": 1.0,
-        })
-        synth_res = requests.post(
-            f"{VOICEVOX_URL}/synthesis", params=params, json=query
-        )
-        return synth_res.content
-    except:
-        return None
+# keep-alive 接続を並列合成ワーカーの数だけ張っておく
+voicevox = get_client(VOICEVOX_URL, pool_size=max(2, TTS_WORKERS))
 
+VOICE_PARAMS = {
+    "speedScale": 1.1,
+    "intonationScale": 1.6,
+    "pitchScale": 0,
+    "volumeScale": 1.0,
+}
+
+
+# 同じ文（あいさつ・おわかれ・エラー時の返事など）は2回目から合成しない
+tts_cache = TtsCache(
+    disk_dir=getattr(config, "TTS_CACHE_DIR", BASE_DIR / "tts_cache_data"),
+    memory_max_bytes=getattr(config, "TTS_CACHE_MEMORY_BYTES", 8 * 1024 * 1024),
+    disk_max_bytes=getattr(config, "TTS_CACHE_DISK_BYTES", 200 * 1024 * 1024),
+    # SDカードにはこの回数使われた文だけ書く（1回きりの返事で毎ターン書かない）
+    disk_min_uses=getattr(config, "TTS_CACHE_DISK_MIN_USES", 2),
+)
+
+
+# あいさつ・定型文は PCM で前もって合成しておく（phrase_bank_data/）
+phrase_bank = PhraseBank(getattr(config, "PHRASE_BANK_DIR", BASE_DIR / "phrase_bank_data"))
 
-def play_audio(audio_data, factor=7.0):
-    # 先頭に無音を追加して、Bluetoothスピーカーの立ち上がり遅延を吸収する
-    LEADING_SILENCE_SEC = 0.6
 
-    amplified = np.frombuffer(audio_data, dtype=np.int16)
-    amplified = (amplified * factor).clip(-32768, 32767).astype(np.int16)
+def build_phrase_bank():
+    """VoiceVoxにつながったらすぐ、足りないあいさつ・定型文をバックグラウンドで並列合成する"""
+    return phrase_bank.build_in_background(
+        GREETINGS + STOCK_REPLIES,
+        SPEAKER_ID,
+        VOICE_PARAMS,
+        lambda text: voicevox.synthesize(text, SPEAKER_ID, VOICE_PARAMS),
+    )
 
-    silence = np.zeros(int(24000 * LEADING_SILENCE_SEC), dtype=np.int16)
 
-    # 無音 + 本編音声
-    output = np.concatenate([silence, amplified])
-    data = output.tobytes()
+def synthesize_voice(text, speaker):
+    audio = phrase_bank.get(text, speaker, VOICE_PARAMS)
+    if not audio:
+        try:
+            audio = tts_cache.get_or_synthesize(
+                text, speaker, VOICE_PARAMS,
+                lambda: voicevox.synthesize(
+                    text, speaker, VOICE_PARAMS, on_query=lambda query: motions.remember(text, query)
+                ),
+            )
+        except Exception as e:
+            print(f"⚠ VoiceVox 合成エラー: {e}")
+            audio = None
+    recorder.speech(text, audio)
+    return audio
+
 
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        tmp.write(data)
-        tmp_path = tmp.name
+def play_audio(audio_data, factor=7.0, leading_silence_sec=None, wait=True):
+    """
+    音量を上げて再生エンジンに積む。
 
-    subprocess.run(["aplay", "-r", "24000", "-f", "S16_LE", "-c", "1", tmp_path])
+    leading_silence_sec=None のときは、スピーカーがスリープしていそうなときだけ
+    測定済みの立ち上がり遅延ぶんの無音を先頭に入れる（起きていれば 0）。
+
+    wait=True  : 鳴り終わるまで待つ
+    wait=False : 鳴り始めたら戻る（次の断片をすぐ後ろに積んで隙間なくつなぐ用）
+    """
+    # 先頭に無音を追加して、Bluetoothスピーカーの立ち上がり遅延を吸収する
+    # （続けて再生する2つ目以降の断片ではスピーカーが起きているので 0 でよい）
+    if leading_silence_sec is None:
+        leading_silence_sec = speaker.lead_in_sec()
+
+    # 音量調整（ソフトリミッター付き）と先頭の無音は再生コールバックの中で付ける。
+    # ここでは配列のコピーを作らない。
+    fragment = speaker.play(
+        to_pcm(audio_data),
+        wait=wait,
+        gain=factor,
+        lead_in_sec=leading_silence_sec,
+    )
+    if not wait:
+        fragment.started.wait()
+    return fragment
 
 # =========================
 # 会話処理
 # =========================
 def speak_greeting():
-    greeting = random.choice(GREETINGS)
+    # 合成済みのあいさつがあれば、その中から選ぶ（VoiceVoxを待たずにすぐ話せる）
+    ready = phrase_bank.available(GREETINGS, SPEAKER_ID, VOICE_PARAMS)
+    greeting = random.choice(ready or GREETINGS)
     print(f"🎙️ Greeting: {greeting}")
 
     # ★ 挨拶動作（しゃべる直前に開始）
-    threading.Thread(target=nico_action_greeting, daemon=True).start()
+    perform("greeting")
 
     audio = synthesize_voice(greeting, SPEAKER_ID)
     if audio:
         play_audio(audio)
 
 
-def speak_response(text):
-    print(f"🤖 ニコ: {text}")
-
-    audio = synthesize_voice(text, SPEAKER_ID)
-    if not audio:
-        return
-
-    # ★ 良い言葉を検出したら「しゃべりながら」動かす
-    if any(word in text for word in GOOD_WORDS):
-        threading.Thread(target=nico_action_goodword, daemon=True).start()
-
-    play_audio(audio)
+def respond(previous_response_id, user_input, on_fragment, should_stop):
+    """会話パイプラインの返答生成段。LLM_STREAMING=False なら一括で受け取ってから文ごとに渡す"""
+    if LLM_STREAMING:
+        reply, response_id = stream_assistant_response(
+            previous_response_id, user_input, on_fragment, should_stop=should_stop
+        )
+        recorder.reply(user_input, reply)
+        return reply, response_id
+
+    reply, response_id = get_assistant_response(previous_response_id, user_input)
+    recorder.reply(user_input, reply)
+    # フレーズバンクにある定型文は、分けずにそのまま渡す
+    if phrase_bank.available([reply], SPEAKER_ID, VOICE_PARAMS):
+        fragments = [reply]
+    else:
+        chunker = SentenceChunker()
+        fragments = chunker.feed(reply)
+        rest = chunker.flush()
+        if rest:
+            fragments.append(rest)
+    for fragment in fragments:
+        if should_stop():
+            break
+        on_fragment(fragment)
+    return reply, response_id
+
+
+# 鳴り終わったら playback スパンを記録する断片（turn, Fragment）
+playing_fragments = []
+playing_lock = threading.Lock()
+
+
+def play_fragment(text, audio, index):
+    # 鳴り始めたら戻り、次の断片をすぐ後ろに積む（隙間なく再生される）
+    queued_at = time.monotonic()
+    fragment = play_audio(audio, leading_silence_sec=None if index == 0 else 0.0, wait=False)
+    tracer.record(
+        "playback_start", queued_at, fragment.started_at,
+        index=index, lead_in_ms=round(fragment.lead_in / speaker.samplerate * 1000),
+    )
+    with playing_lock:
+        playing_fragments.append((current_turn(), fragment))
+    return fragment
+
+
+def wait_playback():
+    """鳴り終わるまで待ち、鳴った断片の playback スパンを記録する"""
+    speaker.wait_idle()
+    with playing_lock:
+        finished = playing_fragments[:]
+        playing_fragments.clear()
+    for turn, fragment in finished:
+        # 割り込みで止めた断片は finished_at が無い
+        tracer.record("playback", fragment.started_at, fragment.finished_at, turn=turn)
+
+
+def goodword_motion(text):
+    # ★ 良い言葉を検出したら、その言葉が鳴る時刻に合わせて動かす（1返答につき1回）
+    if words.has(text, "good"):
+        return lambda fragment: motions.run_on_word(
+            text, fragment, speaker.samplerate, lambda: perform("goodword")
+        )
+    return None
+
+
+conversation = ConversationPipeline(
+    capture=capture_utterance,
+    transcribe=transcribe_utterance,
+    respond=respond,
+    synthesize=lambda text: synthesize_voice(text, SPEAKER_ID),
+    play=play_fragment,
+    wait_idle=wait_playback,
+    motion_for=goodword_motion,
+    words=words,
+    inactivity_timeout=INACTIVITY_TIMEOUT,
+    goodbye_reply=GOODBYE_REPLY,
+    fallback_reply=FALLBACK_REPLY,
+    tts_workers=TTS_WORKERS,
+    timeouts=PIPELINE_TIMEOUTS,
+)
 
 
 # =========================
 # メインループ
 # =========================
 def listen_and_talk_loop():
-    last_valid_input_time = time.time()
-
-    speak_greeting()
-    previous_response_id = None
-
-    while True:
-        if not record_audio():
-            continue
-
-        text = transcribe_audio()
-        now = time.time()
-
-        if os.path.exists(FILENAME):
-            os.remove(FILENAME)
+    """
+    録音・文字起こし・返答生成・合成・再生・動作を会話パイプラインの段として並行に動かす。
+    STOP ワードか、INACTIVITY_TIMEOUT 秒話しかけられなかったら、おわかれを言って終了する。
+    """
+    if SESSION_RECORD_DIR:
+        recorder.start(
+            SESSION_RECORD_DIR, SAMPLERATE,
+            capture=mic_capture if CAPTURE_MODE == "always_on" else None,
+        )
 
-        if not text:
-            print("(無音)")
-        elif any(w in text for w in IGNORE_WORDS):
-            print("(無視ワード)")
-        else:
-            print(f"📝 子供: {text}")
+    if CAPTURE_MODE == "always_on":
+        mic_capture.start()
+        if OUTPUT_CALIBRATE_WAKE and not WAKE_CALIBRATION_FILE.exists():
+            wake = measure_wake_latency(speaker, mic_capture)
+            if wake is not None:
+                speaker.wake_latency_sec = wake
+                save_wake_latency(WAKE_CALIBRATION_FILE, wake)
 
-            if any(s in text for s in STOP_WORDS):
-                speak_response("楽しかった！またあそんでね！")
-                print("STOP")
-                sys.exit(0)
+    # 最初の音を出す前から出力を開いておく（keepalive ならここからスピーカーが起き続ける）
+    speaker.start()
+    if barge_in_monitor is not None:
+        barge_in_monitor.start()
 
-            reply, previous_response_id = get_assistant_response(
-                previous_response_id,
-                text
-            )
-            speak_response(reply)
-            last_valid_input_time = now
+    if TRACE_FILE:
+        tracer.configure(TRACE_FILE, max_bytes=TRACE_MAX_BYTES)
 
-        if now - last_valid_input_time > INACTIVITY_TIMEOUT:
-            speak_response("楽しかった！またあそんでね！")
-            print("STOP")
-            sys.exit(0)
+    # あいさつと並行して、足りない定型文を合成しておく
+    build_phrase_bank()
+    speak_greeting()
 
-        time.sleep(0.3)
+    asyncio.run(conversation.run())
+    print("STOP")
+    sys.exit(0)
 
 
 # =========================
@@ -349,6 +749,12 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("🛑 終了")
     finally:
+        print("📊 TTSキャッシュ:", tts_cache.stats())
+        if getattr(stt, "transcript_filter", None):
+            print("📊 文字起こしのふるい:", stt.transcript_filter.stats())
+        print("📊 BLE:", ble_stats())
+        recorder.close()
+        tracer.close()
         # 最後に念のためSTOPを積んで終わる（安全）
         try:
             ble_send("STOP")
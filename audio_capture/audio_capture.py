@@ -0,0 +1,426 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import sounddevice as sd
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+FRAME_MS = 30                 # VAD判定の1フレーム長
+THRESHOLD_DB = -45.0          # これより小さい音は常に無音扱い（dBFS）
+NOISE_MARGIN_DB = 10.0        # 環境ノイズ推定値からどれだけ大きければ声とみなすか
+START_FRAMES = 3              # 連続でこのフレーム数だけ声が続いたら発話開始
+TRAILING_SILENCE_SEC = 0.8    # 発話後、この秒数だけ無音が続いたら発話終了
+MAX_UTTERANCE_SEC = 15.0      # 1回の発話の最大長（話し続けても打ち切る）
+START_TIMEOUT_SEC = 5.0       # この秒数以内に話し始めなければ「無音」として返す
+PRE_ROLL_SEC = 0.3            # 発話開始より前に残しておく音（最初の音の欠け防止）
+RING_BUFFER_SEC = 30.0        # 常時録音のリングバッファ長（処理中の発話をここにためておく）
+MUTE_TAIL_SEC = 0.3           # 再生終了後もしばらくミュートを続ける（Bluetoothの遅れ分）
+
+
+def frame_dbfs(frame):
+    """int16フレームの音量をdBFSで返す（無音は-120）"""
+    if frame.size == 0:
+        return -120.0
+    x = frame.astype(np.float32)
+    rms = np.sqrt(np.mean(x * x)) / 32768.0
+    return float(20.0 * np.log10(max(rms, 1e-6)))
+
+
+class EnergyVAD:
+    """
+    フレーム単位の音量ベースVAD。
+    ・環境ノイズを無音フレームからゆっくり追従して推定する
+    ・「ノイズ + マージン」と「絶対しきい値」の大きい方を超えたら声とみなす
+    """
+
+    def __init__(self, threshold_db=THRESHOLD_DB, noise_margin_db=NOISE_MARGIN_DB):
+        self.threshold_db = threshold_db
+        self.noise_margin_db = noise_margin_db
+        self.noise_db = threshold_db - noise_margin_db
+
+    def is_speech(self, frame):
+        db = frame_dbfs(frame)
+        speech = db > max(self.threshold_db, self.noise_db + self.noise_margin_db)
+        if not speech:
+            # 無音フレームだけでノイズレベルを更新する（声で引き上げない）
+            self.noise_db = 0.95 * self.noise_db + 0.05 * db
+        return speech
+
+
+class Endpointer:
+    """
+    VADの結果から「発話開始」「発話終了」を決める状態機械。
+    feed() はフレームごとに呼び、"start" / "end" / None を返す。
+    """
+
+    def __init__(
+        self,
+        frame_sec,
+        start_frames=START_FRAMES,
+        trailing_silence_sec=TRAILING_SILENCE_SEC,
+        max_utterance_sec=MAX_UTTERANCE_SEC,
+    ):
+        self.start_frames = start_frames
+        self.trailing_frames = max(1, int(round(trailing_silence_sec / frame_sec)))
+        self.max_frames = max(1, int(round(max_utterance_sec / frame_sec)))
+        self.reset()
+
+    def reset(self):
+        self.in_speech = False
+        self.voiced_run = 0
+        self.silent_run = 0
+        self.speech_frames = 0
+
+    def feed(self, is_speech):
+        if not self.in_speech:
+            self.voiced_run = self.voiced_run + 1 if is_speech else 0
+            if self.voiced_run >= self.start_frames:
+                self.in_speech = True
+                self.speech_frames = self.voiced_run
+                self.silent_run = 0
+                return "start"
+            return None
+
+        self.speech_frames += 1
+        self.silent_run = 0 if is_speech else self.silent_run + 1
+        if self.silent_run >= self.trailing_frames or self.speech_frames >= self.max_frames:
+            return "end"
+        return None
+
+
+def record_utterance(
+    samplerate,
+    device=None,
+    frame_ms=FRAME_MS,
+    trailing_silence_sec=TRAILING_SILENCE_SEC,
+    max_utterance_sec=MAX_UTTERANCE_SEC,
+    start_timeout_sec=START_TIMEOUT_SEC,
+    pre_roll_sec=PRE_ROLL_SEC,
+    vad=None,
+):
+    """
+    InputStream のコールバックでフレームを受け取り、VADで発話区間だけを切り出す。
+
+    戻り値:
+        int16 の1次元配列。
+        start_timeout_sec 以内に声が検出されなければ長さ0の配列（アップロード不要）。
+    """
+    frame_len = int(samplerate * frame_ms / 1000)
+    frame_sec = frame_len / samplerate
+    vad = vad or EnergyVAD()
+    endpointer = Endpointer(
+        frame_sec,
+        trailing_silence_sec=trailing_silence_sec,
+        max_utterance_sec=max_utterance_sec,
+    )
+
+    frames = queue.Queue()
+
+    def callback(indata, frame_count, time_info, status):
+        if status:
+            print("⚠ 録音ステータス:", status)
+        frames.put(indata[:, 0].copy())
+
+    pre_roll = deque(maxlen=max(1, int(round(pre_roll_sec / frame_sec))))
+    voiced = []
+    deadline = time.monotonic() + start_timeout_sec
+    pending = np.zeros(0, dtype=np.int16)
+
+    with sd.InputStream(
+        samplerate=samplerate,
+        device=device,
+        channels=1,
+        dtype="int16",
+        blocksize=frame_len,
+        callback=callback,
+    ):
+        while True:
+            try:
+                block = frames.get(timeout=1.0)
+            except queue.Empty:
+                raise RuntimeError("マイクからの入力が止まりました")
+
+            # blocksize どおりに来ない環境もあるので、フレーム長にそろえる
+            pending = np.concatenate([pending, block]) if pending.size else block
+            while pending.size >= frame_len:
+                frame, pending = pending[:frame_len], pending[frame_len:]
+                event = endpointer.feed(vad.is_speech(frame))
+
+                if endpointer.in_speech:
+                    if event == "start":
+                        voiced.extend(pre_roll)
+                    voiced.append(frame)
+                    if event == "end":
+                        return np.concatenate(voiced)
+                else:
+                    pre_roll.append(frame)
+
+            if not endpointer.in_speech and time.monotonic() > deadline:
+                return np.zeros(0, dtype=np.int16)
+
+
+class MicRingBuffer:
+    """
+    固定長のint16リングバッファ（最初に確保したら以後メモリ確保しない）。
+    位置は「録音開始からの通算サンプル数」で扱うので、呼び出し側は折り返しを気にしなくてよい。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._buf = np.zeros(self.capacity, dtype=np.int16)
+        self._written = 0
+        self._lock = threading.Lock()
+
+    @property
+    def written(self):
+        return self._written
+
+    def oldest(self):
+        """まだ上書きされていない一番古いサンプルの位置"""
+        return max(0, self._written - self.capacity)
+
+    def write(self, block):
+        n = block.shape[0]
+        if n > self.capacity:
+            block = block[-self.capacity:]
+            skipped = n - self.capacity
+            n = self.capacity
+        else:
+            skipped = 0
+        with self._lock:
+            pos = (self._written + skipped) % self.capacity
+            first = min(n, self.capacity - pos)
+            self._buf[pos:pos + first] = block[:first]
+            self._buf[:n - first] = block[first:]
+            self._written += skipped + n
+
+    def read(self, start, end):
+        """通算位置 [start, end) をコピーして返す（上書き済みの部分は切り捨て）"""
+        with self._lock:
+            start = max(int(start), self._written - self.capacity, 0)
+            end = min(int(end), self._written)
+            if end <= start:
+                return np.zeros(0, dtype=np.int16)
+            a = start % self.capacity
+            b = a + (end - start)
+            if b <= self.capacity:
+                return self._buf[a:b].copy()
+            return np.concatenate([self._buf[a:], self._buf[:b - self.capacity]])
+
+
+class ContinuousCapture:
+    """
+    マイクを開きっぱなしにして、PortAudioの録音スレッド（コールバック）から
+    リングバッファへ書き続ける。
+
+    next_utterance() は前回読み終わった位置から続けてVADをかけるので、
+    STT・返答生成・合成の間に話した声もバッファに残っていて取りこぼさない。
+
+    ミュート中（mute_source が True を返す間。ニコの再生中など）もリングバッファには生の音を書き、
+    「ミュート区間」だけを記録しておく。発話の切り出しではその区間を無音として扱う。
+    割り込み（barge-in）を検出したら unmute_from() で区間を途中から取り消せる。
+    """
+
+    def __init__(
+        self,
+        samplerate,
+        device=None,
+        buffer_sec=RING_BUFFER_SEC,
+        frame_ms=FRAME_MS,
+        pre_roll_sec=PRE_ROLL_SEC,
+        vad=None,
+    ):
+        self.samplerate = samplerate
+        self.device = device
+        self.frame_len = int(samplerate * frame_ms / 1000)
+        self.frame_sec = self.frame_len / samplerate
+        self.pre_roll = int(samplerate * pre_roll_sec)
+        self.vad = vad or EnergyVAD()
+        self.ring = MicRingBuffer(int(samplerate * buffer_sec))
+
+        self._cursor = 0
+        self._cond = threading.Condition()
+        self._stream = None
+        # 呼ぶと True/False を返す関数。True の間はミュート（再生エンジンの状態など）
+        self.mute_source = None
+        self._last_callback = (0.0, 0)   # (time.monotonic, その時点の通算サンプル数)
+        self._mute_spans = deque()       # [開始位置, 終了位置 or None(ミュート中)]
+        self._force_unmuted = False      # 割り込み後、その発話を切り出し終わるまでミュートしない
+        # 録音した生の音を毎回受け取る関数（セッション記録用）。録音スレッドから呼ばれる
+        self.tap = None
+        self.last_span = None            # 最後に切り出した発話の (開始位置, 終了位置)
+
+    # ---------- 録音スレッド ----------
+    def _is_muted_now(self):
+        if self._force_unmuted:
+            return False
+        return bool(self.mute_source is not None and self.mute_source())
+
+    def _callback(self, indata, frame_count, time_info, status):
+        if status:
+            print("⚠ 録音ステータス:", status)
+        muted = self._is_muted_now()
+        with self._cond:
+            pos = self.ring.written
+            in_span = bool(self._mute_spans) and self._mute_spans[-1][1] is None
+            if muted and not in_span:
+                self._mute_spans.append([pos, None])
+            elif not muted and in_span:
+                self._mute_spans[-1][1] = pos
+        self.ring.write(indata[:, 0])
+        self._last_callback = (time.monotonic(), self.ring.written)
+        if self.tap is not None:
+            self.tap(indata[:, 0])
+        with self._cond:
+            self._cond.notify_all()
+
+    def start(self):
+        if self._stream is not None:
+            return
+        self._stream = sd.InputStream(
+            samplerate=self.samplerate,
+            device=self.device,
+            channels=1,
+            dtype="int16",
+            blocksize=self.frame_len,
+            callback=self._callback,
+        )
+        self._stream.start()
+        self._cursor = self.ring.written
+        print(f"🎤 常時録音を開始しました（バッファ {self.ring.capacity / self.samplerate:.0f}秒）")
+
+    def position_at(self, t):
+        """time.monotonic() の時刻 t に録音されたサンプルの通算位置（おおよそ）"""
+        t_last, written = self._last_callback
+        return int(written + (t - t_last) * self.samplerate)
+
+    def time_at(self, position):
+        """position_at の逆。通算位置 → time.monotonic() の時刻"""
+        t_last, written = self._last_callback
+        return t_last + (position - written) / self.samplerate
+
+    def stop(self):
+        if self._stream is None:
+            return
+        try:
+            self._stream.stop()
+            self._stream.close()
+        finally:
+            self._stream = None
+
+    def unmute_from(self, position):
+        """
+        position 以降のミュートを取り消す（割り込みで子どもが話し始めた位置を渡す）。
+        その発話を next_utterance() で切り出し終わるまで、新しいミュートもかけない。
+        """
+        with self._cond:
+            self._force_unmuted = True
+            kept = deque()
+            for span in self._mute_spans:
+                if span[0] >= position:
+                    continue
+                if span[1] is None or span[1] > position:
+                    span[1] = position
+                kept.append(span)
+            self._mute_spans = kept
+
+    def read(self, start, end):
+        """リングバッファから読み、ミュート区間を 0 にして返す"""
+        audio = self.ring.read(start, end)
+        start = max(int(start), self.ring.oldest())
+        with self._cond:
+            oldest = self.ring.oldest()
+            while self._mute_spans and self._mute_spans[0][1] is not None and self._mute_spans[0][1] <= oldest:
+                self._mute_spans.popleft()
+            for span_start, span_end in self._mute_spans:
+                a = max(span_start, start) - start
+                b = (start + audio.size if span_end is None else min(span_end, start + audio.size)) - start
+                if a < b:
+                    audio[a:b] = 0
+        return audio
+
+    # ---------- 発話の切り出し ----------
+    def _wait_for(self, position, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.ring.written >= position, timeout=timeout)
+
+    def next_utterance(
+        self,
+        trailing_silence_sec=TRAILING_SILENCE_SEC,
+        max_utterance_sec=MAX_UTTERANCE_SEC,
+        start_timeout_sec=START_TIMEOUT_SEC,
+        on_speech=None,
+        should_stop=None,
+    ):
+        """
+        前回の続きから次の発話を1つ切り出す。
+
+        on_speech:
+            発話中の音声を少しずつ受け取るコールバック（ストリーミングSTT用）。
+            発話開始時に pre-roll 込みの先頭部分、その後はフレームごとに呼ばれる。
+        should_stop:
+            フレームごとに呼び、True ならそこで切り出しをやめる（呼び出し側のタイムアウト用）。
+
+        戻り値:
+            pre-roll 付きの int16 配列。
+            start_timeout_sec 以内に発話が始まらないか、should_stop でやめたときは長さ0の配列。
+        """
+        if self._stream is None:
+            self.start()
+        try:
+            return self._next_utterance(
+                trailing_silence_sec, max_utterance_sec, start_timeout_sec, on_speech, should_stop
+            )
+        finally:
+            self._force_unmuted = False
+
+    def _next_utterance(
+        self, trailing_silence_sec, max_utterance_sec, start_timeout_sec, on_speech, should_stop
+    ):
+        endpointer = Endpointer(
+            self.frame_sec,
+            trailing_silence_sec=trailing_silence_sec,
+            max_utterance_sec=max_utterance_sec,
+        )
+        deadline = time.monotonic() + start_timeout_sec
+        utterance_start = None
+
+        while True:
+            if should_stop is not None and should_stop():
+                return np.zeros(0, dtype=np.int16)
+
+            # 処理が遅れてバッファが一周した場合は、残っている一番古い位置から再開
+            oldest = self.ring.oldest()
+            if self._cursor < oldest:
+                print("⚠ 録音バッファがあふれました。古い音声を捨てます。")
+                self._cursor = oldest
+                endpointer.reset()
+                utterance_start = None
+
+            frame_end = self._cursor + self.frame_len
+            if not self._wait_for(frame_end, timeout=1.0):
+                raise RuntimeError("マイクからの入力が止まりました")
+
+            frame = self.read(self._cursor, frame_end)
+            event = endpointer.feed(self.vad.is_speech(frame))
+            self._cursor = frame_end
+
+            if event == "start":
+                onset = frame_end - endpointer.voiced_run * self.frame_len
+                utterance_start = max(onset - self.pre_roll, self.ring.oldest())
+                if on_speech:
+                    on_speech(self.read(utterance_start, frame_end))
+            elif endpointer.in_speech and on_speech:
+                on_speech(frame)
+
+            if event == "end":
+                self.last_span = (utterance_start, frame_end)
+                return self.read(utterance_start, frame_end)
+
+            if not endpointer.in_speech and time.monotonic() > deadline:
+                return np.zeros(0, dtype=np.int16)
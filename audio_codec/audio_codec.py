@@ -0,0 +1,127 @@
+import io
+import time
+from math import gcd
+
+import numpy as np
+import scipy.io.wavfile as wav
+from scipy.signal import firwin, resample_poly, upfirdn
+
+try:
+    import soundfile as sf
+except ImportError:  # libsndfile が無い環境では WAV にフォールバック
+    sf = None
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+UPLOAD_SAMPLERATE = 16000     # Whisper は内部で16kHzに落とすので、それ以上は送っても無駄
+UPLOAD_FORMAT = "flac"        # "flac" / "opus" / "wav"
+
+# format名 → (soundfileのformat, subtype, 拡張子, MIMEタイプ)
+_FORMATS = {
+    "flac": ("FLAC", "PCM_16", "flac", "audio/flac"),
+    "opus": ("OGG", "OPUS", "ogg", "audio/ogg"),
+}
+
+
+def resample_int16(samples, samplerate, target_rate=UPLOAD_SAMPLERATE):
+    """int16 モノラルを target_rate にリサンプリングする（メモリ上のみ）"""
+    samples = np.asarray(samples).reshape(-1)
+    if samplerate == target_rate or samples.size == 0:
+        return samples.astype(np.int16, copy=False)
+    g = gcd(int(samplerate), int(target_rate))
+    y = resample_poly(samples.astype(np.float32), target_rate // g, samplerate // g)
+    return np.clip(y, -32768, 32767).astype(np.int16)
+
+
+class StreamResampler:
+    """
+    resample_int16 の少しずつ流す版（ストリーミングSTT用）。
+    30ms ごとの断片を別々に resample_int16 にかけると、断片の両端が 0 埋めになって
+    切れ目ごとにノイズが入る。前の入力を覚えておき、全体を1本の信号として変換する。
+    フィルタは resample_poly と同じもの。そのぶん少し遅れる（48kHz→16kHz で 0.6ms）。
+    """
+
+    def __init__(self, samplerate, target_rate=UPLOAD_SAMPLERATE):
+        g = gcd(int(samplerate), int(target_rate))
+        self.up, self.down = int(target_rate) // g, int(samplerate) // g
+        max_rate = max(self.up, self.down)
+        self.h = None if max_rate == 1 else (
+            firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0)) * self.up
+        ).astype(np.float32)
+        self._buf = np.zeros(0, dtype=np.float32)
+        self._base = 0        # _buf[0] が入力の何サンプル目か（down の倍数）
+        self._total = 0       # これまでに受け取った入力のサンプル数
+        self._emitted = 0     # これまでに返した出力のサンプル数
+
+    def push(self, samples):
+        """int16 モノラルを受け取り、変換できたぶんを int16 で返す"""
+        samples = np.asarray(samples).reshape(-1)
+        if self.h is None:
+            return samples.astype(np.int16, copy=False)
+        up, down, taps = self.up, self.down, len(self.h)
+        self._buf = np.concatenate([self._buf, samples.astype(np.float32)])
+        self._total += samples.size
+
+        # 出力 n に要る入力は n * down / up サンプル目まで。そろっているぶんだけ返す
+        end = -(-self._total * up // down)
+        if end <= self._emitted:
+            return np.zeros(0, dtype=np.int16)
+        offset = self._base * up // down
+        y = upfirdn(self.h, self._buf, up, down)[self._emitted - offset:end - offset]
+        self._emitted = end
+
+        # 次の出力に要らない入力は捨てる（出力の並びがずれないよう down の倍数の位置で切る）
+        needed = max(0, -(-(self._emitted * down - taps + 1) // up))
+        base = needed // down * down
+        if base > self._base:
+            self._buf = self._buf[base - self._base:]
+            self._base = base
+        return np.clip(y, -32768, 32767).astype(np.int16)
+
+
+def _encode_wav(samples, samplerate):
+    buf = io.BytesIO()
+    wav.write(buf, samplerate, samples)
+    return buf, "wav", "audio/wav"
+
+
+def _encode_soundfile(samples, samplerate, fmt):
+    sf_format, subtype, ext, mime = _FORMATS[fmt]
+    buf = io.BytesIO()
+    sf.write(buf, samples, samplerate, format=sf_format, subtype=subtype)
+    return buf, ext, mime
+
+
+def encode_for_upload(samples, samplerate, fmt=UPLOAD_FORMAT, target_rate=UPLOAD_SAMPLERATE):
+    """
+    録音データを 16kHz モノラルに落として圧縮し、BytesIO に入れて返す。
+    SDカードには一切書かない。
+
+    戻り値:
+        (file, stats)
+        file  : OpenAI SDK にそのまま渡せる (ファイル名, BytesIO, MIMEタイプ)
+        stats : {"format", "bytes", "encode_ms", "duration_sec"}
+    """
+    t0 = time.perf_counter()
+    mono = resample_int16(samples, samplerate, target_rate)
+
+    buf = None
+    if fmt in _FORMATS and sf is not None:
+        try:
+            buf, ext, mime = _encode_soundfile(mono, target_rate, fmt)
+        except Exception as e:
+            print(f"⚠ {fmt} エンコード失敗のため WAV で送ります: {e}")
+    if buf is None:
+        buf, ext, mime = _encode_wav(mono, target_rate)
+
+    size = buf.getbuffer().nbytes
+    buf.seek(0)
+    stats = {
+        "format": ext,
+        "bytes": size,
+        "encode_ms": (time.perf_counter() - t0) * 1000,
+        "duration_sec": mono.size / target_rate,
+    }
+    return (f"input.{ext}", buf, mime), stats
@@ -0,0 +1,88 @@
+import threading
+
+import numpy as np
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+LIMIT_THRESHOLD = 0.7     # これ（フルスケール比）を超えた分だけ、なめらかに頭打ちにする
+CHUNK = 4096              # 1回に処理するサンプル数（作業バッファの大きさ）
+
+
+class ScratchPool:
+    """
+    作業用バッファ置き場。同じ大きさ・型なら毎回同じメモリを使い回す。
+    スレッドごとに別のバッファを持つので、再生コールバックと他スレッドでぶつからない。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, name, n, dtype):
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        buf = buffers.get(name)
+        if buf is None or buf.shape[0] < n or buf.dtype != dtype:
+            buf = buffers[name] = np.empty(max(n, CHUNK), dtype=dtype)
+        return buf[:n]
+
+
+_pool = ScratchPool()
+
+
+class GainLimiter:
+    """
+    int16 に倍率をかけ、ソフトリミッターで頭打ちにして int16 に書き戻す。
+    ・作業は float32 の使い回しバッファで行い、処理中に新しい配列を作らない
+    ・チャンク単位なので、再生コールバックの中でストリーミング音声にもかけられる
+    ・threshold を超えた部分は tanh でなめらかに ±1.0 に近づける（ハードクリップの歪みを防ぐ）
+    """
+
+    def __init__(self, gain=1.0, threshold=LIMIT_THRESHOLD, pool=None):
+        self.gain = float(gain)
+        self.threshold = float(threshold)
+        self.pool = pool or _pool
+
+    def process(self, src, out, gain=None):
+        """src(int16) → out(int16)。同じ長さであること。src と out が同じ配列でもよい"""
+        gain = self.gain if gain is None else float(gain)
+        n = src.shape[0]
+        for start in range(0, n, CHUNK):
+            end = min(n, start + CHUNK)
+            self._process_chunk(src[start:end], out[start:end], gain)
+        return out
+
+    def _process_chunk(self, src, out, gain):
+        n = src.shape[0]
+        t = self.threshold
+        x = self.pool.get("x", n, np.float32)
+        a = self.pool.get("a", n, np.float32)
+        mask = self.pool.get("mask", n, np.bool_)
+
+        # x = src * gain / 32768（-1.0〜1.0 を超えうる）
+        np.multiply(src, np.float32(gain / 32768.0), out=x, casting="unsafe")
+        np.abs(x, out=a)
+
+        if a.max(initial=0.0) > t:
+            # |x| > t の部分だけ t + (1 - t) * tanh((|x| - t) / (1 - t)) に置き換える
+            np.greater(a, t, out=mask)
+            np.subtract(a, t, out=a)
+            np.multiply(a, np.float32(1.0 / (1.0 - t)), out=a)
+            np.tanh(a, out=a)
+            np.multiply(a, np.float32(1.0 - t), out=a)
+            np.add(a, np.float32(t), out=a)
+            np.copysign(a, x, out=a)
+            np.copyto(x, a, where=mask)
+
+        np.multiply(x, np.float32(32768.0), out=x)
+        np.rint(x, out=x)
+        np.clip(x, -32768.0, 32767.0, out=x)
+        np.copyto(out, x, casting="unsafe")
+
+
+def apply_gain(pcm, gain, threshold=LIMIT_THRESHOLD):
+    """int16配列に倍率＋ソフトリミッターをかけた新しい配列を返す（一括処理用）"""
+    out = np.empty(pcm.shape[0], dtype=np.int16)
+    return GainLimiter(gain, threshold).process(pcm, out)
@@ -0,0 +1,370 @@
+import io
+import json
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import scipy.io.wavfile as wav
+import sounddevice as sd
+
+from audio_capture import MicRingBuffer, frame_dbfs
+from audio_dsp import GainLimiter
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+SAMPLERATE = 24000       # VoiceVox の出力サンプリングレート
+BLOCKSIZE = 1024         # コールバック1回あたりのサンプル数（約43ms）
+KEEPALIVE_LEVEL = 2      # 待機中に流すごく小さいノイズの振幅（int16。聞こえないレベル）
+WAKE_LATENCY_SEC = 0.6   # スピーカーが寝ていたときの立ち上がり遅延（測定するまでの仮の値）
+SINK_SLEEP_SEC = 5.0     # これ以上何も流さないと、スピーカー側がスリープしたとみなす
+REFERENCE_SEC = 10.0     # 出力した音の控え（エコー除去の参照信号）を何秒ぶん残すか
+
+
+def _wav_data_offset(data):
+    """WAVの data チャンクの (開始位置, 長さ)。見つからなければ None"""
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        size = struct.unpack("<I", data[pos + 4:pos + 8])[0]
+        if chunk_id == b"data":
+            return pos + 8, min(size, len(data) - pos - 8)
+        pos += 8 + size + (size & 1)
+    return None
+
+
+def to_pcm(audio_data):
+    """
+    VoiceVoxのWAV bytes / ヘッダ無しPCM bytes / int16配列 を int16 の1次元配列にする。
+    bytes の場合はヘッダを飛ばしてそのまま参照する（コピーしない）。
+    """
+    if isinstance(audio_data, np.ndarray):
+        return audio_data.reshape(-1).astype(np.int16, copy=False)
+    if audio_data[:4] == b"RIFF":
+        found = _wav_data_offset(audio_data)
+        if found is None:
+            _, samples = wav.read(io.BytesIO(audio_data))
+            return samples.reshape(-1) if samples.ndim == 1 else samples[:, 0]
+        offset, size = found
+        return np.frombuffer(audio_data, dtype="<i2", count=size // 2, offset=offset)
+    return np.frombuffer(audio_data, dtype=np.int16)
+
+
+class Fragment:
+    """
+    キューに積んだ1つ分の音声。started / done で再生の進み具合がわかる。
+    先頭の無音（lead_in）と音量（gain）は再生コールバックの中で付けるので、
+    元のPCMはコピーも加工もしない。
+    """
+
+    def __init__(self, pcm, gain=1.0, lead_in=0):
+        self.pcm = pcm
+        self.gain = gain
+        self.lead_in = int(lead_in)
+        self.length = self.lead_in + pcm.shape[0]
+        self.pos = 0
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.started_at = None    # 最初のサンプル（無音含む）を出力バッファへ書いた時刻（time.monotonic）
+        self.finished_at = None
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+class PlaybackEngine:
+    """
+    sounddevice.OutputStream を開きっぱなしにして、メモリ上のPCMをそのまま流す再生エンジン。
+    ・aplay の起動やALSAデバイスのオープンを毎回しない
+    ・一時ファイルを作らない
+    ・enqueue() で積んだ音声は隙間なく順番に再生される
+    """
+
+    def __init__(
+        self,
+        samplerate=SAMPLERATE,
+        device=None,
+        blocksize=BLOCKSIZE,
+        keepalive=False,
+        wake_latency_sec=WAKE_LATENCY_SEC,
+        sink_sleep_sec=SINK_SLEEP_SEC,
+    ):
+        self.samplerate = samplerate
+        self.device = device
+        self.blocksize = blocksize
+        self._queue = deque()
+        self._current = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._stream = None
+        self.last_audio_at = 0.0      # 最後に本物の音声を出した時刻
+        self.last_output_at = 0.0     # 最後にスピーカーが起きている信号を出した時刻（keepalive含む）
+        self._awake_since = 0.0       # スピーカーへ途切れずに信号を出し始めた時刻
+
+        # keepalive: 待機中もごく小さいノイズを流し続けて、Bluetoothスピーカーを寝かせない
+        # （完全なデジタル無音だとスリープするスピーカーがあるため 0 ではなくノイズ）
+        self.keepalive = keepalive
+        self.wake_latency_sec = wake_latency_sec
+        self.sink_sleep_sec = sink_sleep_sec
+        rng = np.random.default_rng(0)
+        self._keepalive_noise = rng.integers(
+            -KEEPALIVE_LEVEL, KEEPALIVE_LEVEL + 1, size=blocksize * 4, dtype=np.int16
+        )
+        self._keepalive_pos = 0
+        self._limiter = GainLimiter()
+
+        # 実際に出力した音（音量調整後）の控え。割り込み検出のエコー除去で参照信号に使う
+        self.reference = MicRingBuffer(int(samplerate * REFERENCE_SEC))
+        self._last_callback = (0.0, 0)
+
+    # ---------- ストリーム ----------
+    def start(self):
+        if self._stream is not None:
+            return
+        self._stream = sd.OutputStream(
+            samplerate=self.samplerate,
+            device=self.device,
+            channels=1,
+            dtype="int16",
+            blocksize=self.blocksize,
+            callback=self._callback,
+        )
+        self._stream.start()
+
+    def close(self):
+        if self._stream is None:
+            return
+        try:
+            self._stream.stop()
+            self._stream.close()
+        finally:
+            self._stream = None
+
+    @property
+    def latency(self):
+        """出力バッファ分の遅れ（秒）"""
+        return float(self._stream.latency) if self._stream is not None else 0.0
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status:
+            print("⚠ 再生ステータス:", status)
+        out = outdata[:, 0]
+        filled = 0
+        now = time.monotonic()
+        if now - self.last_output_at > self.sink_sleep_sec:
+            self._awake_since = now
+        with self._lock:
+            while filled < frames:
+                frag = self._current
+                if frag is None:
+                    if not self._queue:
+                        break
+                    frag = self._current = self._queue.popleft()
+                    frag.started_at = now
+                    frag.started.set()
+
+                n = min(frames - filled, frag.length - frag.pos)
+                self._render(frag, out[filled:filled + n])
+                frag.pos += n
+                filled += n
+
+                if frag.pos >= frag.length:
+                    frag.finished_at = now
+                    frag.done.set()
+                    self._current = None
+
+            if filled:
+                self.last_audio_at = now
+                self.last_output_at = now
+            if self._current is None and not self._queue:
+                self._idle.notify_all()
+
+        rest = frames - filled
+        if rest and self.keepalive:
+            noise = self._keepalive_noise
+            start = self._keepalive_pos
+            if start + rest > noise.shape[0]:
+                start = 0
+            out[filled:] = noise[start:start + rest]
+            self._keepalive_pos = start + rest
+            self.last_output_at = now
+        else:
+            out[filled:] = 0
+
+        self.reference.write(out)
+        self._last_callback = (now, self.reference.written)
+
+    def _render(self, frag, out):
+        """frag の現在位置から len(out) サンプル分を out に書く（無音 → 音量調整済みPCM）"""
+        n = out.shape[0]
+        silent = min(n, max(0, frag.lead_in - frag.pos))
+        if silent:
+            out[:silent] = 0
+        if silent == n:
+            return
+        src_start = frag.pos + silent - frag.lead_in
+        src = frag.pcm[src_start:src_start + n - silent]
+        if frag.gain == 1.0:
+            out[silent:] = src
+        else:
+            self._limiter.process(src, out[silent:], gain=frag.gain)
+
+    # ---------- 公開API ----------
+    def enqueue(self, audio_data, gain=1.0, lead_in_sec=0.0):
+        """
+        音声を再生キューに積んで、すぐに Fragment を返す。
+        gain は再生時にソフトリミッター付きでかける。lead_in_sec は先頭に入れる無音。
+        """
+        self.start()
+        frag = Fragment(
+            to_pcm(audio_data), gain=gain, lead_in=lead_in_sec * self.samplerate
+        )
+        if frag.pcm.size == 0:
+            frag.started.set()
+            frag.done.set()
+            return frag
+        with self._lock:
+            self._queue.append(frag)
+        return frag
+
+    def play(self, audio_data, wait=True, gain=1.0, lead_in_sec=0.0):
+        """積んで、wait=True なら鳴り終わるまで待つ"""
+        frag = self.enqueue(audio_data, gain=gain, lead_in_sec=lead_in_sec)
+        if wait:
+            frag.wait()
+            time.sleep(self.latency)   # 出力バッファに残っている分が鳴り終わるまで
+        return frag
+
+    def lead_in_sec(self):
+        """
+        次の音声の前に入れる無音の長さ。
+        スピーカーがスリープしていそうなとき（ストリーム未開始・長く何も流していない）だけ
+        測定した立ち上がり遅延ぶん入れ、起きているなら 0。
+        起こし始めたばかりなら、残りの分だけ入れる。
+        """
+        now = time.monotonic()
+        if self._stream is None or now - self.last_output_at > self.sink_sleep_sec:
+            return self.wake_latency_sec
+        return max(0.0, self.wake_latency_sec - (now - self._awake_since))
+
+    def reference_position_at(self, t):
+        """time.monotonic() の時刻 t にスピーカーから出ている音の、reference 上の通算位置（おおよそ）"""
+        t_last, written = self._last_callback
+        return int(written - self.blocksize + (t - t_last - self.latency) * self.samplerate)
+
+    def is_playing(self):
+        """本物の音声（keepalive のノイズではなく）を再生中か"""
+        with self._lock:
+            return self._current is not None or bool(self._queue)
+
+    def is_busy(self, tail_sec=0.0):
+        """再生中、または最後の音を出してから tail_sec 以内か"""
+        if self.is_playing():
+            return True
+        return time.monotonic() - self.last_audio_at < tail_sec + self.latency
+
+    def wait_idle(self, timeout=None):
+        """キューが空になり、最後の音が鳴り終わるまで待つ"""
+        with self._idle:
+            ok = self._idle.wait_for(
+                lambda: self._current is None and not self._queue, timeout=timeout
+            )
+        if ok:
+            time.sleep(self.latency)
+        return ok
+
+    def clear(self):
+        """再生中・待ち中の音声をすべて止める"""
+        with self._lock:
+            dropped = list(self._queue)
+            if self._current is not None:
+                dropped.append(self._current)
+            self._queue.clear()
+            self._current = None
+            self._idle.notify_all()
+        for frag in dropped:
+            frag.started.set()
+            frag.done.set()
+        return len(dropped)
+
+
+def play_wav_file(path, device=None):
+    """WAVファイルを1回だけ再生する（起動アナウンスなど）"""
+    samplerate, samples = wav.read(path)
+    if samples.dtype.kind == "f":
+        samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    engine = PlaybackEngine(samplerate=samplerate, device=device)
+    try:
+        engine.play(samples if samples.ndim == 1 else samples[:, 0])
+    finally:
+        engine.close()
+
+
+# =========================
+# スピーカーの立ち上がり遅延の測定
+# =========================
+def _tone(samplerate, sec=0.12, freq=880.0, level=0.25):
+    t = np.arange(int(samplerate * sec)) / samplerate
+    fade = np.minimum(1.0, np.minimum(t, t[-1] - t) / 0.01)
+    return (np.sin(2 * np.pi * freq * t) * fade * level * 32767).astype(np.int16)
+
+
+def _onset_delay(engine, capture, fragment, search_sec=2.0, margin_db=20.0):
+    """fragment が出力されてから、マイクで聞こえるまでの秒数（見つからなければNone）"""
+    fragment.wait()
+    time.sleep(search_sec)
+    start = capture.position_at(fragment.started_at)
+    audio = capture.ring.read(start, start + int(search_sec * capture.samplerate))
+    frame = capture.frame_len
+    levels = [
+        frame_dbfs(audio[i:i + frame]) for i in range(0, audio.size - frame + 1, frame)
+    ]
+    if not levels:
+        return None
+    floor = float(np.percentile(levels, 20))
+    for i, db in enumerate(levels):
+        if db > floor + margin_db:
+            return i * frame / capture.samplerate
+    return None
+
+
+def measure_wake_latency(engine, capture, cold_wait_sec=0.0):
+    """
+    スピーカーが寝ている状態で短い音を鳴らし、マイクで聞こえるまでの遅れを測る。
+    続けてもう1回（起きている状態で）鳴らし、その差を「立ち上がり遅延」とする。
+    マイク→スピーカーの距離や出力バッファ分の遅れは差し引かれる。
+
+    capture は audio_capture.ContinuousCapture（録音中であること）。
+    戻り値: 秒。測れなかったときは None。
+    """
+    tone = _tone(engine.samplerate)
+    saved = capture.mute_source
+    capture.mute_source = None     # 測定中は自分の音を聞く
+    try:
+        time.sleep(cold_wait_sec)
+        cold = _onset_delay(engine, capture, engine.enqueue(tone))
+        warm = _onset_delay(engine, capture, engine.enqueue(tone))
+    finally:
+        capture.mute_source = saved
+    if cold is None or warm is None:
+        print(f"⚠ 立ち上がり遅延を測定できませんでした（cold={cold}, warm={warm}）")
+        return None
+    wake = max(0.0, cold - warm)
+    print(f"🔈 スピーカー立ち上がり遅延: {wake * 1000:.0f}ms (cold={cold * 1000:.0f}ms, warm={warm * 1000:.0f}ms)")
+    return wake
+
+
+def load_wake_latency(path, default=WAKE_LATENCY_SEC):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return float(json.load(f)["wake_latency_sec"])
+    except (OSError, ValueError, KeyError):
+        return default
+
+
+def save_wake_latency(path, wake_latency_sec):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"wake_latency_sec": wake_latency_sec, "measured_at": time.time()}, f)
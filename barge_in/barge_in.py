@@ -0,0 +1,295 @@
+"""
+割り込み（barge-in）検出。
+
+ニコの再生中もマイクを聞き続け、再生している音（参照信号）から
+マイクに回り込んだエコーを差し引いた「残り」に子どもの声があるかを判定する。
+
+マイク音声と参照信号のWAVがあれば、オーディオ機器なしで試せる:
+    python barge_in.py mic.wav reference.wav
+
+fixtures/ の録音（回り込みだけ・声が重なる・無音）で判定を確かめる:
+    python check_fixtures.py
+"""
+import argparse
+import threading
+import time
+from math import gcd
+
+import numpy as np
+import scipy.io.wavfile as wav
+from scipy.signal import resample_poly
+
+from audio_capture import EnergyVAD, frame_dbfs
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+PROCESS_RATE = 16000        # エコー除去・判定はこのレートで行う
+FRAME_MS = 20
+MAX_DELAY_SEC = 0.5         # 再生してからマイクに届くまでの遅れの最大（Bluetoothの遅れ込み）
+MIN_SPEECH_SEC = 0.2        # これだけ声が続いたら割り込みとみなす
+ECHO_MARGIN_DB = 6.0        # エコーを引いた残りが、いつもの消え残りよりこれだけ大きければ子どもの声
+DELAY_UPDATE_CORR = 0.6     # 遅れ・ゲインの推定を更新する相関のしきい値（エコーだけが鳴っているとき）
+MIN_UPDATE_DB = -40.0       # これより小さいマイク音では推定を更新しない（偶然の相関で遅れが跳ぶため）
+MAX_ECHO_GAIN = 4.0
+DELAY_TOLERANCE_SEC = 0.002 # 推定した遅れがこれ以内のずれなら同じ遅れとみなす
+DELAY_SWITCH_FRAMES = 3     # 別の遅れに乗り換えるのは、続けてこのフレーム数同じ遅れが出たときだけ
+
+
+def _resample(x, rate, target):
+    if rate == target:
+        return x.astype(np.float32)
+    g = gcd(int(rate), int(target))
+    return resample_poly(x.astype(np.float32), target // g, rate // g).astype(np.float32)
+
+
+class EchoSuppressor:
+    """
+    参照信号を使うフレーム単位のエコー抑圧。
+    ・参照信号とマイクの相互相関で「遅れ」と「エコーの大きさ（ゲイン）」を推定する
+    ・推定の更新は相関が高いフレーム（ほぼエコーだけのとき）に限る。子どもの声が
+      重なったフレームで推定がずれると、声ごと引き算してしまうため
+    ・声は倍音でできているので、短いフレームでは別の遅れ（ピッチ周期の倍数）でも相関が
+      高くなることがある。いまの遅れから離れた遅れには、何フレームか続けて出たときだけ乗り換える
+    ・その遅れ・ゲインの参照信号をマイクから引き算する
+    """
+
+    def __init__(self, samplerate=PROCESS_RATE, max_delay_sec=MAX_DELAY_SEC):
+        self.max_delay = int(samplerate * max_delay_sec)
+        self.tolerance = int(samplerate * DELAY_TOLERANCE_SEC)
+        self.reset()
+
+    def reset(self):
+        self.delay = None
+        self.gain = None
+        self._candidate = None      # 乗り換え先の候補の遅れ
+        self._candidate_frames = 0
+
+    def _normalized_corr(self, mic, ref_window):
+        n = mic.shape[0]
+        corr = np.correlate(ref_window, mic, mode="valid")        # corr[k] = Σ ref[k+i]·mic[i]
+        energy = np.cumsum(np.concatenate(([0.0], ref_window * ref_window)))
+        window_energy = energy[n:] - energy[:-n]
+        norm = np.sqrt(window_energy * float(np.dot(mic, mic))) + 1e-9
+        return corr / norm
+
+    def _update(self, mic, ref_window):
+        n = mic.shape[0]
+        if frame_dbfs(mic) < MIN_UPDATE_DB:
+            return
+        ncorr = self._normalized_corr(mic, ref_window)
+        k = int(np.argmax(ncorr))
+        if ncorr[k] < DELAY_UPDATE_CORR:
+            return
+        delay = self.max_delay - k
+        ref = ref_window[k:k + n]
+        gain = float(np.dot(mic, ref)) / (float(np.dot(ref, ref)) + 1e-9)
+        gain = min(max(gain, 0.0), MAX_ECHO_GAIN)
+
+        if self.delay is not None and abs(delay - self.delay) > self.tolerance:
+            if self._candidate is not None and abs(delay - self._candidate) <= self.tolerance:
+                self._candidate_frames += 1
+            else:
+                self._candidate, self._candidate_frames = delay, 1
+            if self._candidate_frames < DELAY_SWITCH_FRAMES:
+                return
+            self.gain = None        # 遅れが変わったらゲインも測り直す
+        self._candidate, self._candidate_frames = None, 0
+        self.delay = delay
+        self.gain = gain if self.gain is None else 0.8 * self.gain + 0.2 * gain
+
+    def process(self, mic, ref_window):
+        """
+        mic        : 1フレーム分（float32）
+        ref_window : 同じ時刻までの参照信号（長さ max_delay + len(mic)。末尾がマイクと同時刻）
+
+        戻り値: (エコーを引いた残り, 推定エコーの dBFS)。エコーが推定できないときは (mic, None)
+        """
+        n = mic.shape[0]
+        if float(np.dot(ref_window, ref_window)) / ref_window.shape[0] < 1.0:
+            return mic, -120.0        # 何も鳴っていない
+
+        self._update(mic, ref_window)
+        if self.delay is None:
+            return mic, None
+
+        k = self.max_delay - self.delay
+        echo = self.gain * ref_window[k:k + n]
+        return mic - echo, frame_dbfs(echo)
+
+
+class BargeInDetector:
+    """
+    エコーを引いた残りにVADをかけ、声が MIN_SPEECH_SEC 続いたら割り込みとする。
+
+    1フレームの引き算ではエコーは消しきれないので、「いつもの消え残り」
+    （残り − 推定エコー の dB差）をゆっくり追いかけておき、それより
+    echo_margin_db 以上大きいときだけ声とみなす。
+    """
+
+    def __init__(
+        self,
+        samplerate=PROCESS_RATE,
+        frame_ms=FRAME_MS,
+        max_delay_sec=MAX_DELAY_SEC,
+        min_speech_sec=MIN_SPEECH_SEC,
+        echo_margin_db=ECHO_MARGIN_DB,
+        vad=None,
+    ):
+        self.samplerate = samplerate
+        self.frame_len = int(samplerate * frame_ms / 1000)
+        self.max_delay = int(samplerate * max_delay_sec)
+        self.min_frames = max(1, int(round(min_speech_sec * 1000 / frame_ms)))
+        self.echo_margin_db = echo_margin_db
+        self.suppressor = EchoSuppressor(samplerate, max_delay_sec)
+        self.vad = vad or EnergyVAD()
+        self.reset()
+
+    def reset(self):
+        self.run = 0
+        self.misses = 0
+        self.leftover_db = 0.0
+        self.suppressor.reset()
+
+    def process(self, mic, ref_window):
+        """1フレーム処理して、割り込みが確定したら True"""
+        residual, echo_db = self.suppressor.process(mic, ref_window)
+        if echo_db is None:
+            speech = False            # エコーの遅れが分かるまでは判定しない
+        else:
+            speech = self.vad.is_speech(residual)
+            if echo_db > -100:
+                leftover = frame_dbfs(residual) - echo_db
+                if not (speech and leftover > self.leftover_db + self.echo_margin_db):
+                    speech = False
+                    self.leftover_db = 0.95 * self.leftover_db + 0.05 * leftover
+
+        # 1フレームだけ途切れても続いているとみなす
+        if speech:
+            self.run += 1 + self.misses
+            self.misses = 0
+        elif self.run and self.misses == 0:
+            self.misses = 1
+        else:
+            self.run = 0
+            self.misses = 0
+        return self.run >= self.min_frames
+
+
+def detect_barge_in(mic, mic_rate, ref, ref_rate, detector=None):
+    """
+    録音済みのマイク音声と参照信号（同じ時刻から始まるもの）で割り込みを探す。
+    戻り値: 子どもが話し始めた時刻（秒）。割り込みがなければ None。
+    """
+    detector = detector or BargeInDetector()
+    mic = _resample(np.asarray(mic).reshape(-1), mic_rate, detector.samplerate)
+    ref = _resample(np.asarray(ref).reshape(-1), ref_rate, detector.samplerate)
+    n = detector.frame_len
+    pad = np.zeros(detector.max_delay, dtype=np.float32)
+    ref = np.concatenate([pad, ref, np.zeros(max(0, mic.shape[0] - ref.shape[0]), np.float32)])
+
+    for start in range(0, mic.shape[0] - n + 1, n):
+        window = ref[start:start + detector.max_delay + n]
+        if detector.process(mic[start:start + n], window):
+            onset = start + n - detector.run * n
+            return onset / detector.samplerate
+    return None
+
+
+def detect_barge_in_wav(mic_path, ref_path):
+    mic_rate, mic = wav.read(mic_path)
+    ref_rate, ref = wav.read(ref_path)
+    if mic.ndim > 1:
+        mic = mic[:, 0]
+    if ref.ndim > 1:
+        ref = ref[:, 0]
+    return detect_barge_in(mic, mic_rate, ref, ref_rate)
+
+
+class BargeInMonitor:
+    """
+    再生中だけマイクのリングバッファと再生エンジンの参照信号を読み、割り込みを見張るスレッド。
+    割り込みを検出したら on_barge_in(話し始めた位置) を呼ぶ（位置はマイクの通算サンプル数）。
+
+    capture : audio_capture.ContinuousCapture
+    engine  : audio_output.PlaybackEngine
+    """
+
+    def __init__(self, capture, engine, on_barge_in, detector=None):
+        self.capture = capture
+        self.engine = engine
+        self.on_barge_in = on_barge_in
+        self.detector = detector or BargeInDetector()
+        rate = self.detector.samplerate
+        self.mic_frame = int(capture.samplerate * self.detector.frame_len / rate)
+        self.ref_len = int(engine.samplerate * (self.detector.max_delay + self.detector.frame_len) / rate)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def _fit(self, x, n):
+        if x.shape[0] >= n:
+            return x[-n:]
+        return np.concatenate([np.zeros(n - x.shape[0], np.float32), x])
+
+    def _run(self):
+        det = self.detector
+        pos = self.capture.ring.written
+        playing = False
+        while self._running:
+            if not self.engine.is_playing():
+                if playing:
+                    det.reset()
+                    playing = False
+                time.sleep(0.02)
+                pos = self.capture.ring.written
+                continue
+            playing = True
+
+            end = pos + self.mic_frame
+            if self.capture.ring.written < end:
+                time.sleep(0.005)
+                continue
+            mic = self.capture.ring.read(pos, end)
+            ref_end = self.engine.reference_position_at(self.capture.time_at(end))
+            ref = self.engine.reference.read(ref_end - self.ref_len, ref_end)
+            pos = end
+
+            mic = self._fit(_resample(mic, self.capture.samplerate, det.samplerate), det.frame_len)
+            ref = self._fit(
+                _resample(ref, self.engine.samplerate, det.samplerate), det.max_delay + det.frame_len
+            )
+            if det.process(mic, ref):
+                onset = end - det.run * self.mic_frame
+                det.reset()
+                try:
+                    self.on_barge_in(onset)
+                except Exception as e:
+                    print("⚠ 割り込み処理エラー:", e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="録音WAVで割り込み検出を試す")
+    parser.add_argument("mic", help="マイク音声のWAV")
+    parser.add_argument("reference", help="同じ時刻から始まる再生音（参照信号）のWAV")
+    args = parser.parse_args()
+
+    onset = detect_barge_in_wav(args.mic, args.reference)
+    if onset is None:
+        print("🙊 割り込みなし")
+    else:
+        print(f"✋ 割り込み検出: {onset:.2f}秒")
+
+
+if __name__ == "__main__":
+    main()
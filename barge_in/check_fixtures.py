@@ -0,0 +1,59 @@
+"""
+fixtures/ の録音WAVで割り込み検出を確かめる（オーディオ機器なしで動く）。
+
+    回り込みだけ        → 割り込みなし
+    回り込み＋子どもの声 → 割り込みあり（話し始めの時刻の近くで）
+    部屋の音だけ        → 割り込みなし
+
+ひとつでも外れたら終了コード 1。fixtures/ が無ければ make_fixtures.py で作る。
+
+使い方:
+    python check_fixtures.py
+"""
+import sys
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+REPO = HERE.parent
+for name in ("audio_capture", "turn_trace"):
+    sys.path.insert(0, str(REPO / name))
+
+try:
+    import sounddevice  # noqa: F401
+except OSError:
+    # PortAudio の無い環境では audio_capture の import が通ればよいので代役を使う
+    sys.path.insert(0, str(REPO / "benchmarks" / "fake_devices"))
+
+from barge_in import detect_barge_in_wav  # noqa: E402
+from make_fixtures import FIXTURES_DIR, SPEECH_START_SEC, make_fixtures  # noqa: E402
+
+ONSET_TOLERANCE_SEC = 0.3  # 検出した話し始めと、実際の話し始めのずれの許容
+
+# mic のWAV → 割り込みの話し始め（秒）。None は割り込みなし
+EXPECTED = {
+    "mic_echo_only.wav": None,
+    "mic_speech_over_echo.wav": SPEECH_START_SEC,
+    "mic_silence.wav": None,
+}
+
+
+def check(fixtures_dir=FIXTURES_DIR):
+    if not (fixtures_dir / "reference.wav").exists():
+        make_fixtures(fixtures_dir)
+
+    failures = 0
+    for name, expected in EXPECTED.items():
+        onset = detect_barge_in_wav(fixtures_dir / name, fixtures_dir / "reference.wav")
+        if expected is None:
+            ok = onset is None
+        else:
+            ok = onset is not None and abs(onset - expected) <= ONSET_TOLERANCE_SEC
+        got = "なし" if onset is None else f"{onset:.2f}秒"
+        want = "なし" if expected is None else f"{expected:.2f}秒"
+        print(f"{'✅' if ok else '❌'} {name}: 割り込み {got}（期待 {want}）")
+        failures += not ok
+    return failures == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check() else 1)
@@ -0,0 +1,102 @@
+"""
+割り込み検出の確認用WAV（fixtures/）を作る。
+
+オーディオ機器なしで barge_in.py を試せるように、再生音（参照信号）と
+マイク録音の組を作る。乱数の種は固定なので、何度作っても同じWAVになる。
+
+    reference.wav            : ニコの声（再生した音）
+    mic_echo_only.wav        : 再生音がマイクに回り込んだだけ（割り込みなし）
+    mic_speech_over_echo.wav : 回り込みの途中（1.2秒〜）で子どもが話しかける（割り込みあり）
+    mic_silence.wav          : 何も鳴っていない部屋の音（割り込みなし）
+
+使い方:
+    python make_fixtures.py
+"""
+from pathlib import Path
+
+import numpy as np
+import scipy.io.wavfile as wav
+from scipy.signal import lfilter, resample_poly
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+REF_RATE = 24000           # VoiceVox の出力と同じ
+MIC_RATE = 16000
+LENGTH_SEC = 3.0
+ECHO_DELAY_SEC = 0.12      # 再生してからマイクに届くまで（Bluetoothスピーカー）
+ECHO_GAIN = 0.5
+SPEECH_START_SEC = 1.2     # 子どもが話し始める時刻
+SPEECH_SEC = 1.0
+NOISE_LEVEL = 30           # 部屋のノイズ（int16）
+SEED = 0
+
+
+def voice(rate, seconds, f0, level, rng):
+    """
+    倍音＋抑揚＋音節ごとの切れ目がある、声っぽい音。
+    音節の長さ・間・高さは乱数で揺らす（同じ形がくり返すと、遅れの推定が別の音節に合ってしまう）
+    """
+    n = int(rate * seconds)
+    envelope = np.zeros(n)
+    pitch = np.full(n, float(f0))
+    i = 0
+    while i < n:
+        length = int(rate * rng.uniform(0.08, 0.22))
+        ramp = np.sin(np.linspace(0, np.pi, length)) ** 0.5
+        envelope[i:i + length] = ramp[:n - i] * rng.uniform(0.6, 1.0)
+        pitch[i:i + length] = f0 * rng.uniform(0.85, 1.2)
+        i += length + int(rate * rng.uniform(0.02, 0.12))
+    t = np.arange(n) / rate
+    pitch *= 1 + 0.05 * np.sin(2 * np.pi * 5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / rate
+    x = np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.3 * np.sin(3 * phase) + 0.15 * np.sin(4 * phase)
+    return (x * envelope * level).astype(np.float32)
+
+
+def room(x, rate):
+    """スピーカーとマイクの間の部屋（高域が落ちて、少し反射が混ざる）"""
+    y = lfilter([0.3], [1.0, -0.7], x)
+    for delay_sec, gain in ((0.011, 0.25), (0.023, 0.12)):
+        d = int(rate * delay_sec)
+        y[d:] += gain * y[:-d]
+    return y
+
+
+def make_fixtures(out_dir=FIXTURES_DIR):
+    rng = np.random.default_rng(SEED)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # ニコの声。最後の0.3秒は鳴らし終わり
+    reference = np.zeros(int(REF_RATE * LENGTH_SEC), np.float32)
+    nico = voice(REF_RATE, LENGTH_SEC - 0.3, 280, 6000, rng)
+    reference[:nico.shape[0]] = nico
+
+    # マイクに届く回り込み（マイクのレートで、遅れて小さく）
+    echo = resample_poly(reference, MIC_RATE, REF_RATE)
+    delay = int(MIC_RATE * ECHO_DELAY_SEC)
+    echo = np.concatenate([np.zeros(delay, np.float32), echo[:-delay]])
+    echo = room(echo * ECHO_GAIN, MIC_RATE)
+
+    n = echo.shape[0]
+    noise = rng.normal(0, NOISE_LEVEL, n)
+
+    child = np.zeros(n, np.float32)
+    start = int(MIC_RATE * SPEECH_START_SEC)
+    speech = voice(MIC_RATE, SPEECH_SEC, 380, 5000, rng)
+    child[start:start + speech.shape[0]] = speech
+
+    def write(name, rate, x):
+        wav.write(out_dir / name, rate, np.clip(x, -32768, 32767).astype(np.int16))
+
+    write("reference.wav", REF_RATE, reference)
+    write("mic_echo_only.wav", MIC_RATE, echo + noise)
+    write("mic_speech_over_echo.wav", MIC_RATE, echo + child + noise)
+    write("mic_silence.wav", MIC_RATE, noise)
+    print(f"✅ {out_dir} に作りました")
+
+
+if __name__ == "__main__":
+    make_fixtures()
@@ -0,0 +1,232 @@
+"""
+Pico へのコマンド送信（ble_sender_pico）のベンチマーク。
+
+本物の BleakClient の代わりに代役をつなぎ、send_cmd をまとめて呼んだとき（バースト）の
+・1秒あたり何コマンド書けるか
+・積んでから書き込みを始めるまで（queue）/ 書き込み（write）/ 積んでから書き終わるまで（total）
+・まとめた・捨てた・期限切れのコマンドの数
+を、BLE_WRITE_RESPONSE=True（いつも応答あり）と False（動きだけ応答なし）で比べる。
+送信の仕組み（優先度・まとめ・期限）は本物のまま。STOP などはどちらでも応答ありで書く。
+
+代役の書き込み時間（BLE は接続イベントごとにしか送れない）:
+    応答なし: 次の接続イベントまで（0〜接続間隔）
+    応答あり: 次の接続イベント＋Pico の返事が載るイベント（接続間隔 1〜2 つぶん）
+
+パターン:
+    raw    : 動きを1つずつ（書き終わってから次を積むので、まとめが効かない。素の書き込みの速さ）
+    motion : 振り付け・STOP の混ざった実際に近い並び（まとめ・STOP の追い越しが効く）
+
+使い方:
+    python bench_ble.py
+    python bench_ble.py --interval-ms 50 --burst 50 --pattern raw
+"""
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import random
+import sys
+import time
+import types
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO / "turn_trace"))
+
+from turn_trace import percentile, tracer  # noqa: E402
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+INTERVAL_MS = 30.0          # 接続間隔（Pico W と Pi の組み合わせでよくある値）
+BURST = 20                  # 1回のバーストで積むコマンド数
+BURSTS = 10
+BURST_GAP_SEC = 0.5         # バーストの間
+MOTION_PATTERN = ["SEQ:F2,W0.1,R2", "SEQ:F1.5", "STOP", "SEQ:F2", "LED:1", "STOP"]
+
+
+# =========================
+# 代役の BLE
+# =========================
+class FakeCharacteristic:
+    uuid = "fake-write"
+    properties = ["write", "write-without-response"]
+
+
+class FakeServices:
+    def get_characteristic(self, uuid):
+        return FakeCharacteristic()
+
+
+class FakeBleakClient:
+    """接続間隔ごとにしか送れない、という BLE の待ち方だけをまねる"""
+
+    interval = INTERVAL_MS / 1000
+    rng = random.Random(0)
+
+    def __init__(self, device, disconnected_callback=None, **kwargs):
+        self.is_connected = False
+        self.services = FakeServices()
+        self.mtu_size = 23
+        self._disconnected_callback = disconnected_callback
+        self._lock = None
+
+    async def connect(self, timeout=None):
+        await asyncio.sleep(self.interval * 3)
+        self._lock = asyncio.Lock()
+        self.is_connected = True
+
+    async def disconnect(self):
+        if self.is_connected:
+            self.is_connected = False
+            if self._disconnected_callback:
+                self._disconnected_callback(self)
+
+    async def write_gatt_char(self, char, data, response=True):
+        # 1つの接続イベントで送れるのは1パケット（書き込みは1本ずつ）
+        async with self._lock:
+            wait = self.rng.uniform(0, self.interval)
+            if response:
+                wait += self.interval
+            await asyncio.sleep(wait)
+
+    async def get_rssi(self):
+        return -60 + self.rng.randint(-5, 5)
+
+
+class FakeBleakScanner:
+    @staticmethod
+    async def find_device_by_address(address, timeout=None):
+        await asyncio.sleep(0.05)
+        return types.SimpleNamespace(address=address, details={})
+
+
+_instances = itertools.count()
+
+
+def load_sender(response):
+    """
+    代役の bleak / config で ble_sender_pico を読み込む（設定は import 時に読まれる）。
+    送信ループのスレッドがモジュールの変数を使うので、モードごとに別の名前で読み込む。
+    """
+    sys.modules["bleak"] = types.SimpleNamespace(BleakClient=FakeBleakClient, BleakScanner=FakeBleakScanner)
+    sys.modules["config"] = types.SimpleNamespace(
+        PICO_MAC="00:00:00:00:00:00", WRITE_UUID="fake-write",
+        BLE_WRITE_RESPONSE=response, BLE_KEEPALIVE_SEC=1.0, BLE_LINK_SAMPLE_SEC=None,
+    )
+    spec = importlib.util.spec_from_file_location(
+        f"ble_sender_pico_{next(_instances)}", REPO / "ble_sender_pico" / "ble_sender_pico.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# =========================
+# 計測
+# =========================
+def settled(stats, expected):
+    """積んだコマンドが、送った・まとめた・捨てた・期限切れ・失敗のどれかになったか"""
+    done = sum(stats[k] for k in ("sent", "dropped", "coalesced", "late", "failed"))
+    return done >= expected
+
+
+def run_mode(response, pattern, burst, bursts, gap):
+    ble = load_sender(response)
+    ble.connect_early()
+    deadline = time.monotonic() + 5
+    while ble.stats()["connects"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    writes = []
+    listener = lambda entry: writes.append(entry) if entry["stage"] == "ble" else None  # noqa: E731
+    tracer.listeners.append(listener)
+    try:
+        sent = 0
+        burst_spans = []
+        for b in range(bursts):
+            first = len(writes)
+            t0 = time.monotonic()
+            if pattern == "raw":
+                for i in range(burst):
+                    ble.send_cmd(f"SEQ:F{i % 9 + 1}")
+                    sent += 1
+                    while not settled(ble.stats(), sent):
+                        time.sleep(0.001)
+            else:
+                for i in range(burst):
+                    ble.send_cmd(MOTION_PATTERN[i % len(MOTION_PATTERN)])
+                sent += burst
+                while not settled(ble.stats(), sent):
+                    time.sleep(0.001)
+            if len(writes) > first:
+                burst_spans.append((len(writes) - first, time.monotonic() - t0))
+            time.sleep(gap)
+    finally:
+        tracer.listeners.remove(listener)
+
+    stats = ble.stats()
+    written = sum(n for n, _ in burst_spans)
+    busy = sum(sec for _, sec in burst_spans)
+    result = {
+        "response": response,
+        "pattern": pattern,
+        "enqueued": sent,
+        "written": written,
+        "throughput_per_sec": round(written / busy, 1) if busy else None,
+        "counters": {k: stats[k] for k in ("sent", "coalesced", "dropped", "late", "failed")},
+    }
+    for name, key in (("queue", "queue_ms"), ("write", "write_ms"), ("total", "ms")):
+        values = sorted(w[key] for w in writes)
+        result[f"{name}_ms"] = {
+            f"p{p}": None if not values else round(percentile(values, p), 1) for p in (50, 95, 99)
+        }
+    return result
+
+
+def print_result(r):
+    mode = "応答あり" if r["response"] else "動きは応答なし"
+    c = r["counters"]
+    print(
+        f"🔁 {mode} / {r['pattern']}: 積んだ {r['enqueued']} → 書いた {c['sent']}"
+        f"（まとめた {c['coalesced']}・STOP で捨てた {c['dropped']}・期限切れ {c['late']}・失敗 {c['failed']}）"
+        f"  {r['throughput_per_sec']} コマンド/秒"
+    )
+    for name in ("queue", "write", "total"):
+        s = r[f"{name}_ms"]
+        print(f"   {name:6s} p50 {s['p50']}ms  p95 {s['p95']}ms  p99 {s['p99']}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BLE コマンド送信のバーストベンチマーク（代役の BleakClient）")
+    parser.add_argument("--interval-ms", type=float, default=INTERVAL_MS, help="代役の接続間隔（ms）")
+    parser.add_argument("--burst", type=int, default=BURST, help="1回のバーストで積むコマンド数")
+    parser.add_argument("--bursts", type=int, default=BURSTS)
+    parser.add_argument("--gap", type=float, default=BURST_GAP_SEC, help="バーストの間（秒）")
+    parser.add_argument("--pattern", choices=["raw", "motion", "both"], default="both")
+    parser.add_argument("--mode", choices=["response", "no-response", "both"], default="both")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="結果を JSON で保存する")
+    args = parser.parse_args()
+
+    FakeBleakClient.interval = args.interval_ms / 1000
+    FakeBleakClient.rng = random.Random(args.seed)
+    modes = {"response": [True], "no-response": [False], "both": [True, False]}[args.mode]
+    patterns = ["raw", "motion"] if args.pattern == "both" else [args.pattern]
+
+    print(f"⏱ 接続間隔 {args.interval_ms:g}ms / {args.bursts} バースト × {args.burst} コマンド")
+    results = []
+    for pattern in patterns:
+        for response in modes:
+            result = run_mode(response, pattern, args.burst, args.bursts, args.gap)
+            print_result(result)
+            results.append(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"interval_ms": args.interval_ms, "results": results}, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,495 @@
+"""
+オフラインのエンドツーエンドベンチマーク。
+
+USBマイク・Bluetoothスピーカー・Pico・EC2・OpenAI が無くても、会話ループを丸ごと動かして
+「子どもが話し終わってから、ニコの声が鳴り始めるまで」を計る。
+
+・OpenAI（文字起こし / Responses / Assistants）と VoiceVox はローカルの代役サーバ（fake_servers.py）
+・sounddevice / simpleaudio / aplay / BLE は代役（fake_devices/）。マイクは台本の WAV を実時間で流す
+・対象のスクリプトを一時ディレクトリにコピーし、代役の config.py と一緒に別プロセスで起動する
+  （--module で assistant/assistant.py（Assistants API 版）や、git の前のリビジョンから取り出した
+  スクリプトも同じ条件で比べられる。日付つきの assistant/assistant_2025*.py は config を import せずに
+  使っているなどそのままでは動かないので、比べる対象にはならない）
+・--replay で、記録したセッション（session_recorder の zip）の子どもの声・文字起こし・返答・合成音声を
+  記録した応答時間どおりに再現する（--speed 4 なら4倍速。時間は実時間に換算して出す）
+
+使い方:
+    python bench_e2e.py
+    python bench_e2e.py --module ../assistant/assistant.py
+    python bench_e2e.py --turns 8 --ttft lognormal:0.6,0.4 --tts-synth lognormal:0.4,0.3
+    python bench_e2e.py --fixtures fixtures/      # *.wav と同じ名前の *.txt（文字起こし）
+    python bench_e2e.py --json result.json --keep
+    python bench_e2e.py --replay ../sessions/session-20261017-101500.zip --speed 4
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+from fake_servers import FakeOpenAI, FakeVoiceVox
+from session_replay import ReplayPlan
+
+HERE = Path(__file__).resolve().parent
+REPO = HERE.parent
+FAKE_DEVICES = HERE / "fake_devices"
+DEFAULT_MODULE = REPO / "assistant_responses" / "assistant_responses.py"
+
+sys.path.insert(0, str(REPO / "turn_trace"))
+from turn_trace import load_records, percentile, print_summary, summarize  # noqa: E402
+
+try:
+    import psutil
+except ImportError:      # 無ければ /proc を読む
+    psutil = None
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+UTTERANCE_RATE = 16000
+DEFAULT_SCRIPT = [
+    "こんにちは！",
+    "きょうはなにしてあそぶ？",
+    "ニコ、だいすき！",
+    "おなかすいたね。",
+    "おにごっこしよう！",
+    "ありがとう、たのしいね。",
+]
+STOP_TEXT = "ストップ"
+# 時計ではなく音声の長さで測っている段（倍速で回しても実時間に換算しない）
+AUDIO_TIME_STAGES = {"capture"}
+DEFAULT_REPLIES = [
+    "わーい！いっしょにあそぼう。ニコ、うれしいな！",
+    "うん、ニコもだいすきだよ！ありがとう。",
+    "おにごっこしようか？ニコ、はやいよ！",
+    "おやつたべたいね。なにがすき？",
+]
+
+# 代役の config.py（対象のスクリプトが import する）
+CONFIG_TEMPLATE = '''\
+# bench_e2e.py が生成した代役の設定
+OPENAI_API_KEY = "sk-fake"
+OPENAI_MODEL = "fake-model"
+ASSISTANT_ID = "asst_fake"
+VOICEVOX_URL = {voicevox_url!r}
+VOICEVOX_PORT = {voicevox_port!r}
+SPEAKER_ID = 1
+PICO_MAC = "00:00:00:00:00:00"
+WRITE_UUID = "00000000-0000-0000-0000-000000000000"
+DEV_MODE = True
+BUTTON_AUDIO_PATH = ""
+AUDIO_OUTPUT_DEVICE = None
+
+OUTPUT_CALIBRATE_WAKE = False
+TRACE_FILE = {trace_file!r}
+TTS_CACHE_DIR = {tts_cache_dir!r}
+PHRASE_BANK_DIR = {phrase_bank_dir!r}
+'''
+
+
+# =========================
+# 台本
+# =========================
+def synth_utterance(text, path, samplerate=UTTERANCE_RATE):
+    """子どもの声っぽい合成音（高めの基本周波数＋音節ごとの抑揚）。長さは文字数に比例"""
+    seconds = min(3.0, max(0.8, 0.2 * len(text)))
+    t = np.arange(int(samplerate * seconds)) / samplerate
+    f0 = 320 + 60 * np.sin(2 * np.pi * 2.0 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / samplerate
+    voice = np.sin(phase) + 0.6 * np.sin(2 * phase) + 0.3 * np.sin(3 * phase)
+    syllables = np.clip(np.sin(2 * np.pi * 4.0 * t), 0.2, 1.0)
+    fade = np.minimum(1.0, np.minimum(t, seconds - t) / 0.05)
+    wav.write(path, samplerate, (voice * syllables * fade * 6000).astype(np.int16))
+
+
+def build_script(workdir, turns, fixtures=None):
+    """[{"wav", "text"}, ...]。最後は必ず STOP ワードで終わる"""
+    if fixtures:
+        entries = []
+        for wav_path in sorted(Path(fixtures).glob("*.wav")):
+            txt = wav_path.with_suffix(".txt")
+            text = txt.read_text(encoding="utf-8").strip() if txt.exists() else ""
+            entries.append({"wav": str(wav_path), "text": text})
+        if not entries:
+            raise SystemExit(f"❌ WAV がありません: {fixtures}")
+        if STOP_TEXT not in entries[-1]["text"]:
+            stop = workdir / "stop.wav"
+            synth_utterance(STOP_TEXT, stop)
+            entries.append({"wav": str(stop), "text": STOP_TEXT})
+        return entries
+
+    texts = [DEFAULT_SCRIPT[i % len(DEFAULT_SCRIPT)] for i in range(turns)] + [STOP_TEXT]
+    entries = []
+    for i, text in enumerate(texts):
+        path = workdir / f"utterance_{i:02d}.wav"
+        synth_utterance(text, path)
+        entries.append({"wav": str(path), "text": text})
+    return entries
+
+
+class ScriptTranscriber:
+    """
+    文字起こしの代役。マイクの代役が「話し終わった」と記録した発話の文を、古い順に1回ずつ返す。
+    まだ話し終わった発話が無いアップロード（無音の録音など）には "" を返す。
+    latencies（発話の番号 → 秒）があれば、その発話は (文, 秒) で返す（リプレイ用）。
+    """
+
+    def __init__(self, audio_log, latencies=None):
+        self.audio_log = audio_log
+        self.latencies = latencies or {}
+        self.consumed = set()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            for event in read_events(self.audio_log):
+                if event["event"] == "utterance_end" and event["index"] not in self.consumed:
+                    self.consumed.add(event["index"])
+                    text = event.get("text") or ""
+                    if event["index"] in self.latencies:
+                        return text, self.latencies[event["index"]]
+                    return text
+        return ""
+
+
+def read_events(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+# =========================
+# CPU / メモリ
+# =========================
+class ResourceSampler(threading.Thread):
+    """対象プロセスの CPU 使用率とメモリ（RSS）を一定間隔で測る"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.cpu = []
+        self.rss = []
+        self.cpu_sec = 0.0
+        self._finished = threading.Event()
+
+    def stop(self):
+        self._finished.set()
+        self.join(timeout=2)
+
+    def _read_proc(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{self.pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS"))
+        return cpu, rss
+
+    def run(self):
+        proc = psutil.Process(self.pid) if psutil else None
+        last_cpu, last_t = None, None
+        while not self._finished.wait(self.interval):
+            try:
+                if proc is not None:
+                    times = proc.cpu_times()
+                    cpu, rss = times.user + times.system, proc.memory_info().rss
+                else:
+                    cpu, rss = self._read_proc()
+            except (OSError, StopIteration) if psutil is None else (OSError, psutil.Error):
+                return
+            now = time.monotonic()
+            if last_cpu is not None:
+                self.cpu.append((cpu - last_cpu) / (now - last_t) * 100)
+            last_cpu, last_t = cpu, now
+            self.cpu_sec = cpu
+            self.rss.append(rss)
+
+    def summary(self):
+        cpu = sorted(self.cpu)
+        rss = sorted(self.rss)
+        if not rss:
+            return {}
+        return {
+            "cpu_sec": round(self.cpu_sec, 2),
+            "cpu_avg_pct": round(sum(cpu) / len(cpu), 1) if cpu else None,
+            "cpu_p95_pct": round(percentile(cpu, 95), 1) if cpu else None,
+            "cpu_max_pct": round(cpu[-1], 1) if cpu else None,
+            "rss_avg_mb": round(sum(rss) / len(rss) / 2**20, 1),
+            "rss_max_mb": round(rss[-1] / 2**20, 1),
+        }
+
+
+# =========================
+# 集計
+# =========================
+def turn_latencies(events, speed=1.0):
+    """
+    発話ごとに「話し終わり → 次にニコの音が鳴り始める」まで（ms。speed 倍速なら実時間に換算）。
+    次の発話が始まるまでに鳴らなかったら None。
+    """
+    ends = [e for e in events if e["event"] == "utterance_end"]
+    starts = [e["t"] for e in events if e["event"] == "utterance_start"]
+    outputs = [e["t"] for e in events if e["event"] == "output_start"]
+    result = []
+    for end in ends:
+        next_start = min((t for t in starts if t > end["t"]), default=float("inf"))
+        onset = next((t for t in outputs if end["t"] < t < next_start), None)
+        result.append({
+            "index": end["index"],
+            "text": end.get("text"),
+            "latency_ms": None if onset is None else round((onset - end["t"]) * 1000 * speed, 1),
+        })
+    return result
+
+
+def latency_stats(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": values[-1],
+    }
+
+
+# =========================
+# 実行
+# =========================
+def module_dirs():
+    """1フォルダ1モジュールのフォルダ（実機では同じディレクトリに並ぶもの）"""
+    skip = {"benchmarks", "assistant", "images"}
+    return [
+        str(d) for d in sorted(REPO.iterdir())
+        if d.is_dir() and d.name not in skip and not d.name.startswith((".", "_")) and any(d.glob("*.py"))
+    ]
+
+
+def prepare_workdir(workdir, module, voicevox, overrides=()):
+    target = workdir / module.name
+    shutil.copy(module, target)
+    prompt = module.parent / "nico_prompt.txt"
+    shutil.copy(prompt if prompt.exists() else REPO / "nico_prompt.txt", workdir / "nico_prompt.txt")
+    shutil.copy(REPO / "nico_words.json", workdir / "nico_words.json")
+    (workdir / "config.py").write_text(
+        CONFIG_TEMPLATE.format(
+            voicevox_url=voicevox.url,
+            voicevox_port=voicevox.server_address[1],
+            trace_file=str(workdir / "turn_trace.jsonl"),
+            tts_cache_dir=str(workdir / "tts_cache_data"),
+            phrase_bank_dir=str(workdir / "phrase_bank_data"),
+        ) + "".join(f"{item.partition('=')[0].strip()} = {item.partition('=')[2].strip()}\n" for item in overrides),
+        encoding="utf-8",
+    )
+    return target
+
+
+def run_benchmark(args, workdir):
+    module = Path(args.module).resolve()
+    audio_log = workdir / "audio_events.jsonl"
+    replay = ReplayPlan(args.replay, workdir) if args.replay else None
+    if replay is not None:
+        script = replay.utterances
+        transcriber = ScriptTranscriber(audio_log, replay.transcript_latencies())
+        replies, voices = replay.reply_for, replay.voice_for
+    else:
+        script = build_script(workdir, args.turns, args.fixtures)
+        transcriber = ScriptTranscriber(audio_log)
+        replies, voices = DEFAULT_REPLIES, None
+    script_path = workdir / "mic_script.json"
+    script_path.write_text(json.dumps({
+        "utterances": script,
+        "gap_sec": args.gap,
+        "turn_timeout_sec": args.turn_timeout,
+    }, ensure_ascii=False), encoding="utf-8")
+
+    openai_server = FakeOpenAI(
+        transcriber, replies,
+        stt=args.stt, ttft=args.ttft, llm=args.llm, seed=args.seed, speed=args.speed,
+        hallucination=args.hallucinate,
+    ).start()
+    voicevox = FakeVoiceVox(
+        query=args.tts_query, synth=args.tts_synth, seed=args.seed, voices=voices, speed=args.speed,
+    ).start()
+    target = prepare_workdir(workdir, module, voicevox, args.set)
+
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join([str(FAKE_DEVICES), str(workdir), *module_dirs()]),
+        "PATH": str(FAKE_DEVICES) + os.pathsep + env.get("PATH", ""),
+        "OPENAI_BASE_URL": openai_server.url + "/v1",
+        "OPENAI_API_KEY": "sk-fake",
+        "FAKE_MIC_SCRIPT": str(script_path),
+        "FAKE_AUDIO_LOG": str(audio_log),
+        "FAKE_APLAY_STATE": str(workdir / "aplay_state"),
+        "FAKE_SPEED": str(args.speed),
+        "PYTHONUNBUFFERED": "1",
+    })
+    timeout = args.timeout or 60 + 25 * len(script) / args.speed
+
+    source = f"リプレイ {replay.name}" if replay is not None else "合成音声"
+    print(
+        f"🏁 {module.relative_to(REPO) if module.is_relative_to(REPO) else module} / "
+        f"{source} / 発話 {len(script)} 回 / {args.speed:g}倍速"
+    )
+    stdout = None if args.verbose else open(workdir / "stdout.log", "w", encoding="utf-8")
+    started = time.time()
+    proc = subprocess.Popen(
+        # main.py と同じく、VoiceVox のホストを sys.argv[1] で渡す（それで受け取るリビジョン用）
+        [sys.executable, str(target), "127.0.0.1"],
+        cwd=workdir, env=env, stdout=stdout, stderr=subprocess.STDOUT,
+    )
+    sampler = ResourceSampler(proc.pid)
+    sampler.start()
+    try:
+        exit_code = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        print(f"⏰ {timeout:.0f}秒で終わらないので止めます")
+        proc.send_signal(signal.SIGINT)
+        try:
+            exit_code = proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            exit_code = proc.wait()
+    finally:
+        sampler.stop()
+        if stdout is not None:
+            stdout.close()
+        openai_server.stop()
+        voicevox.stop()
+        if replay is not None:
+            replay.close()
+    wall = time.time() - started
+
+    log_tail = []
+    if exit_code != 0 and not args.verbose:
+        log_tail = (workdir / "stdout.log").read_text(encoding="utf-8", errors="replace").splitlines()[-8:]
+
+    events = read_events(audio_log)
+    turns = turn_latencies(events, args.speed)
+    first_output = next((e["t"] for e in events if e["event"] == "output_start"), None)
+    trace = workdir / "turn_trace.jsonl"
+    records = load_records(trace) if trace.exists() else []
+    for r in records:
+        if r["stage"] not in AUDIO_TIME_STAGES:
+            r["ms"] *= args.speed
+    return {
+        "module": str(module),
+        "replay": args.replay,
+        "speed": args.speed,
+        "exit_code": exit_code,
+        "log_tail": log_tail,
+        "wall_sec": round(wall, 1),
+        "greeting_ms": None if first_output is None else round((first_output - started) * 1000 * args.speed, 1),
+        "turns": turns,
+        "turn_latency_ms": latency_stats([t["latency_ms"] for t in turns]),
+        "missed_turns": sum(1 for t in turns if t["latency_ms"] is None),
+        "stages": summarize(records),
+        "recorded_stages": summarize(replay.recorded_spans()) if replay is not None else {},
+        "resources": sampler.summary(),
+        "requests": {**openai_server.requests, **voicevox.requests},
+        "settings": {
+            "stt": args.stt, "ttft": args.ttft, "llm": args.llm,
+            "tts_query": args.tts_query, "tts_synth": args.tts_synth, "seed": args.seed,
+        },
+        "host": {
+            "machine": platform.machine(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "loadavg": [round(x, 2) for x in os.getloadavg()],
+        },
+    }
+
+
+def print_report(result):
+    print()
+    print(f"📦 {result['module']}  (exit {result['exit_code']}, {result['wall_sec']}秒)")
+    for line in result["log_tail"]:
+        print(f"  | {line}")
+    if result["greeting_ms"] is not None:
+        print(f"👋 起動 → あいさつ: {result['greeting_ms']:.0f}ms")
+    for turn in result["turns"]:
+        latency = "返事なし" if turn["latency_ms"] is None else f"{turn['latency_ms']:.0f}ms"
+        print(f"  #{turn['index']:<2d} {turn['text'] or '':20s} {latency}")
+    stats = result["turn_latency_ms"]
+    if stats["count"]:
+        print(
+            f"⏱ 話し終わり → ニコの声: p50 {stats['p50']:.0f}ms  p95 {stats['p95']:.0f}ms  "
+            f"p99 {stats['p99']:.0f}ms  max {stats['max']:.0f}ms  (返事なし {result['missed_turns']})"
+        )
+    if result["stages"]:
+        print()
+        if result["speed"] != 1:
+            print(f"（{result['speed']:g}倍速で測った時間を実時間に換算。CPU で処理している部分はそのぶん大きく出る）")
+        print_summary(result["stages"])
+    if result["recorded_stages"]:
+        print()
+        print("📼 記録したセッション:")
+        print_summary(result["recorded_stages"])
+    res = result["resources"]
+    if res:
+        print()
+        print(
+            f"🖥 CPU {res['cpu_sec']}秒 (平均 {res['cpu_avg_pct']}% / p95 {res['cpu_p95_pct']}% / "
+            f"最大 {res['cpu_max_pct']}%)  RSS 平均 {res['rss_avg_mb']}MB / 最大 {res['rss_max_mb']}MB"
+        )
+    print(f"🌐 リクエスト: {result['requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="代役サーバ・代役デバイスで会話ループを丸ごと計る")
+    parser.add_argument("--module", default=str(DEFAULT_MODULE), help="起動するスクリプト（既定: assistant_responses.py）")
+    parser.add_argument("--turns", type=int, default=5, help="STOP の前に話す回数（--fixtures が無いとき）")
+    parser.add_argument("--fixtures", help="発話の WAV（と同じ名前の .txt）を置いたディレクトリ")
+    parser.add_argument("--replay", help="記録したセッション（session-xxxx.zip）を再現する")
+    parser.add_argument("--speed", type=float, default=1.0, help="何倍速で回すか（リプレイを速く回す用）")
+    parser.add_argument("--stt", default="lognormal:0.5,0.3", help="文字起こしの応答時間")
+    parser.add_argument("--ttft", default="lognormal:0.6,0.3", help="返答の最初の文字までの時間")
+    parser.add_argument("--llm", default="lognormal:0.8,0.3", help="最初の文字から返答を送り終えるまで")
+    parser.add_argument("--tts-query", default="lognormal:0.05,0.3", help="VoiceVox audio_query の応答時間")
+    parser.add_argument("--tts-synth", default="lognormal:0.4,0.3", help="VoiceVox synthesis の応答時間")
+    parser.add_argument("--gap", type=float, default=1.0, help="ニコが鳴り終わってから次に話すまで（秒）")
+    parser.add_argument("--turn-timeout", type=float, default=20.0, help="返事が無くても次を話すまで（秒）")
+    parser.add_argument("--timeout", type=float, help="全体の制限時間（秒）")
+    parser.add_argument("--hallucinate", metavar="TEXT",
+                        help="無音のアップロードに Whisper のようにでっち上げて返す文（例: ご視聴ありがとうございました）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="config.py に足す設定（VALUE は Python の式。例: --set LLM_STREAMING=False）")
+    parser.add_argument("--json", help="結果を JSON で保存する")
+    parser.add_argument("--keep", action="store_true", help="作業ディレクトリ（ログ・トレース）を残す")
+    parser.add_argument("--verbose", action="store_true", help="対象スクリプトの出力をそのまま表示する")
+    args = parser.parse_args()
+
+    if args.keep:
+        workdir = Path(tempfile.mkdtemp(prefix="bench_e2e_"))
+        result = run_benchmark(args, workdir)
+        print(f"📁 作業ディレクトリ: {workdir}")
+    else:
+        with tempfile.TemporaryDirectory(prefix="bench_e2e_") as tmp:
+            result = run_benchmark(args, Path(tmp))
+
+    print_report(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=1)
+    return result
+
+
+if __name__ == "__main__":
+    main()
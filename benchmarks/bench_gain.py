@@ -0,0 +1,115 @@
+"""
+音量調整（ゲイン＋リミッター）のマイクロベンチマーク。
+
+今までの実装（np.frombuffer → float64倍 → clip → astype → 無音とconcatenate → tobytes）と、
+audio_dsp.GainLimiter（使い回しバッファでチャンク処理）を比べる。
+
+使い方:
+    python bench_gain.py [--seconds 3] [--repeat 50]
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+REPO = HERE.parent
+for name in ("audio_dsp", "audio_capture", "audio_output"):
+    sys.path.insert(0, str(REPO / name))
+
+try:
+    import sounddevice  # noqa: F401
+except OSError:
+    # PortAudio の無い環境では BLOCKSIZE が読めればよいので代役を使う
+    sys.path.insert(0, str(HERE / "fake_devices"))
+
+from audio_dsp import GainLimiter  # noqa: E402
+from audio_output import BLOCKSIZE  # noqa: E402
+
+SAMPLERATE = 24000
+
+
+def legacy_play_audio_path(audio_data, factor=7.0, leading_silence_sec=0.6):
+    """assistant_responses.play_audio の元の処理（aplayに渡す直前まで）"""
+    amplified = np.frombuffer(audio_data, dtype=np.int16)
+    amplified = (amplified * factor).clip(-32768, 32767).astype(np.int16)
+    silence = np.zeros(int(24000 * leading_silence_sec), dtype=np.int16)
+    output = np.concatenate([silence, amplified])
+    return output.tobytes()
+
+
+def legacy_amplify_audio(audio_data, amplification_factor=4.5):
+    """play_greeting.amplify_audio の元の処理"""
+    audio_array = np.frombuffer(audio_data, dtype=np.int16)
+    amplified_audio = (audio_array * amplification_factor).clip(-32768, 32767).astype(np.int16)
+    return amplified_audio.tobytes()
+
+
+def streamed_gain(audio_data, out_block, limiter, factor=7.0):
+    """再生コールバックと同じく、BLOCKSIZEごとに出力バッファへ直接書く"""
+    pcm = np.frombuffer(audio_data, dtype=np.int16)
+    for start in range(0, pcm.shape[0], BLOCKSIZE):
+        src = pcm[start:start + BLOCKSIZE]
+        limiter.process(src, out_block[:src.shape[0]], gain=factor)
+
+
+def synthetic_voice(seconds):
+    """VoiceVoxっぽい音量の合成音（倍率7でクリップが起きるくらい）"""
+    t = np.arange(int(SAMPLERATE * seconds)) / SAMPLERATE
+    env = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    x = (np.sin(2 * np.pi * 220 * t) + 0.3 * np.sin(2 * np.pi * 660 * t)) * env * 6000
+    return x.astype(np.int16).tobytes()
+
+
+def measure(name, fn, repeat):
+    fn()  # 作業バッファの確保などは計測から外す
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times.sort()
+    result = {
+        "name": name,
+        "median_ms": times[len(times) // 2],
+        "p95_ms": times[int(len(times) * 0.95) - 1],
+        "peak_alloc_kb": peak / 1024,
+    }
+    print(
+        f"{name:28s} median {result['median_ms']:7.2f}ms  "
+        f"p95 {result['p95_ms']:7.2f}ms  peak alloc {result['peak_alloc_kb']:8.1f}KB"
+    )
+    return result
+
+
+def run(seconds=3.0, repeat=50):
+    data = synthetic_voice(seconds)
+    limiter = GainLimiter()
+    out_block = np.empty(BLOCKSIZE, dtype=np.int16)
+    print(f"🎧 {seconds:.1f}秒 / {len(data) / 1024:.0f}KB の音声で計測（{repeat}回）")
+    return [
+        measure("legacy play_audio", lambda: legacy_play_audio_path(data), repeat),
+        measure("legacy amplify_audio", lambda: legacy_amplify_audio(data), repeat),
+        measure("GainLimiter (streamed)", lambda: streamed_gain(data, out_block, limiter), repeat),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ゲイン処理のマイクロベンチマーク")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    run(args.seconds, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+毎ターン Pi の上で走る処理のマイクロベンチマーク（ベースラインと比べる）。
+
+・play_audio の再生パス（to_pcm → 先頭の無音 → ゲイン＋リミッター → 参照リング）
+・amplify_audio（play_greeting。apply_gain で一括）
+・アップロード用のエンコード（record_audio の録音 → encode_for_upload。wav / flac）
+・単語リスト（nico_words.json）の判定。WordMatcher の1回の走査と、
+  以前のカテゴリごとの any(w in text ...) の比較
+・BLE コマンドのエンコード
+
+結果は baselines/micro-<machine>.json と比べ、遅くなった項目に印を付ける。
+比べるのは一番速かったサンプル（timeit と同じ考え方。ほかの処理に邪魔された分が入りにくい）。
+マシン自体の速さの揺れ（温度によるクロック低下など）は、各項目の直前に測る
+リポジトリのコードを含まない決まった処理（calibration）の比で割って補正する。
+ベースラインが無ければ今回の結果で作る。Pi 4 で --save したものをコミットしておくと、
+変更のたびに「どれだけ遅く/速くなったか」がわかる。
+
+使い方:
+    python bench_micro.py
+    python bench_micro.py --save                 # ベースラインを今回の結果で上書き
+    python bench_micro.py --filter words --fail  # 遅くなった項目があれば終了コード 1
+"""
+import argparse
+import gc
+import io
+import json
+import platform
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+HERE = Path(__file__).resolve().parent
+REPO = HERE.parent
+for name in ("audio_dsp", "audio_capture", "audio_output", "audio_codec", "turn_trace", "word_matcher"):
+    sys.path.insert(0, str(REPO / name))
+
+try:
+    import sounddevice  # noqa: F401
+except OSError:
+    # PortAudio の無い環境では再生コールバックだけ動かせればよいので代役を使う
+    sys.path.insert(0, str(HERE / "fake_devices"))
+
+from audio_codec import encode_for_upload  # noqa: E402
+from audio_dsp import apply_gain  # noqa: E402
+from audio_output import Fragment, PlaybackEngine, to_pcm  # noqa: E402
+from bench_gain import synthetic_voice  # noqa: E402
+from turn_trace import percentile  # noqa: E402
+from word_matcher import WordMatcher  # noqa: E402
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+SAMPLE_SEC = 0.005          # 1サンプル（何回かまとめて呼ぶ）の長さの目安
+SAMPLES = 40                # サンプル数
+THRESHOLD = 0.10            # ベースラインから10%以上変わったら印を付ける
+BASELINE_DIR = HERE / "baselines"
+
+VOICE_SEC = 3.0             # VoiceVox の1断片くらい
+RECORD_SEC = 5.0            # 1発話くらい
+RECORD_RATE = 48000
+
+# 子どもの発話とニコの返答っぽい文（当たり・はずれの両方）
+TEXTS = [
+    "ニコ、だいすき！",
+    "きょうはなにしてあそぶ？",
+    "ストップ",
+    "ご視聴ありがとうございました",
+    "おなかすいたね。きょうのおやつはなにかな？",
+    "わーい！いっしょにあそぼう。ニコ、うれしいな！",
+    "うーん、わかんない",
+    "",
+]
+BLE_COMMANDS = ["FORWARD:2.0", "REVERSE:2.0", "STOP", "FORWARD:1.5"]
+
+
+WORDS_FILE = REPO / "nico_words.json"
+
+
+# =========================
+# 計測
+# =========================
+def measure(fn, samples=SAMPLES, sample_sec=SAMPLE_SEC):
+    """
+    1回あたりの時間（µs）の最小・中央値・p95。
+    短い処理は1サンプルが sample_sec 以上になるまでまとめて呼ぶ（timeit と同じく GC は止める）。
+    """
+    fn()
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - t0 >= sample_sec or number >= 1 << 20:
+            break
+        number *= 2
+
+    times = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(samples):
+            t0 = time.perf_counter()
+            for _ in range(number):
+                fn()
+            times.append((time.perf_counter() - t0) / number * 1e6)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    times.sort()
+    return {
+        "min_us": round(times[0], 3),
+        "median_us": round(percentile(times, 50), 3),
+        "p95_us": round(percentile(times, 95), 3),
+        "loops": number,
+    }
+
+
+# =========================
+# 対象
+# =========================
+def play_audio_path(engine, wav_bytes, outdata, factor=7.0, lead_in_sec=0.6):
+    """play_audio から再生コールバックが最後のブロックを書き終えるまで（ストリームは開かない）"""
+    frag = Fragment(to_pcm(wav_bytes), gain=factor, lead_in=int(lead_in_sec * engine.samplerate))
+    engine._queue.append(frag)
+    while not frag.done.is_set():
+        engine._callback(outdata, outdata.shape[0], None, None)
+
+
+def wav_bytes(pcm_bytes, samplerate=24000):
+    """VoiceVox が返すのと同じ形（ヘッダ付き WAV）"""
+    buf = io.BytesIO()
+    wav.write(buf, samplerate, np.frombuffer(pcm_bytes, dtype=np.int16))
+    return buf.getvalue()
+
+
+def recorded_audio(seconds=RECORD_SEC, samplerate=RECORD_RATE):
+    """マイクの録音っぽい音（声＋ノイズ）"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(samplerate * seconds)) / samplerate
+    voice = np.sin(2 * np.pi * 300 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)) * 4000
+    return (voice + rng.normal(0, 100, t.size)).astype(np.int16)
+
+
+def calibration(values=np.arange(4096, dtype=np.float64)):
+    """マシンの速さを測る決まった処理（Python のループ＋ numpy。リポジトリのコードは使わない）"""
+    total = 0
+    for i in range(2000):
+        total += i * i
+    return total + float(np.dot(values, values))
+
+
+def build_cases():
+    """名前 → 引数なしで呼べる関数"""
+    voice = wav_bytes(synthetic_voice(VOICE_SEC))
+    engine = PlaybackEngine(samplerate=24000)
+    outdata = np.zeros((engine.blocksize, 1), dtype=np.int16)
+    recorded = recorded_audio()
+    words = WordMatcher(WORDS_FILE, reload_check_sec=float("inf"))
+
+    cases = {
+        "play_audio path (3s)": lambda: play_audio_path(engine, voice, outdata),
+        "amplify_audio (3s)": lambda: apply_gain(to_pcm(voice), 4.5).tobytes(),
+        "encode wav (5s@48k)": lambda: encode_for_upload(recorded, RECORD_RATE, fmt="wav"),
+        "encode flac (5s@48k)": lambda: encode_for_upload(recorded, RECORD_RATE, fmt="flac"),
+        "ble encode": lambda: [cmd.encode() for cmd in BLE_COMMANDS],
+    }
+    cases["words matcher (all)"] = lambda: [words.categories(text) for text in TEXTS]
+    for name, word_list in words.lists.items():
+        cases[f"words any() {name}"] = (
+            lambda word_list=word_list: [any(w in text for w in word_list) for text in TEXTS]
+        )
+    return cases
+
+
+# =========================
+# ベースライン
+# =========================
+def environment():
+    return {
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+
+
+def baseline_path():
+    return BASELINE_DIR / f"micro-{platform.machine()}.json"
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(
+            {**environment(), "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results},
+            f, ensure_ascii=False, indent=1,
+        )
+    print(f"💾 ベースラインを保存しました: {path}")
+
+
+def compare(results, baseline):
+    """
+    名前 → 最小値の比（今回 / ベースライン）。ベースラインに無い項目は None。
+    どちらにも calibration_us があれば、その比（マシンの速さの揺れ）で割った値にする。
+    """
+    base = (baseline or {}).get("results", {})
+    ratios = {}
+    for name, r in results.items():
+        b = base.get(name, {})
+        if not b.get("min_us"):
+            ratios[name] = None
+            continue
+        ratio = r["min_us"] / b["min_us"]
+        if r.get("calibration_us") and b.get("calibration_us"):
+            ratio /= r["calibration_us"] / b["calibration_us"]
+        ratios[name] = ratio
+    return ratios
+
+
+def machine_drift(results, baseline):
+    """calibration の比の中央値（マシンがベースラインの何倍の時間で動いているか）"""
+    base = (baseline or {}).get("results", {})
+    drifts = sorted(
+        r["calibration_us"] / base[name]["calibration_us"]
+        for name, r in results.items()
+        if r.get("calibration_us") and base.get(name, {}).get("calibration_us")
+    )
+    return percentile(drifts, 50)
+
+
+def print_report(results, ratios, baseline, threshold=THRESHOLD):
+    if baseline:
+        print(f"📏 ベースライン: {baseline.get('saved_at')} / Python {baseline.get('python')} / numpy {baseline.get('numpy')}")
+        drift = machine_drift(results, baseline)
+        if drift is not None:
+            print(f"🖥 マシンの速さ: ベースラインの {drift:.2f} 倍の時間（比はこれで補正）")
+    print(f"{'case':28s} {'min':>11s} {'median':>11s} {'p95':>11s} {'vs base':>9s}")
+    for name, r in results.items():
+        ratio = ratios.get(name)
+        if ratio is None:
+            mark, change = "", "-"
+        else:
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            mark = "  ⚠ 遅くなった" if ratio > 1 + threshold else "  ✨ 速くなった" if ratio < 1 - threshold else ""
+        print(
+            f"{name:28s} {r['min_us']:9.1f}µs {r['median_us']:9.1f}µs {r['p95_us']:9.1f}µs "
+            f"{change:>9s}{mark}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="毎ターン走る処理のマイクロベンチマーク")
+    parser.add_argument("--filter", help="名前にこの文字列を含む項目だけ")
+    parser.add_argument("--baseline", help=f"比べるベースライン（既定: {baseline_path().relative_to(HERE)}）")
+    parser.add_argument("--save", action="store_true", help="今回の結果でベースラインを上書きする")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="この割合以上変わったら印を付ける")
+    parser.add_argument("--fail", action="store_true", help="遅くなった項目があれば終了コード 1")
+    parser.add_argument("--samples", type=int, default=SAMPLES)
+    parser.add_argument("--json", help="結果を JSON で保存する")
+    args = parser.parse_args()
+
+    cases = build_cases()
+    if args.filter:
+        cases = {k: v for k, v in cases.items() if args.filter in k}
+    print(f"⏱ {platform.machine()} / Python {platform.python_version()} / {len(cases)} 項目")
+    results = {}
+    for name, fn in cases.items():
+        cal = measure(calibration, samples=max(5, args.samples // 4))
+        results[name] = {**measure(fn, samples=args.samples), "calibration_us": cal["min_us"]}
+
+    path = Path(args.baseline) if args.baseline else baseline_path()
+    baseline = load_baseline(path)
+    ratios = compare(results, baseline)
+    print_report(results, ratios, baseline, args.threshold)
+
+    if args.save or baseline is None:
+        # 今回走らせなかった項目はベースラインに残す
+        merged = {**(baseline or {}).get("results", {}), **results}
+        save_baseline(path, merged)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({**environment(), "results": results, "vs_baseline": ratios}, f, ensure_ascii=False, indent=1)
+
+    slower = [name for name, ratio in ratios.items() if ratio is not None and ratio > 1 + args.threshold]
+    if args.fail and slower:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
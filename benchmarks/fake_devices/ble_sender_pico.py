@@ -0,0 +1,34 @@
+"""
+ベンチマーク用の BLE 送信の代役（何も送らない）。
+コマンドは FAKE_AUDIO_LOG に記録し、turn_trace があれば ble スパンも残す。
+"""
+import time
+
+from sounddevice import log_event
+
+try:
+    from turn_trace import current_turn, tracer
+except ImportError:      # turn_trace の無い古いリビジョン
+    tracer = None
+
+
+_counters = {"sent": 0, "dropped": 0, "coalesced": 0, "late": 0, "failed": 0}
+
+
+def send_cmd(cmd: str, enqueued_at=None, turn=None, priority=None, deadline=None):
+    now = time.monotonic()
+    log_event("ble", cmd=cmd)
+    _counters["sent"] += 1
+    if tracer is not None:
+        tracer.record(
+            "ble", now if enqueued_at is None else enqueued_at, now,
+            turn=current_turn() if turn is None else turn, cmd=cmd, sink="null",
+        )
+
+
+def connect_early():
+    pass
+
+
+def stats():
+    return dict(_counters)
@@ -0,0 +1,53 @@
+"""
+ベンチマーク用の simpleaudio の代役（古い assistant_*.py 用）。
+実際には鳴らさず、音の長さだけ待って「鳴っている」を sounddevice の代役に伝える。
+"""
+import threading
+import time
+
+import scipy.io.wavfile as wav
+
+from sounddevice import SPEED, speaker
+
+
+class PlayObject:
+    def __init__(self, duration):
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(duration,), daemon=True)
+        self._thread.start()
+
+    def _run(self, duration):
+        end = time.monotonic() + duration
+        while time.monotonic() < end and not self._done.is_set():
+            speaker.note(True)
+            time.sleep(0.02)
+        self._done.set()
+        speaker.note(False)
+
+    def wait_done(self):
+        self._done.wait()
+
+    def is_playing(self):
+        return not self._done.is_set()
+
+    def stop(self):
+        self._done.set()
+
+
+class WaveObject:
+    def __init__(self, audio_data, num_channels=2, bytes_per_sample=2, sample_rate=44100):
+        frames = len(audio_data) // (num_channels * bytes_per_sample)
+        self.duration = frames / sample_rate
+
+    @classmethod
+    def from_wave_file(cls, path):
+        rate, data = wav.read(path)
+        channels = 1 if data.ndim == 1 else data.shape[1]
+        return cls(data.tobytes(), channels, data.dtype.itemsize, rate)
+
+    def play(self):
+        return PlayObject(self.duration / SPEED)
+
+
+def stop_all():
+    pass
@@ -0,0 +1,414 @@
+"""
+ベンチマーク用の sounddevice の代役（bench_e2e.py が PYTHONPATH の先頭に置く）。
+
+・マイク: 台本（FAKE_MIC_SCRIPT の JSON）の WAV を実時間で流す。それ以外は小さいノイズ。
+  ニコがしゃべり終わって gap_sec 静かになったら、次の発話を流し始める。
+・スピーカー: コールバックを実時間で呼び、出てきた音の大きさで「鳴っている」を判定する。
+  simpleaudio / aplay の代役も同じ「鳴っている」情報を使う。
+・出来事は FAKE_AUDIO_LOG に1行1JSONで書く（発話の始まり/終わり、ニコの音の始まり/終わり）。
+  時刻は time.time()。
+・FAKE_SPEED=2 なら、マイク・スピーカーとも実時間の2倍の速さで進む（リプレイを速く回す用）。
+"""
+import json
+import os
+import threading
+import time
+from math import gcd
+
+import numpy as np
+import scipy.io.wavfile as wav
+from scipy.signal import resample_poly
+
+
+TICK_SEC = 0.01           # マイクを進める単位
+NOISE_LEVEL = 30          # 待機中のマイクノイズ（int16 の標準偏差）
+LOUD_LEVEL = 500          # これより大きい出力を「ニコが鳴っている」とみなす（keepalive のノイズは除く）
+QUIET_HOLD_SEC = 0.25     # これだけ静かなら鳴り終わったとみなす
+SPEED = float(os.environ.get("FAKE_SPEED") or 1.0)
+
+
+# =========================
+# 出来事ログ
+# =========================
+_log_lock = threading.Lock()
+
+
+def log_event(event, **fields):
+    path = os.environ.get("FAKE_AUDIO_LOG")
+    if not path:
+        return
+    fields.update(event=event, t=time.time())
+    with _log_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(fields, ensure_ascii=False) + "\n")
+
+
+# =========================
+# 「鳴っている」の管理（スピーカー / simpleaudio / aplay 共通）
+# =========================
+class _Speaker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.loud = False
+        self.last_loud = 0.0          # time.monotonic
+        self.ever_played = 0          # 鳴り始めの回数
+        self._aplay_state = os.environ.get("FAKE_APLAY_STATE")
+        self._aplay_checked = 0.0
+        if self._aplay_state:
+            # マイクを開く前のあいさつ（aplay）も拾えるように、import したときから見張る
+            threading.Thread(target=self._watch_aplay, daemon=True).start()
+
+    def note(self, loud):
+        now = time.monotonic()
+        with self._lock:
+            if loud:
+                self.last_loud = now
+                if not self.loud:
+                    self.loud = True
+                    self.ever_played += 1
+                    log_event("output_start")
+            elif self.loud and (now - self.last_loud) * SPEED > QUIET_HOLD_SEC:
+                self.loud = False
+                log_event("output_end")
+
+    def _poll_aplay(self):
+        """aplay の代役は別プロセスなので、ファイルに書かれた「いつまで鳴るか」を読む"""
+        if not self._aplay_state:
+            return
+        now = time.monotonic()
+        if now - self._aplay_checked < 0.05:
+            return
+        self._aplay_checked = now
+        try:
+            with open(self._aplay_state, encoding="utf-8") as f:
+                start, end = (float(x) for x in f.read().split())
+        except (OSError, ValueError):
+            return
+        wall = time.time()
+        self.note(start <= wall <= end)
+
+    def _watch_aplay(self):
+        while True:
+            time.sleep(0.05)
+            self._poll_aplay()
+            self.note(False)
+
+    def quiet_for(self):
+        """最後に鳴ってから何秒たったか（鳴っていれば 0。SPEED 倍速の時間で）"""
+        self._poll_aplay()
+        self.note(False)      # 鳴らす側が止まったまま（コールバックが来ない）でも鳴り終わりにする
+        with self._lock:
+            if self.loud:
+                return 0.0
+            return (time.monotonic() - self.last_loud) * SPEED if self.ever_played else float("inf")
+
+
+speaker = _Speaker()
+
+
+# =========================
+# マイク
+# =========================
+def _load_wav(path, samplerate, offset_sec=None, duration_sec=None):
+    rate, data = _read_audio(path)
+    if data.ndim > 1:
+        data = data[:, 0]
+    if offset_sec is not None or duration_sec is not None:
+        start = int((offset_sec or 0.0) * rate)
+        end = data.shape[0] if duration_sec is None else start + int(duration_sec * rate)
+        data = data[start:end]
+    if data.dtype != np.int16:
+        data = (data.astype(np.float64) / np.abs(data).max() * 20000).astype(np.int16)
+    if rate != samplerate:
+        g = gcd(int(rate), int(samplerate))
+        data = resample_poly(data.astype(np.float32), samplerate // g, rate // g).astype(np.int16)
+    return data
+
+
+_wav_cache = {}
+
+
+def _read_audio(path):
+    """WAV（FLAC は soundfile があれば）。同じファイルは1回だけ読む（リプレイは1本のマイク録音から切り出す）"""
+    if path not in _wav_cache:
+        if str(path).endswith(".flac"):
+            import soundfile as sf
+            data, rate = sf.read(path, dtype="int16")
+        else:
+            rate, data = wav.read(path)
+        _wav_cache[path] = (rate, data)
+    return _wav_cache[path]
+
+
+class _Mic:
+    """
+    台本どおりに発話を流す仮想マイク。最初に開かれたときのサンプルレートで動く。
+
+    台本（JSON）:
+        {"utterances": [{"wav": "a.wav", "text": "こんにちは"}, ...],
+         "gap_sec": 1.0,            ニコが鳴り終わってから話し始めるまで
+         "turn_timeout_sec": 20.0}  ニコが返事をしなくても、これだけ待ったら次を話す
+
+    発話ごとに "gap_sec" を書くとその発話だけ上書きする。
+    "wait_sec" を書いた発話は、ニコの返事を待たずに前の発話からその秒数で話し始める
+    （記録したセッションで、返事の前に続けて話していたところ）。
+    "offset_sec" / "duration_sec" を書くと、WAV のその区間だけを流す。
+    """
+
+    def __init__(self):
+        path = os.environ.get("FAKE_MIC_SCRIPT")
+        script = {}
+        if path:
+            with open(path, encoding="utf-8") as f:
+                script = json.load(f)
+        self.utterances = script.get("utterances", [])
+        self.gap_sec = float(script.get("gap_sec", 1.0))
+        self.turn_timeout_sec = float(script.get("turn_timeout_sec", 20.0))
+        self.samplerate = None
+        self._lock = threading.Lock()
+        self._sinks = []
+        self._thread = None
+        self._rng = np.random.default_rng(0)
+
+    def attach(self, sink, samplerate):
+        with self._lock:
+            if self.samplerate is None:
+                self.samplerate = int(samplerate)
+            self._sinks.append(sink)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def detach(self, sink):
+        with self._lock:
+            if sink in self._sinks:
+                self._sinks.remove(sink)
+
+    def _run(self):
+        block = int(self.samplerate * TICK_SEC)
+        index = 0
+        audio = None
+        pos = 0
+        waiting_since = time.monotonic()
+        played_before = 0         # 最初の発話は、あいさつが鳴り終わってから
+        next_tick = time.monotonic()
+
+        while True:
+            next_tick += TICK_SEC / SPEED
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            chunk = self._rng.normal(0, NOISE_LEVEL, block).astype(np.int16)
+
+            if audio is None and index < len(self.utterances):
+                entry = self.utterances[index]
+                replied = speaker.ever_played > played_before
+                waited = (time.monotonic() - waiting_since) * SPEED
+                if entry.get("wait_sec") is not None:
+                    ready = waited >= entry["wait_sec"]
+                else:
+                    gap = entry.get("gap_sec", self.gap_sec)
+                    ready = (replied and speaker.quiet_for() >= gap) or waited >= self.turn_timeout_sec
+                if ready:
+                    audio = _load_wav(entry["wav"], self.samplerate, entry.get("offset_sec"), entry.get("duration_sec"))
+                    pos = 0
+                    log_event("utterance_start", index=index, text=entry.get("text"))
+
+            if audio is not None:
+                n = min(block, audio.shape[0] - pos)
+                chunk[:n] = np.clip(chunk[:n].astype(np.int32) + audio[pos:pos + n], -32768, 32767)
+                pos += n
+                if pos >= audio.shape[0]:
+                    log_event("utterance_end", index=index, text=self.utterances[index].get("text"))
+                    index += 1
+                    audio = None
+                    waiting_since = time.monotonic()
+                    played_before = speaker.ever_played
+
+            with self._lock:
+                sinks = list(self._sinks)
+            for sink in sinks:
+                sink(chunk)
+
+
+_mic = _Mic()
+
+
+# =========================
+# sounddevice の API
+# =========================
+class _Default:
+    def __init__(self):
+        self.device = (None, None)
+        self.samplerate = None
+        self.channels = None
+        self.dtype = None
+
+
+default = _Default()
+
+_DEVICES = [
+    {"name": "UACDemoV1.0: USB Audio (fake)", "index": 0, "hostapi": 0,
+     "max_input_channels": 1, "max_output_channels": 0, "default_samplerate": 48000.0},
+    {"name": "Bluetooth speaker (fake)", "index": 1, "hostapi": 0,
+     "max_input_channels": 0, "max_output_channels": 2, "default_samplerate": 48000.0},
+]
+
+
+class PortAudioError(Exception):
+    pass
+
+
+class CallbackFlags:
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return "<CallbackFlags: ->"
+
+
+def query_devices(device=None, kind=None):
+    if device is None and kind is None:
+        return [dict(d) for d in _DEVICES]
+    if device is None:
+        device = 0 if kind == "input" else 1
+    return dict(_DEVICES[int(device)])
+
+
+class InputStream:
+    def __init__(self, samplerate=None, blocksize=None, device=None, channels=None,
+                 dtype=None, callback=None, **kwargs):
+        self.samplerate = samplerate or default.samplerate or 48000
+        self.blocksize = blocksize or int(self.samplerate * TICK_SEC)
+        self.channels = channels or 1
+        self.callback = callback
+        self.latency = 0.01
+        self.active = False
+        self._pending = np.zeros(0, dtype=np.int16)
+
+    def _sink(self, chunk):
+        self._pending = np.concatenate([self._pending, chunk])
+        while self._pending.shape[0] >= self.blocksize:
+            block = self._pending[:self.blocksize]
+            self._pending = self._pending[self.blocksize:]
+            indata = np.repeat(block[:, None], self.channels, axis=1)
+            self.callback(indata, self.blocksize, None, CallbackFlags())
+
+    def start(self):
+        if not self.active:
+            self.active = True
+            _mic.attach(self._sink, self.samplerate)
+
+    def stop(self):
+        if self.active:
+            self.active = False
+            _mic.detach(self._sink)
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class OutputStream:
+    def __init__(self, samplerate=None, blocksize=None, device=None, channels=None,
+                 dtype=None, callback=None, latency=None, **kwargs):
+        self.samplerate = samplerate or default.samplerate or 48000
+        self.blocksize = blocksize or 1024
+        self.channels = channels or 1
+        self.callback = callback
+        self.latency = 0.05
+        self.active = False
+        self._thread = None
+
+    def _run(self):
+        period = self.blocksize / self.samplerate / SPEED
+        out = np.zeros((self.blocksize, self.channels), dtype=np.int16)
+        next_tick = time.monotonic()
+        while self.active:
+            self.callback(out, self.blocksize, None, CallbackFlags())
+            speaker.note(int(np.abs(out).max()) > LOUD_LEVEL)
+            next_tick += period
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self):
+        if not self.active:
+            self.active = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.active = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------- 一括録音（古い assistant_*.py の sd.rec / sd.wait） ----------
+class _Recording:
+    def __init__(self, frames, channels):
+        self.data = np.zeros((frames, channels), dtype=np.int16)
+        self.filled = 0
+        self.done = threading.Event()
+
+    def sink(self, chunk):
+        n = min(chunk.shape[0], self.data.shape[0] - self.filled)
+        self.data[self.filled:self.filled + n] = chunk[:n, None]
+        self.filled += n
+        if self.filled >= self.data.shape[0]:
+            _mic.detach(self.sink)
+            self.done.set()
+
+
+_recordings = []
+
+
+def rec(frames, samplerate=None, channels=None, dtype=None, **kwargs):
+    samplerate = samplerate or default.samplerate or 48000
+    recording = _Recording(int(frames), channels or default.channels or 1)
+    _recordings.append(recording)
+    _mic.attach(recording.sink, samplerate)
+    return recording.data
+
+
+def wait(ignore_errors=True):
+    while _recordings:
+        _recordings.pop().done.wait()
+
+
+def play(data, samplerate=None, blocking=False, **kwargs):
+    """sd.play の代役（鳴っている時間だけ待つ）"""
+    samplerate = samplerate or default.samplerate or 48000
+    duration = np.asarray(data).shape[0] / samplerate / SPEED
+
+    def run():
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            speaker.note(True)
+            time.sleep(0.02)
+        speaker.note(False)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    if blocking:
+        thread.join()
+
+
+def stop():
+    pass
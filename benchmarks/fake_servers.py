@@ -0,0 +1,426 @@
+"""
+ベンチマーク用の OpenAI / VoiceVox の代役サーバ（ローカルで動く。応答時間は分布で指定できる）。
+
+OpenAI（base_url を http://127.0.0.1:PORT/v1 にして使う）:
+    POST /v1/audio/transcriptions       文字起こし（台本どおりの文を返す。verbose_json なら区間つき）
+    POST /v1/responses                  Responses API（stream=true なら SSE で少しずつ返す）
+    POST /v1/threads ...                Assistants API（assistant/assistant.py 用の最小限）
+
+VoiceVox:
+    GET  /  /version  /speakers
+    POST /audio_query                   モーラの長さ入りのクエリを返す
+    POST /synthesis                     クエリの長さぶんの WAV を返す
+
+応答時間の指定（秒）:
+    "0.2"                 いつも 0.2
+    "uniform:0.1,0.4"     一様分布
+    "normal:0.5,0.1"      正規分布（平均, 標準偏差）
+    "lognormal:0.5,0.4"   対数正規分布（中央値, σ）
+
+リプレイ（記録したセッションの再現）では、文字起こし・返答・合成音声と、その時の応答時間を
+関数で1件ずつ渡せる（transcripts / replies / voices）。
+speed=2 なら待ち時間をすべて半分にする（実時間より速く回す）。
+"""
+import io
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+
+# =========================
+# 応答時間の分布
+# =========================
+class Latency:
+    def __init__(self, spec, seed=None, speed=1.0):
+        self.spec = str(spec)
+        self.speed = speed
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        kind, _, args = self.spec.partition(":")
+        if not args:
+            kind, args = "const", kind
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",")]
+        if self.kind not in ("const", "uniform", "normal", "lognormal"):
+            raise ValueError(f"unknown latency distribution: {self.spec}")
+
+    def sample(self):
+        a = self.args
+        with self._lock:
+            if self.kind == "const":
+                value = a[0]
+            elif self.kind == "uniform":
+                value = self.rng.uniform(a[0], a[1])
+            elif self.kind == "normal":
+                value = self.rng.gauss(a[0], a[1])
+            else:
+                value = a[0] * math.exp(self.rng.gauss(0.0, a[1]))
+        return max(0.0, value)
+
+    def sleep(self, value=None):
+        """value（秒）を省略すると分布から引く。実際に待つのは value / speed"""
+        if value is None:
+            value = self.sample()
+        time.sleep(value / self.speed)
+        return value
+
+    def __repr__(self):
+        return self.spec
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # keep-alive（本物と同じく接続を使い回せるように）
+    disable_nagle_algorithm = True    # SSE の小さい書き込みをためずにすぐ送る
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(n) if n else b""
+
+    def _json_body(self):
+        body = self._body()
+        return json.loads(body) if body else {}
+
+    def _send(self, status, body, content_type="application/json"):
+        if not isinstance(body, (bytes, bytearray)):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, port=0):
+        super().__init__(("127.0.0.1", port), handler)
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+# =========================
+# OpenAI
+# =========================
+class FakeOpenAI(_Server):
+    """
+    transcripts : 文字起こしで返す文を決める関数（呼ばれるたびに次の文 or ""）。
+                  (文, 応答時間) を返すと stt の分布の代わりにその時間を使う
+    replies     : 返答文のリスト（順番に使い回す）か、入力文 → 返答 の関数。
+                  関数は文か {"text", "ttft", "llm"}（秒。None なら分布から）を返す
+    stt / ttft / llm : 応答時間。llm は最初の文字のあとの、残り全部を送り終えるまでの時間
+    hallucination : 文が "" のアップロード（無音）に、本物の Whisper のようにでっち上げて返す文。
+                    verbose_json なら no_speech_prob が高く avg_logprob の低い区間として返す
+    """
+
+    def __init__(self, transcripts, replies, stt="0.5", ttft="0.6", llm="0.8", seed=0, port=0, speed=1.0,
+                 hallucination=None):
+        super().__init__(_OpenAIHandler, port)
+        self.transcripts = transcripts
+        self.hallucination = hallucination
+        if callable(replies):
+            self.replies = replies
+        else:
+            cycle = itertools.cycle(replies)
+            self.replies = lambda user_input: next(cycle)
+        self.speed = speed
+        self.stt = Latency(stt, seed, speed)
+        self.ttft = Latency(ttft, seed + 1, speed)
+        self.llm = Latency(llm, seed + 2, speed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.threads = {}       # thread_id -> [messages]
+        self.runs = {}          # run_id -> (thread_id, ready_at, reply)
+        self.requests = {"transcriptions": 0, "responses": 0, "runs": 0}
+
+    def next_id(self, prefix):
+        with self._lock:
+            return f"{prefix}_{next(self._ids)}"
+
+    def next_reply(self, user_input=""):
+        """(返答文, ttft秒, llm秒)"""
+        with self._lock:
+            reply = self.replies(user_input)
+        if not isinstance(reply, dict):
+            reply = {"text": reply}
+        ttft = reply.get("ttft")
+        llm = reply.get("llm")
+        return (
+            reply["text"],
+            self.ttft.sample() if ttft is None else ttft,
+            self.llm.sample() if llm is None else llm,
+        )
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] += 1
+
+
+def _response_object(resp_id, model, text, status="completed"):
+    return {
+        "id": resp_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": status,
+        "output": [{
+            "id": resp_id.replace("resp", "msg"),
+            "type": "message",
+            "role": "assistant",
+            "status": status,
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }],
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+    }
+
+
+class _OpenAIHandler(_Handler):
+    def do_POST(self):
+        server = self.server
+        path = urlparse(self.path).path
+        if path.endswith("/audio/transcriptions"):
+            verbose = b"verbose_json" in self._body()
+            server.count("transcriptions")
+            text = server.transcripts()
+            latency = None
+            if isinstance(text, tuple):
+                text, latency = text
+            server.stt.sleep(latency)
+            segment = {"no_speech_prob": 0.02, "avg_logprob": -0.25, "compression_ratio": 1.1}
+            if not text and server.hallucination:
+                text = server.hallucination
+                segment = {"no_speech_prob": 0.92, "avg_logprob": -1.3, "compression_ratio": 1.3}
+            if not verbose:
+                return self._send(200, {"text": text})
+            segments = [dict(segment, id=0, seek=0, start=0.0, end=1.0, text=text, tokens=[],
+                             temperature=0.0)] if text else []
+            return self._send(200, {"task": "transcribe", "language": "japanese", "duration": 1.0,
+                                    "text": text, "segments": segments})
+        if path.endswith("/responses"):
+            return self._responses(self._json_body())
+        if path.endswith("/threads"):
+            self._body()
+            thread_id = server.next_id("thread")
+            server.threads[thread_id] = []
+            return self._send(200, {"id": thread_id, "object": "thread", "created_at": int(time.time())})
+        parts = path.strip("/").split("/")
+        if len(parts) >= 4 and parts[-3] == "threads" and parts[-1] == "messages":
+            body = self._json_body()
+            message = _thread_message(server.next_id("msg"), parts[-2], "user", body.get("content", ""))
+            server.threads.setdefault(parts[-2], []).insert(0, message)
+            return self._send(200, message)
+        if len(parts) >= 4 and parts[-3] == "threads" and parts[-1] == "runs":
+            self._body()
+            server.count("runs")
+            run_id = server.next_id("run")
+            messages = server.threads.get(parts[-2]) or [{}]
+            user_input = messages[0].get("content", [{}])[0].get("text", {}).get("value", "")
+            reply, ttft, llm = server.next_reply(user_input)
+            ready_at = time.monotonic() + (ttft + llm) / server.speed
+            server.runs[run_id] = (parts[-2], ready_at, reply, False)
+            return self._send(200, _run_object(run_id, parts[-2], "queued"))
+        self._send(404, {"error": {"message": f"not found: {path}"}})
+
+    def do_GET(self):
+        server = self.server
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) >= 4 and parts[-4] == "threads" and parts[-2] == "runs":
+            thread_id, ready_at, reply, posted = server.runs[parts[-1]]
+            if time.monotonic() < ready_at:
+                return self._send(200, _run_object(parts[-1], thread_id, "in_progress"))
+            if not posted:
+                message = _thread_message(server.next_id("msg"), thread_id, "assistant", reply)
+                server.threads.setdefault(thread_id, []).insert(0, message)
+                server.runs[parts[-1]] = (thread_id, ready_at, reply, True)
+            return self._send(200, _run_object(parts[-1], thread_id, "completed"))
+        if len(parts) >= 3 and parts[-3] == "threads" and parts[-1] == "messages":
+            data = server.threads.get(parts[-2], [])
+            return self._send(200, {"object": "list", "data": data, "has_more": False})
+        self._send(404, {"error": {"message": "not found"}})
+
+    def _responses(self, body):
+        server = self.server
+        server.count("responses")
+        model = body.get("model", "fake")
+        resp_id = server.next_id("resp")
+        user_input = body.get("input", "")
+        reply, ttft, llm = server.next_reply(user_input if isinstance(user_input, str) else "")
+
+        if not body.get("stream"):
+            server.ttft.sleep(ttft + llm)
+            return self._send(200, _response_object(resp_id, model, reply))
+
+        # SSE（本物と同じく chunked で1イベントずつ送る）
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        seq = itertools.count()
+
+        def event(payload):
+            payload["sequence_number"] = next(seq)
+            data = json.dumps(payload, ensure_ascii=False)
+            chunk = f"event: {payload['type']}\ndata: {data}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.flush()
+
+        created = _response_object(resp_id, model, "", status="in_progress")
+        created["output"] = []
+        event({"type": "response.created", "response": created})
+        server.ttft.sleep(ttft)
+
+        pieces = [reply[i:i + 3] for i in range(0, len(reply), 3)]
+        for i, piece in enumerate(pieces):
+            if i:
+                server.llm.sleep(llm / max(1, len(pieces) - 1))
+            event({
+                "type": "response.output_text.delta",
+                "item_id": resp_id.replace("resp", "msg"),
+                "output_index": 0,
+                "content_index": 0,
+                "delta": piece,
+            })
+        event({"type": "response.completed", "response": _response_object(resp_id, model, reply)})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _thread_message(msg_id, thread_id, role, text):
+    return {
+        "id": msg_id,
+        "object": "thread.message",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "role": role,
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+    }
+
+
+def _run_object(run_id, thread_id, status):
+    return {
+        "id": run_id,
+        "object": "thread.run",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "assistant_id": "asst_fake",
+        "status": status,
+    }
+
+
+# =========================
+# VoiceVox
+# =========================
+SYNTH_RATE = 24000
+MORA_SEC = 0.11
+
+
+def synth_wav(query):
+    """クエリのモーラ長さぶんの、声っぽい（倍音＋抑揚のある）WAVを作る"""
+    speed = float(query.get("speedScale") or 1.0)
+    length = float(query.get("prePhonemeLength", 0.1)) + float(query.get("postPhonemeLength", 0.1))
+    for phrase in query.get("accent_phrases", []):
+        for mora in phrase["moras"]:
+            length += (mora.get("consonant_length") or 0) + mora["vowel_length"]
+    # 本物と同じく、前後の無音も含めたすべての長さを speedScale で割る
+    length /= speed
+    n = int(SYNTH_RATE * max(0.1, length))
+    t = np.arange(n) / SYNTH_RATE
+    f0 = 280 + 40 * np.sin(2 * np.pi * 1.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SYNTH_RATE
+    voice = np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase)
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 6 * t)
+    samples = (voice * envelope * 2500 * float(query.get("volumeScale") or 1.0)).astype(np.int16)
+    buf = io.BytesIO()
+    wav.write(buf, SYNTH_RATE, samples)
+    return buf.getvalue()
+
+
+def audio_query_for(text):
+    moras = [
+        {"text": ch, "consonant": None, "consonant_length": 0.04, "vowel": "a",
+         "vowel_length": MORA_SEC - 0.04, "pitch": 5.5}
+        for ch in text if not ch.isspace()
+    ]
+    return {
+        "accent_phrases": [{"moras": moras, "accent": 1, "pause_mora": None, "is_interrogative": False}],
+        "speedScale": 1.0,
+        "pitchScale": 0.0,
+        "intonationScale": 1.0,
+        "volumeScale": 1.0,
+        "prePhonemeLength": 0.1,
+        "postPhonemeLength": 0.1,
+        "outputSamplingRate": SYNTH_RATE,
+        "outputStereo": False,
+        "kana": text,
+    }
+
+
+class FakeVoiceVox(_Server):
+    """
+    voices : 文 → {"wav": WAV bytes, "query": 秒, "synth": 秒} の関数（リプレイ用）。
+             None を返した文や、秒が None のところは合成音・分布で代わりに作る
+    """
+
+    def __init__(self, query="0.05", synth="0.4", seed=0, port=0, voices=None, speed=1.0):
+        super().__init__(_VoiceVoxHandler, port)
+        self.query = Latency(query, seed + 10, speed)
+        self.synth = Latency(synth, seed + 11, speed)
+        self.voices = voices or (lambda text: None)
+        self._lock = threading.Lock()
+        self.requests = {"audio_query": 0, "synthesis": 0}
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] += 1
+
+
+class _VoiceVoxHandler(_Handler):
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/speakers":
+            return self._send(200, [{"name": "fake", "speaker_uuid": "0", "styles": [{"name": "normal", "id": 1}]}])
+        if path in ("/", "/version"):
+            return self._send(200, b"fake voicevox", "text/plain")
+        self._send(404, {"detail": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/audio_query":
+            self._body()
+            text = params.get("text", [""])[0]
+            self.server.count("audio_query")
+            self.server.query.sleep((self.server.voices(text) or {}).get("query"))
+            return self._send(200, audio_query_for(text))
+        if url.path == "/synthesis":
+            query = self._json_body()
+            # 文は audio_query で kana に入れておいたものを使う
+            voice = self.server.voices(query.get("kana", "")) or {}
+            self.server.count("synthesis")
+            self.server.synth.sleep(voice.get("synth"))
+            return self._send(200, voice.get("wav") or synth_wav(query), "audio/wav")
+        self._send(404, {"detail": "not found"})
@@ -0,0 +1,132 @@
+"""
+記録したセッション（session_recorder の zip）を bench_e2e.py の代役で再現するための台本を作る。
+
+・マイク: 記録したマイク音から発話の区間だけを切り出して流す（本物の子どもの声・話す間合い）
+  ニコの返事が鳴り終わってから話し始めるまでの間は、記録どおりにする
+・文字起こし: 記録した文を、記録した処理時間で返す
+・返答: 入力文ごとに記録した返答を、記録した最初の文字までの時間・全体の時間で返す
+・VoiceVox: 記録した合成音声を、記録した audio_query / synthesis の時間で返す
+  （記録時にキャッシュから出して時間が無い文は、記録の中央値を使う）
+"""
+import statistics
+import sys
+from pathlib import Path
+
+import scipy.io.wavfile as wav
+
+REPO = Path(__file__).resolve().parent.parent
+for name in ("turn_trace", "audio_codec", "session_recorder"):
+    sys.path.insert(0, str(REPO / name))
+from session_recorder import SessionArchive  # noqa: E402
+
+
+class ReplayPlan:
+    def __init__(self, archive_path, workdir):
+        self.archive = SessionArchive(archive_path)
+        self.name = self.archive.session["name"]
+        self._write_mic(Path(workdir))
+        self.utterances = self._script()
+        self._replies = self._collect_replies()
+        self._voices = self._collect_voices()
+
+    def close(self):
+        self.archive.close()
+
+    # ---------- マイク ----------
+    def _write_mic(self, workdir):
+        rate, samples = self.archive.mic()
+        self.mic_wav = str(workdir / "replay_mic.wav")
+        wav.write(self.mic_wav, rate, samples)
+
+    def _script(self):
+        """マイクの台本（fake_devices/sounddevice.py の形）と、発話ごとの文字起こし時間"""
+        texts = {e["turn"]: e["text"] for e in self.archive.of_kind("transcript")}
+        stt = self.archive.span_ms("stt")
+        played = sorted(
+            s["t"] + s["ms"] / 1000 for s in self.archive.spans if s["stage"] == "playback"
+        )
+
+        entries = []
+        previous_end = None
+        for u in self.archive.of_kind("utterance"):
+            entry = {
+                "wav": self.mic_wav,
+                "offset_sec": u["start_sec"],
+                "duration_sec": round(u["end_sec"] - u["start_sec"], 3),
+                "text": texts.get(u["turn"], ""),
+                "stt_sec": None if u["turn"] not in stt else stt[u["turn"]] / 1000,
+            }
+            start = u["spoken_at"]
+            if previous_end is not None:
+                # 前の発話のあとにニコが鳴り終わっていれば、その鳴り終わりからの間合い。
+                # 鳴る前に続けて話していたら、前の発話からの間合い
+                ends = [t for t in played if previous_end < t <= start]
+                if ends:
+                    entry["gap_sec"] = round(start - ends[-1], 3)
+                else:
+                    entry["wait_sec"] = round(max(0.0, start - previous_end), 3)
+            entries.append(entry)
+            previous_end = start + entry["duration_sec"]
+        return entries
+
+    def transcript_latencies(self):
+        """発話の番号 → 文字起こしの時間（秒）"""
+        return {i: e["stt_sec"] for i, e in enumerate(self.utterances) if e["stt_sec"] is not None}
+
+    # ---------- 返答 ----------
+    def _collect_replies(self):
+        ttft = self.archive.span_ms("llm_ttft")
+        llm = self.archive.span_ms("llm")
+        replies = {}
+        for r in self.archive.of_kind("reply"):
+            total = llm.get(r["turn"])
+            first = ttft.get(r["turn"], total)
+            replies.setdefault(r["input"], []).append({
+                "text": r["text"],
+                "ttft": None if first is None else first / 1000,
+                "llm": None if total is None else max(0.0, total - first) / 1000,
+            })
+        return replies
+
+    def reply_for(self, user_input):
+        """同じ入力が何度もあれば記録の順に返す（最後のものは使い回す）"""
+        queue = self._replies.get(user_input)
+        if not queue:
+            return {"text": "うん！"}
+        return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    # ---------- 合成音声 ----------
+    def _collect_voices(self):
+        events = self.archive.of_kind("speech")
+        medians = {}
+        for key in ("query_ms", "synth_ms"):
+            values = [e[key] for e in events if e.get(key) is not None]
+            medians[key] = statistics.median(values) if values else None
+
+        voices = {}
+        for e in events:
+            voice = voices.get(e["text"])
+            if voice is None or (voice["timed"] is False and e.get("synth_ms") is not None):
+                voices[e["text"]] = {"file": e["file"], "timed": e.get("synth_ms") is not None,
+                                     "query_ms": e.get("query_ms"), "synth_ms": e.get("synth_ms")}
+        for voice in voices.values():
+            for key in ("query_ms", "synth_ms"):
+                if voice[key] is None:
+                    voice[key] = medians[key]
+        return voices
+
+    def voice_for(self, text):
+        voice = self._voices.get(text)
+        if voice is None:
+            return None
+        if "wav" not in voice:
+            voice["wav"] = self.archive.speech(voice["file"])
+        return {
+            "wav": voice["wav"],
+            "query": None if voice["query_ms"] is None else voice["query_ms"] / 1000,
+            "synth": None if voice["synth_ms"] is None else voice["synth_ms"] / 1000,
+        }
+
+    # ---------- 比較用 ----------
+    def recorded_spans(self):
+        return self.archive.spans
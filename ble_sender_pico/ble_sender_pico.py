@@ -1,24 +1,85 @@
 import asyncio
 import threading
 import time
-from bleak import BleakClient
+from collections import deque, namedtuple
+from bleak import BleakClient, BleakScanner
+import config
 from config import PICO_MAC, WRITE_UUID
+from turn_trace import current_turn, percentile, tracer
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+PRIORITY_STOP = 0          # 非常停止。待っているほかのコマンドより先に送る
+PRIORITY_MOTION = 1
+PRIORITY_NORMAL = 2
+# 動きのコマンドは積んでからこの秒数を過ぎたら送らない（言葉から遅れて動くくらいなら動かない）
+# 期限の時計はつながっている間だけ進む（起動直後やつなぎ直しの待ちでは期限切れにしない）
+MOTION_DEADLINE_SEC = getattr(config, "BLE_MOTION_DEADLINE_SEC", 0.5)
+MOTION_PREFIXES = ("SEQ:", "FORWARD", "REVERSE")
+
+# 接続を見張る間隔（秒）。切れていたら次のコマンドを待たずにつなぎ直す（None で見張らない＝初回送信時に接続）
+KEEPALIVE_SEC = getattr(config, "BLE_KEEPALIVE_SEC", 2.0)
+# 見張りでつながらないことが続いたら、間隔を倍々にのばしてこの秒数まで待つ（Pico の電源が切れているときにスキャンし続けない）
+# つながったとき・コマンドが積まれたときに KEEPALIVE_SEC に戻す
+KEEPALIVE_MAX_SEC = getattr(config, "BLE_KEEPALIVE_MAX_SEC", 60.0)
+KEEPALIVE_WARN_SEC = 60.0  # 見張りの接続失敗の警告は、この秒数に1回まで
+SCAN_TIMEOUT = 10.0        # Pico を探す時間（最初と、つなぎ直しが続けて失敗したとき）
+CONNECT_TIMEOUT = 10.0
+RESCAN_AFTER_FAILURES = 3  # 続けてこの回数つながらなければ、Pico を探し直す
+# 書き込みに使うサービスの UUID（指定するとそのサービスだけ探すので接続が速い）
+SERVICE_UUID = getattr(config, "SERVICE_UUID", None)
+# 書き込みの方式: True=いつも応答あり（Pico に届いたことを確かめる）
+#                 False=動きのコマンドだけ応答なし（返事を待たないぶん速い。Pico の特性が対応しているときだけ）
+# STOP（非常停止）とそのほかのコマンドは、どちらでも応答ありで書く
+WRITE_RESPONSE = getattr(config, "BLE_WRITE_RESPONSE", True)
+# 接続の具合（RSSI・MTU）を turn_trace に記録する間隔（秒）。keep-alive の見張りのついでに測る
+LINK_SAMPLE_SEC = getattr(config, "BLE_LINK_SAMPLE_SEC", 10.0)
+
+# cmd: 送る文字列 / deadline: これを過ぎたら送らない（time.monotonic。None なら期限なし）
+Command = namedtuple("Command", "cmd priority deadline enqueued_at turn")
 
 _loop = None
 _thread = None
 _ready = threading.Event()
 
-_cmd_queue = None          # asyncio.Queue (loop内で作る)
+_pending = []              # 送る前のコマンド（ループのスレッドだけが触る）
+_has_pending = None        # asyncio.Event (loop内で作る)
+_link_lock = None          # asyncio.Lock（worker と keep-alive が同時につながないように）
+_link_lost = None          # asyncio.Event（切断されたら keep-alive を起こす）
+
+# つなぎ直しを速くするため、見つけた Pico（BLEDevice）・クライアント・書き込み先は捨てずに使い回す
+_device = None
 _client = None
-_connected = False
+_char = None
+_motion_response = True   # 動きのコマンドを応答ありで書くか（つないだときに決める）
+_connect_failures = 0
+_link_up_at = None         # いまの接続がつながった時刻（time.monotonic。切れていれば None）
+_keepalive_delay = KEEPALIVE_SEC  # 見張りの次の確認までの秒数（つながらないと KEEPALIVE_MAX_SEC までのびる）
+
+# sent=送った / dropped=STOP に追い越されて捨てた / coalesced=後の同じ種類のコマンドにまとめた
+# late=期限を過ぎたので送らなかった / failed=書き込みに失敗した
+# connects=つないだ回数 / reconnects=そのうち2回目以降 / link_lost=切断を検出した回数
+_counters = {
+    "sent": 0, "dropped": 0, "coalesced": 0, "late": 0, "failed": 0,
+    "connects": 0, "reconnects": 0, "link_lost": 0,
+}
+_counters_lock = threading.Lock()
+_connect_ms = deque(maxlen=50)
+_queue_ms = deque(maxlen=500)     # 積んでから書き込みを始めるまで（接続待ちも含む）
+_write_ms = deque(maxlen=500)     # 書き込み（応答ありなら Pico の返事まで）
 
 def _loop_thread():
-    global _loop, _cmd_queue
+    global _loop, _has_pending, _link_lock, _link_lost
     _loop = asyncio.new_event_loop()
     asyncio.set_event_loop(_loop)
-    _cmd_queue = asyncio.Queue()
+    _has_pending = asyncio.Event()
+    _link_lock = asyncio.Lock()
+    _link_lost = asyncio.Event()
     _ready.set()
     _loop.create_task(_ble_worker())
+    if KEEPALIVE_SEC:
+        _loop.create_task(_keep_link())
     _loop.run_forever()
 
 def _ensure_loop():
@@ -31,28 +92,202 @@ def _ensure_loop():
     if _loop is None:
         raise RuntimeError("BLE loop failed to start")
 
-async def _connect():
-    global _client, _connected
-    if _client is not None:
-        try:
-            await _client.disconnect()
-        except:
-            pass
-        _client = None
-        _connected = False
+async def _resolve_device():
+    """Pico の BLEDevice（見つけたら覚えておき、次からは探さずにつなぐ）"""
+    global _device
+    if _device is None:
+        t0 = time.monotonic()
+        device = await BleakScanner.find_device_by_address(PICO_MAC, timeout=SCAN_TIMEOUT)
+        if device is None:
+            raise RuntimeError(f"{PICO_MAC} が見つかりません")
+        print(f"🔎 Pico を見つけました ({(time.monotonic() - t0) * 1000:.0f}ms)")
+        _device = device
+    return _device
+
+def _on_disconnected(client):
+    global _link_up_at
+    _link_up_at = None
+    _count("link_lost")
+    print("🔌 BLE切断を検出")
+    if _link_lost is not None:
+        _link_lost.set()
 
-    _client = BleakClient(PICO_MAC)
+def _use_motion_response(char):
+    if WRITE_RESPONSE:
+        return True
+    return "write-without-response" not in (getattr(char, "properties", None) or [])
+
+def _use_response(cmd):
+    """このコマンドを応答ありで書くか（応答なしにできるのは動きだけ）"""
+    return _motion_response if _kind(cmd) == "motion" else True
+
+async def _connect():
+    global _device, _client, _char, _motion_response, _connect_failures, _link_up_at, _keepalive_delay
+    device = await _resolve_device()
+    if _client is None:
+        options = {"services": [SERVICE_UUID]} if SERVICE_UUID else {}
+        _client = BleakClient(device, disconnected_callback=_on_disconnected, **options)
 
     # connect は失敗しうるのでリトライ前提
     print(f"➡ Connecting to {PICO_MAC}")
-    await _client.connect()
-    _connected = True
+    t0 = time.monotonic()
+    try:
+        await _client.connect(timeout=CONNECT_TIMEOUT)
+    except Exception:
+        _connect_failures += 1
+        if _connect_failures >= RESCAN_AFTER_FAILURES:
+            # 続けて失敗するなら、覚えている Pico の情報が古いのかもしれない。次は探し直す
+            _device = _client = None
+            _connect_failures = 0
+        raise
+    t1 = time.monotonic()
+    _link_up_at = t1
+    _connect_failures = 0
+    _keepalive_delay = KEEPALIVE_SEC
+    # 書き込み先の特性は1回だけ引いておく（毎回 UUID から探さない）
+    _char = _client.services.get_characteristic(WRITE_UUID) or WRITE_UUID
+    _motion_response = _use_motion_response(_char)
+
+    with _counters_lock:
+        reconnect = _counters["connects"] > 0
+        _counters["connects"] += 1
+        _counters["reconnects"] += int(reconnect)
+        _connect_ms.append((t1 - t0) * 1000)
+    tracer.record("ble_connect", t0, t1, reconnect=reconnect, motion_response=_motion_response)
+    print(
+        f"✅ BLE接続 ({(t1 - t0) * 1000:.0f}ms{'・つなぎ直し' if reconnect else ''}"
+        f"{'' if _motion_response else '・動きは応答なしで書き込み'})"
+    )
 
 async def _ensure_connected():
-    global _connected
-    if _connected and _client is not None and _client.is_connected:
+    async with _link_lock:
+        if _client is not None and _client.is_connected:
+            return
+        await _connect()
+
+async def _keep_link():
+    """
+    起動したらすぐつなぎ（あいさつの合成と並行）、その後も見張り続ける。
+    切れていたら、次のコマンドが来る前につなぎ直しておく。
+    つながらないことが続いたら、確認の間隔を KEEPALIVE_MAX_SEC までのばす。
+    """
+    global _keepalive_delay
+    sampled_at = 0.0
+    failures = 0
+    warned_at = None
+    while True:
+        if _client is None or not _client.is_connected:
+            try:
+                await _ensure_connected()
+                failures = 0
+                warned_at = None
+            except Exception as e:
+                failures += 1
+                _keepalive_delay = min(_keepalive_delay * 2, KEEPALIVE_MAX_SEC)
+                now = time.monotonic()
+                if warned_at is None or now - warned_at >= KEEPALIVE_WARN_SEC:
+                    warned_at = now
+                    print(f"⚠ BLE接続失敗(keep-alive・{failures}回目・次は{_keepalive_delay:.0f}秒後): {e}")
+        if LINK_SAMPLE_SEC and _client is not None and _client.is_connected:
+            if time.monotonic() - sampled_at >= LINK_SAMPLE_SEC:
+                sampled_at = time.monotonic()
+                await _sample_link()
+        try:
+            await asyncio.wait_for(_link_lost.wait(), _keepalive_delay)
+        except asyncio.TimeoutError:
+            pass
+        _link_lost.clear()
+
+async def _read_rssi():
+    """
+    つながっている Pico の RSSI（dBm）。取れなければ None。
+    get_rssi() のあるバックエンドはそれを使い、BlueZ ではデバイスのプロパティ
+    （最後に広告を受けたときの値）を読む。接続間隔は bleak から取れないので記録しない。
+    """
+    get_rssi = getattr(_client, "get_rssi", None)
+    if callable(get_rssi):
+        try:
+            return await get_rssi()
+        except Exception:
+            pass
+    details = getattr(_device, "details", None)
+    props = details.get("props", {}) if isinstance(details, dict) else {}
+    return props.get("RSSI")
+
+async def _sample_link():
+    now = time.monotonic()
+    tracer.record(
+        "ble_link", now, now,
+        rssi=await _read_rssi(), mtu=getattr(_client, "mtu_size", None),
+    )
+
+# =========================
+# 送る前のコマンド（優先度・期限・まとめ）
+# =========================
+def _kind(cmd):
+    if cmd == "STOP":
+        return "stop"
+    if cmd.startswith(MOTION_PREFIXES):
+        return "motion"
+    return "other"
+
+def _count(key, n=1):
+    if n:
+        with _counters_lock:
+            _counters[key] += n
+
+def _enqueue(command):
+    """
+    ループのスレッドで呼ぶ。
+    ・STOP: 先に積まれている動きは止められるだけなので捨てる（STOP どうしは1つにまとめる）
+    ・動き: Pico は新しい動きが届くと前の動きをやめるので、先に積まれている動きは新しいほうにまとめる
+    ・そのほか: 直前と同じコマンドならまとめる
+    """
+    global _pending, _keepalive_delay
+    # コマンドが来たならロボットを使うつもり。見張りの間隔を元に戻す
+    _keepalive_delay = KEEPALIVE_SEC
+    kind = _kind(command.cmd)
+    if kind == "stop":
+        kept = [c for c in _pending if _kind(c.cmd) not in ("stop", "motion")]
+        _count("dropped", sum(1 for c in _pending if _kind(c.cmd) == "motion"))
+        _count("coalesced", sum(1 for c in _pending if _kind(c.cmd) == "stop"))
+        _pending = kept
+    elif kind == "motion":
+        kept = [c for c in _pending if _kind(c.cmd) != "motion"]
+        _count("coalesced", len(_pending) - len(kept))
+        _pending = kept
+    elif _pending and _pending[-1].cmd == command.cmd:
+        _count("coalesced")
+        return
+    _pending.append(command)
+    _has_pending.set()
+
+def _expire(now=None):
+    """
+    期限を過ぎたコマンドを捨てる。
+    期限はつながってから数える（つながる前に積んだコマンドは、つながるまで待った時間だけ期限をのばす）。
+    つながっていない間は何も捨てない。
+    """
+    global _pending
+    if _link_up_at is None or _client is None or not _client.is_connected:
         return
-    await _connect()
+    now = time.monotonic() if now is None else now
+    kept = []
+    for c in _pending:
+        deadline = c.deadline
+        if deadline is not None and c.enqueued_at < _link_up_at:
+            deadline += _link_up_at - c.enqueued_at
+        if deadline is not None and now > deadline:
+            print(f"⌛ BLE: 間に合わなかったので送りません: {c.cmd}（{now - deadline:.2f}秒遅れ）")
+            _count("late")
+        else:
+            kept.append(c)
+    _pending = kept
+
+def _pop_next():
+    """優先度の高いものから。同じ優先度なら積んだ順"""
+    index = min(range(len(_pending)), key=lambda i: (_pending[i].priority, i))
+    return _pending.pop(index)
 
 async def _ble_worker():
     """
@@ -61,10 +296,14 @@ async def _ble_worker():
     """
     backoff = 0.3
     while True:
-        cmd = await _cmd_queue.get()
+        await _has_pending.wait()
         try:
             # 接続できるまでリトライ（InProgressにならない）
+            # 待っている間に届いた STOP や、古くなった動きは次に送るものを選ぶときに反映される
             while True:
+                _expire()
+                if not _pending:
+                    break
                 try:
                     await _ensure_connected()
                     break
@@ -74,28 +313,80 @@ async def _ble_worker():
                     backoff = min(backoff * 1.5, 3.0)
 
             backoff = 0.3  # 接続できたら戻す
+            _expire()
+            if not _pending:
+                continue
+            command = _pop_next()
+        finally:
+            if not _pending:
+                _has_pending.clear()
 
+        cmd = command.cmd
+        response = _use_response(cmd)
+        try:
             # 送信
-            await _client.write_gatt_char(WRITE_UUID, cmd.encode())
+            t0 = time.monotonic()
+            await _client.write_gatt_char(_char, cmd.encode(), response=response)
+            t1 = time.monotonic()
+            _count("sent")
+            queue_ms, write_ms = (t0 - command.enqueued_at) * 1000, (t1 - t0) * 1000
+            with _counters_lock:
+                _queue_ms.append(queue_ms)
+                _write_ms.append(write_ms)
+            # キューに積んでから書き込み完了まで（接続待ちも含む）
+            tracer.record(
+                "ble", command.enqueued_at, t1, turn=command.turn, cmd=cmd,
+                queue_ms=round(queue_ms, 1), write_ms=round(write_ms, 1), response=response,
+            )
             print("📤 送信:", cmd)
 
         except Exception as e:
-            # 送信失敗→接続を捨てて次で再接続
+            # 送信失敗→切って次で再接続（見つけた Pico とクライアントは使い回す）
+            _count("failed")
             print(f"⚠ BLE送信失敗: {cmd} / {e}")
             try:
                 await _client.disconnect()
             except:
                 pass
-            globals()["_client"] = None
-            globals()["_connected"] = False
 
-        finally:
-            _cmd_queue.task_done()
-
-def send_cmd(cmd: str):
+def send_cmd(cmd: str, enqueued_at=None, turn=None, priority=None, deadline=None):
     """
     既存互換：同期関数のまま呼べる。
     ただし「キューに積むだけ」なので速い＆安全。
+
+    enqueued_at（time.monotonic）/ turn は計測用。手前にもう1段キューがあるときに渡す。
+    priority を省くと STOP は PRIORITY_STOP、動きは PRIORITY_MOTION。
+    deadline（time.monotonic）を省くと、動きは積んでから MOTION_DEADLINE_SEC で期限切れになる。
+    どちらの期限も、つながる前に積んだときはつながった時刻から数える。
     """
+    if enqueued_at is None:
+        enqueued_at = time.monotonic()
+    if turn is None:
+        turn = current_turn()
+    kind = _kind(cmd)
+    if priority is None:
+        priority = {"stop": PRIORITY_STOP, "motion": PRIORITY_MOTION}.get(kind, PRIORITY_NORMAL)
+    if deadline is None and kind == "motion" and MOTION_DEADLINE_SEC is not None:
+        deadline = enqueued_at + MOTION_DEADLINE_SEC
     _ensure_loop()
-    _loop.call_soon_threadsafe(_cmd_queue.put_nowait, cmd)
+    _loop.call_soon_threadsafe(_enqueue, Command(cmd, priority, deadline, enqueued_at, turn))
+
+def connect_early():
+    """起動時に呼ぶ: BLE のループを起こして、最初のコマンドを待たずにつなぎ始める"""
+    _ensure_loop()
+
+def stats():
+    """送った・捨てた・まとめた・遅れたコマンドの数と、接続・待ち・書き込みにかかった時間（ms）"""
+    with _counters_lock:
+        last_connect_ms = _connect_ms[-1] if _connect_ms else None
+        connect_ms = sorted(_connect_ms)
+        queue_ms = sorted(_queue_ms)
+        write_ms = sorted(_write_ms)
+        result = dict(_counters)
+    result["motion_response"] = _motion_response
+    result["connect_ms_last"] = None if last_connect_ms is None else round(last_connect_ms)
+    result["connect_ms_p50"] = None if not connect_ms else round(percentile(connect_ms, 50))
+    for name, values in (("queue_ms", queue_ms), ("write_ms", write_ms)):
+        result[f"{name}_p50"] = None if not values else round(percentile(values, 50), 1)
+        result[f"{name}_p95"] = None if not values else round(percentile(values, 95), 1)
+    return result
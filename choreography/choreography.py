@@ -0,0 +1,103 @@
+"""
+ニコの動き（振り付け）を1回の BLE 書き込みで Pico に送るための形式と、名前つきの振り付け。
+
+パケットの形（Pico 側はこれを読んで順に動き、最後に必ず止まる）:
+
+    SEQ:F2,W0.1,R2
+        F<秒>  前進      (FORWARD)
+        R<秒>  後退      (REVERSE)
+        W<秒>  止まって待つ
+    ・最後のステップのあとは STOP（書かなくてよい）
+    ・動いている途中に次の SEQ か STOP が届いたら、いまの動きをやめてそちらに従う
+
+1回の書き込みで届くように、パケットは MAX_PACKET_BYTES 以下にする
+（BLE の既定の MTU 23 から ATT ヘッダ 3 バイトを引いた 20 バイト）。
+"""
+from collections import namedtuple
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+PREFIX = "SEQ:"
+MAX_PACKET_BYTES = 20
+MAX_STEP_SEC = 10.0
+
+DIRECTIONS = {"F": "FORWARD", "R": "REVERSE", "W": None}
+
+# 名前 → 振り付け（"F2,W0.1,R2" のようにステップをカンマでつなぐ）
+DEFAULT_CHOREOGRAPHIES = {
+    "greeting": "F1.5",            # あいさつ: 少し前に出る
+    "goodword": "F2,W0.1,R2",      # 良い言葉: 前進 → ひと呼吸 → 後退
+}
+
+Step = namedtuple("Step", "direction seconds")
+
+
+def _seconds(value):
+    """2.0 → "2"、0.25 → "0.25"（パケットを短くする）"""
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def parse_steps(text):
+    """"F2,W0.1,R2"（"SEQ:" は付いていてもよい）→ [Step, ...]"""
+    if text.startswith(PREFIX):
+        text = text[len(PREFIX):]
+    steps = []
+    for item in text.split(","):
+        item = item.strip()
+        direction, seconds = item[:1].upper(), item[1:]
+        if direction not in DIRECTIONS:
+            raise ValueError(f"振り付けのステップが読めません: {item!r}")
+        try:
+            seconds = float(seconds)
+        except ValueError:
+            raise ValueError(f"振り付けのステップの秒数が読めません: {item!r}") from None
+        if not 0 < seconds <= MAX_STEP_SEC:
+            raise ValueError(f"振り付けのステップは 0〜{MAX_STEP_SEC:g} 秒にしてください: {item!r}")
+        steps.append(Step(direction, seconds))
+    return steps
+
+
+def encode(steps):
+    """[Step, ...] → 1回で送れるパケット（文字列）"""
+    packet = PREFIX + ",".join(f"{s.direction}{_seconds(s.seconds)}" for s in steps)
+    if len(packet.encode()) > MAX_PACKET_BYTES:
+        raise ValueError(f"振り付けが長すぎて1回で送れません（{len(packet.encode())} バイト）: {packet}")
+    return packet
+
+
+def legacy_commands(steps):
+    """SEQ を読めない Pico 用: [(送るコマンド or None, そのあと待つ秒), ...]（最後の STOP は呼び出し側で）"""
+    return [
+        (None if DIRECTIONS[s.direction] is None else f"{DIRECTIONS[s.direction]}:{s.seconds}", s.seconds)
+        for s in steps
+    ]
+
+
+class ChoreographyRegistry:
+    """名前つきの振り付け。作るときにすべて読んでパケットにしておく（送るときは引くだけ）"""
+
+    def __init__(self, choreographies=None):
+        self._steps = {}
+        self._packets = {}
+        for name, text in {**DEFAULT_CHOREOGRAPHIES, **(choreographies or {})}.items():
+            self.register(name, text)
+
+    def register(self, name, text):
+        steps = parse_steps(text) if isinstance(text, str) else [Step(*s) for s in text]
+        self._packets[name] = encode(steps)
+        self._steps[name] = steps
+
+    def names(self):
+        return list(self._packets)
+
+    def packet(self, name):
+        return self._packets[name]
+
+    def steps(self, name):
+        return list(self._steps[name])
+
+    def duration(self, name):
+        """動き終わって止まるまでの秒数"""
+        return sum(s.seconds for s in self._steps[name])
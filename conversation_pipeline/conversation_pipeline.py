@@ -0,0 +1,389 @@
+"""
+会話パイプライン（asyncio）。
+
+録音 → 文字起こし → 返答生成 → 合成 → 再生（→ 動作）を段ごとのタスクに分け、
+大きさの決まったキューでつなぐ。
+・段ごとにタイムアウトがあり、どこかが詰まっても会話全体は止まらない
+・録音段は返答の再生中も次の発話を待ち続ける（再生と次のターンの録音が重なる）
+・interrupt() すると、いまのターンの残り（生成・合成・再生）を捨てる（割り込み用）
+・発話ごとにターン番号を振り、各段の処理に turn_trace のターン番号として引き継ぐ
+・返答の断片ごとに "fragment" スパンを記録する（合成段に届いてから再生に渡すまで）
+    wait_ms  : 合成段に届いてから合成を始めるまで（合成ワーカーの空き待ち）
+    synth_ms : 合成にかかった時間
+    stall_ms : 再生段がこの断片の合成完了を待った時間（前の断片が鳴り終わる前に合成が終われば 0 に近い）
+
+録音・STT・VoiceVox などの処理はブロックする関数のまま渡してよい（スレッドで実行する）。
+タイムアウトした処理はスレッド側では走り続けるので、結果を待たずに捨てるだけになる。
+ただし録音だけは、次の録音と同じマイクを取り合わないよう、やめさせてから終わるのを待つ。
+"""
+import asyncio
+import functools
+import itertools
+import threading
+import time
+
+from turn_trace import set_turn, tracer
+from word_matcher import WordMatcher
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+STAGE_TIMEOUTS = {
+    "capture": 30.0,      # 1発話の切り出し（無音ならもっと早く戻ってくる）
+    "stt": 20.0,          # 文字起こし
+    "llm_first": 15.0,    # 返答の最初の断片が届くまで
+    "llm": 40.0,          # 返答全体
+    "tts": 20.0,          # 1断片の合成
+    "play_start": 10.0,   # 1断片が鳴り始めるまで
+    "drain": 60.0,        # 最後の断片が鳴り終わるまで
+}
+QUEUE_SIZES = {
+    "utterance": 1,       # 録音 → STT
+    "text": 1,            # STT → 返答生成
+    "fragment": 8,        # 返答生成 → 合成
+    "motion": 1,          # 再生 → 動作（動いている間の要求は捨てる）
+}
+TTS_WORKERS = 2
+
+_TURN_END = object()
+
+
+class Turn:
+    """1回の返答。interrupt() されたら cancelled になり、残りの断片は捨てられる"""
+
+    def __init__(self, turn_id, text, heard_at=None):
+        self.id = turn_id
+        self.text = text
+        self.heard_at = heard_at      # 話し終わりを検出した時刻（time.monotonic）
+        self.cancelled = False
+        self.llm_stopped = False
+        self.moved = False
+        self.played = 0
+        self.done = asyncio.Event()
+
+
+class ConversationPipeline:
+    """
+    capture(should_stop)         -> 1発話（None=録音エラー）
+        should_stop() が True になったら（タイムアウト）切り出しをやめて戻る
+    transcribe(utterance)        -> 文字列（"" なら無音、None ならエラー）
+    respond(previous_response_id, text, on_fragment, should_stop) -> (返答全文, Response ID)
+        返答の断片ができるたびに on_fragment(text) を呼ぶ。should_stop() が True ならやめる
+    synthesize(text)             -> 音声 or None
+    play(text, audio, index)     -> 鳴り始めたら戻る（再生中の断片を返してもよい）
+    wait_idle()                  -> 鳴り終わるまで待つ
+    motion_for(text)             -> その断片に合わせて動かす関数 or None（1返答につき1回）
+        断片が鳴り始めてから呼ぶ。play が値を返したときは action(その値) で呼ぶ
+
+    STOP ワード・無視ワード・無反応タイムアウトの扱いは従来のループと同じ。
+    words には "stop" / "ignore" のカテゴリを持つ WordMatcher を渡す
+    （渡さなければ stop_words / ignore_words のリストから作る）。
+    run() は STOP ワードか無反応でおわかれを言い終わったら "stop" / "inactive" を返す。
+    """
+
+    def __init__(
+        self,
+        capture,
+        transcribe,
+        respond,
+        synthesize,
+        play,
+        wait_idle,
+        motion_for=None,
+        stop_words=(),
+        ignore_words=(),
+        words=None,
+        inactivity_timeout=None,
+        goodbye_reply=None,
+        fallback_reply=None,
+        tts_workers=TTS_WORKERS,
+        timeouts=None,
+        queue_sizes=None,
+    ):
+        self.capture = capture
+        self.transcribe = transcribe
+        self.respond = respond
+        self.synthesize = synthesize
+        self.play = play
+        self.wait_idle = wait_idle
+        self.motion_for = motion_for
+        self.words = words or WordMatcher.from_lists(stop=list(stop_words), ignore=list(ignore_words))
+        self.inactivity_timeout = inactivity_timeout
+        self.goodbye_reply = goodbye_reply
+        self.fallback_reply = fallback_reply
+        self.tts_workers = tts_workers
+        self.timeouts = {**STAGE_TIMEOUTS, **(timeouts or {})}
+        self.queue_sizes = {**QUEUE_SIZES, **(queue_sizes or {})}
+        self.response_id = None
+        self._turn_ids = itertools.count(1)
+        self._turns = set()
+        self._loop = None
+
+    # ---------- 外から ----------
+    def interrupt(self):
+        """
+        いまのターンの残りを捨てる（どのスレッドから呼んでもよい）。
+        _turns はループのスレッドで増減するので、捨てる処理はループに頼む。
+        """
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._cancel_turns)
+        except RuntimeError:
+            pass  # run() が終わってループが閉じている
+
+    def _cancel_turns(self):
+        for turn in self._turns:
+            turn.cancelled = True
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._utterances = asyncio.Queue(self.queue_sizes["utterance"])
+        self._texts = asyncio.Queue(self.queue_sizes["text"])
+        self._fragments = asyncio.Queue(self.queue_sizes["fragment"])
+        self._playable = asyncio.Queue(max(1, self.tts_workers))
+        self._motions = asyncio.Queue(self.queue_sizes["motion"])
+
+        stages = [
+            asyncio.create_task(self._capture_stage(), name="capture"),
+            asyncio.create_task(self._stt_stage(), name="stt"),
+            asyncio.create_task(self._tts_stage(), name="tts"),
+            asyncio.create_task(self._playback_stage(), name="playback"),
+            asyncio.create_task(self._motion_stage(), name="motion"),
+        ]
+        dialog = asyncio.create_task(self._dialog_stage(), name="dialog")
+        try:
+            # 会話段が終わる（STOP・無反応）か、どこかの段が例外で落ちるまで
+            done, _ = await asyncio.wait([dialog, *stages], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not dialog:
+                    raise RuntimeError(f"{task.get_name()} 段が止まりました") from task.exception()
+            return dialog.result()
+        finally:
+            for task in [dialog, *stages]:
+                task.cancel()
+            await asyncio.gather(dialog, *stages, return_exceptions=True)
+
+    # ---------- 共通 ----------
+    async def _call(self, stage, fn, *args):
+        return await asyncio.wait_for(asyncio.to_thread(fn, *args), self.timeouts[stage])
+
+    # ---------- 録音 ----------
+    async def _capture_stage(self):
+        while True:
+            turn_id = next(self._turn_ids)
+            set_turn(turn_id)
+            stop = threading.Event()
+            task = asyncio.ensure_future(asyncio.to_thread(self.capture, stop.is_set))
+            try:
+                done, _ = await asyncio.wait([task], timeout=self.timeouts["capture"])
+                if not done:
+                    # スレッドを残したまま次の録音を始めないよう、やめさせて終わるまで待つ
+                    print("⏱ 録音がタイムアウトしました")
+                    stop.set()
+                    await asyncio.wait([task])
+                    if task.exception() is not None:
+                        print("❌ 録音エラー:", task.exception())
+                    continue
+            finally:
+                stop.set()
+            utterance = task.result()
+            if utterance is None:
+                continue
+            await self._utterances.put((turn_id, time.monotonic(), utterance))
+
+    # ---------- 文字起こし ----------
+    async def _stt_stage(self):
+        while True:
+            turn_id, heard_at, utterance = await self._utterances.get()
+            set_turn(turn_id)
+            try:
+                text = await self._call("stt", self.transcribe, utterance)
+            except asyncio.TimeoutError:
+                print("⏱ 文字起こしがタイムアウトしました")
+                continue
+            if text is None:
+                continue
+            await self._texts.put((turn_id, heard_at, text))
+
+    # ---------- 会話（STOP・無視ワード・無反応 と 返答生成） ----------
+    async def _dialog_stage(self):
+        last_valid_input_time = time.time()
+        while True:
+            turn_id, heard_at, text = await self._texts.get()
+            set_turn(turn_id)
+            now = time.time()
+
+            found = self.words.categories(text)
+            if not text:
+                print("(無音)")
+            elif "ignore" in found:
+                print("(無視ワード)")
+            else:
+                print(f"📝 子供: {text}")
+                if "stop" in found:
+                    await self._say(self.goodbye_reply, turn_id)
+                    return "stop"
+                await self._respond(text, turn_id, heard_at)
+                last_valid_input_time = now
+
+            if self.inactivity_timeout is not None and now - last_valid_input_time > self.inactivity_timeout:
+                await self._say(self.goodbye_reply, turn_id)
+                return "inactive"
+
+    async def _say(self, text, turn_id):
+        """決まった文をしゃべり、鳴り終わるまで待つ"""
+        turn = self._open_turn(turn_id, text)
+        print(f"🤖 ニコ: {text}")
+        await self._fragments.put((turn, text))
+        await self._fragments.put((turn, _TURN_END))
+        await turn.done.wait()
+
+    def _open_turn(self, turn_id, text, heard_at=None):
+        turn = Turn(turn_id, text, heard_at)
+        self._turns.add(turn)
+        return turn
+
+    async def _respond(self, text, turn_id, heard_at):
+        turn = self._open_turn(turn_id, text, heard_at)
+        loop = self._loop
+        got_first = asyncio.Event()
+
+        def on_fragment(fragment):
+            # 生成スレッドから呼ばれる。合成段が詰まっていればここで待つ（背圧）
+            if turn.llm_stopped:
+                return
+            print(f"🤖 ニコ: {fragment}")
+            future = asyncio.run_coroutine_threadsafe(self._fragments.put((turn, fragment)), loop)
+            future.result(timeout=self.timeouts["llm"])
+            loop.call_soon_threadsafe(got_first.set)
+
+        task = asyncio.ensure_future(
+            asyncio.to_thread(
+                self.respond,
+                self.response_id,
+                text,
+                on_fragment,
+                lambda: turn.cancelled or turn.llm_stopped,
+            )
+        )
+
+        started = loop.time()
+        first = asyncio.ensure_future(got_first.wait())
+        await asyncio.wait([task, first], timeout=self.timeouts["llm_first"], return_when=asyncio.FIRST_COMPLETED)
+        first.cancel()
+        if not task.done() and not got_first.is_set():
+            print("⏱ 返答の最初の文が届きません")
+        else:
+            remaining = self.timeouts["llm"] - (loop.time() - started)
+            await asyncio.wait([task], timeout=max(0.0, remaining))
+            if not task.done():
+                print("⏱ 返答の生成がタイムアウトしました")
+
+        if task.done() and task.exception() is None:
+            _, self.response_id = task.result()
+        else:
+            # 生成スレッドには「もうやめて」とだけ伝え、結果は待たない
+            turn.llm_stopped = True
+            if task.done():
+                print("❌ 返答生成エラー:", task.exception())
+            if not got_first.is_set() and self.fallback_reply:
+                print(f"🤖 ニコ: {self.fallback_reply}")
+                await self._fragments.put((turn, self.fallback_reply))
+        await self._fragments.put((turn, _TURN_END))
+
+    # ---------- 合成（並列、順番は保つ） ----------
+    async def _tts_stage(self):
+        slots = asyncio.Semaphore(max(1, self.tts_workers))
+        while True:
+            turn, fragment = await self._fragments.get()
+            job, timing = None, None
+            if fragment is not _TURN_END:
+                if turn.cancelled or turn.done.is_set():
+                    continue
+                set_turn(turn.id)
+                timing = {"queued_at": time.monotonic()}
+                await slots.acquire()
+                job = asyncio.create_task(self._synthesize(fragment, slots, timing))
+            await self._playable.put((turn, fragment, job, timing))
+
+    async def _synthesize(self, fragment, slots, timing):
+        timing["synth_at"] = time.monotonic()
+        try:
+            return await self._call("tts", self.synthesize, fragment)
+        except asyncio.TimeoutError:
+            print(f"⏱ 合成がタイムアウトしました: {fragment}")
+            return None
+        except Exception as e:
+            print(f"⚠ 合成エラー: {fragment} / {e}")
+            return None
+        finally:
+            timing["synth_done_at"] = time.monotonic()
+            slots.release()
+
+    # ---------- 再生 ----------
+    async def _playback_stage(self):
+        while True:
+            turn, fragment, job, timing = await self._playable.get()
+            set_turn(turn.id)
+
+            if fragment is _TURN_END:
+                if not turn.cancelled and turn.played:
+                    try:
+                        await self._call("drain", self.wait_idle)
+                    except asyncio.TimeoutError:
+                        print("⏱ 再生が終わりません")
+                self._turns.discard(turn)
+                turn.done.set()
+                continue
+
+            waited_at = time.monotonic()
+            audio = await job
+            if turn.cancelled:
+                continue
+            ready_at = time.monotonic()
+            tracer.record(
+                "fragment", timing["queued_at"], ready_at,
+                index=turn.played, chars=len(fragment), audio=bool(audio),
+                wait_ms=round((timing["synth_at"] - timing["queued_at"]) * 1000, 1),
+                synth_ms=round((timing["synth_done_at"] - timing["synth_at"]) * 1000, 1),
+                stall_ms=round((ready_at - waited_at) * 1000, 1),
+            )
+            if not audio:
+                continue
+
+            try:
+                playing = await self._call("play_start", self.play, fragment, audio, turn.played)
+                if turn.played == 0 and turn.heard_at is not None:
+                    tracer.record("first_audio", turn.heard_at, time.monotonic())
+                turn.played += 1
+            except asyncio.TimeoutError:
+                print(f"⏱ 再生が始まりません: {fragment}")
+                continue
+            except Exception as e:
+                print(f"⚠ 再生エラー: {fragment} / {e}")
+                continue
+
+            # 動きは鳴り始めてから積む（言葉に合わせるための時刻は再生中の断片からわかる）
+            if self.motion_for is not None and not turn.moved:
+                action = self.motion_for(fragment)
+                if action is not None:
+                    turn.moved = True
+                    if playing is not None:
+                        action = functools.partial(action, playing)
+                    try:
+                        self._motions.put_nowait((turn.id, action))
+                    except asyncio.QueueFull:
+                        print("(動作中のため動きをスキップ)")
+
+    # ---------- 動作 ----------
+    async def _motion_stage(self):
+        while True:
+            turn_id, action = await self._motions.get()
+            set_turn(turn_id)
+            try:
+                await asyncio.to_thread(action)
+            except Exception as e:
+                print("⚠ 動作エラー:", e)
@@ -6,12 +6,12 @@ import lgpio
 from gpiozero import Button, LED, Device
 from gpiozero.pins.lgpio import LGPIOFactory
 import socket
-import requests
 import os
 import threading
 import traceback
 import atexit
 import config
+from voicevox_client import VoiceVoxClient
 from enum import Enum
 from datetime import datetime
   
@@ -217,19 +217,20 @@ def start_ec2():
 
 def wait_for_voicevox(host, port=VOICEVOX_PORT, timeout=60):
     print(f"🔄 VoiceVox 起動確認中: http://{host}:{port}")
+    voicevox = VoiceVoxClient(f"http://{host}:{port}", connect_timeout=3, read_timeout=3, retries=0)
     start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            with socket.create_connection((host, port), timeout=3):
-                response = requests.get(f"http://{host}:{port}", timeout=3)
-                if response.status_code == 200:
-                    speakers_response = requests.get(f"http://{host}:{port}/speakers", timeout=3)
-                    if speakers_response.status_code == 200:
+    try:
+        while time.time() - start_time < timeout:
+            try:
+                with socket.create_connection((host, port), timeout=3):
+                    if voicevox.is_ready(timeout=3):
                         print("✅ VoiceVox 完全起動確認！")
                         return True
-        except Exception as e:
-            print(f"⏳ ポート接続待ち中… {e}")
-        time.sleep(2)
+            except Exception as e:
+                print(f"⏳ ポート接続待ち中… {e}")
+            time.sleep(2)
+    finally:
+        voicevox.close()
     print("❌ VoiceVox 起動タイムアウト")
     return False
 
@@ -351,7 +352,15 @@ def handle_shutdown():
 def play_button_prompt():
     print("🔈『ボタンを押してね』の音声を再生します...")
     try:
-        subprocess.run(["aplay",  config.BUTTON_AUDIO_PATH], check=True)
+        # audio_output は numpy / scipy / PortAudio を使う。起動役のこのスクリプトは
+        # assistant と別の Python で動くこともあるので、ここで読み、無ければ aplay で鳴らす
+        try:
+            from audio_output import play_wav_file
+        except ImportError as e:
+            print(f"ℹ audio_output が使えないので aplay で再生します: {e}")
+            subprocess.run(["aplay", config.BUTTON_AUDIO_PATH], check=True)
+        else:
+            play_wav_file(config.BUTTON_AUDIO_PATH)
         print("✅ 音声再生完了")
     except Exception as e:
         print("⚠ 音声再生エラー:", e)
@@ -0,0 +1,120 @@
+"""
+ニコの動きを、しゃべっている言葉に合わせて始める。
+
+VoiceVox の audio_query が返す accent_phrases（モーラごとの子音・母音の長さ）から
+「何文字目の音が、音声の先頭から何秒のところで鳴るか」の時刻表を作り、
+良い言葉が鳴る時刻に合わせて動きを始める。
+
+    言葉が鳴る時刻 = 断片が出力バッファに書かれ始めた時刻（Fragment.started_at）
+                    + 先頭の無音（lead_in）+ 出力バッファの遅れ + 時刻表の言葉の位置
+                    - BLE で届くまでの時間（lead_sec）
+
+時刻表は読み（カタカナ）で作るので、"大好き" も "だいすき" の単語で見つかる。
+キャッシュから出した音声のように audio_query を通っていない文は、
+文字の位置を音声の長さに比例させて見積もる。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+LEAD_SEC = 0.1                # BLE のキュー・書き込み・モーターの立ち上がりのぶん早めに送る
+LATE_SEC = 0.5                # 言葉からこれ以上遅れたら動かさない（ずれた動きはしないほうがまし）
+MAX_TIMELINES = 64            # 覚えておく時刻表の数（新しいものから）
+
+
+def mora_timeline(query):
+    """
+    audio_query の結果 → [(読み, 開始秒, 終了秒), ...]（音声の先頭から）。
+    VoiceVox は speedScale で前後の無音も含めたすべての長さを割る。
+    """
+    speed = float(query.get("speedScale") or 1.0)
+    t = float(query.get("prePhonemeLength") or 0.0)
+    timeline = []
+    for phrase in query.get("accent_phrases", []):
+        for mora in phrase.get("moras", []):
+            length = float(mora.get("consonant_length") or 0.0) + float(mora.get("vowel_length") or 0.0)
+            timeline.append((mora.get("text", ""), t / speed, (t + length) / speed))
+            t += length
+        pause = phrase.get("pause_mora")
+        if pause:
+            t += float(pause.get("consonant_length") or 0.0) + float(pause.get("vowel_length") or 0.0)
+    return timeline
+
+
+class MotionScheduler:
+    """
+    words    : WordMatcher（category の単語が鳴る時刻に合わせる）
+    remember(text, query) で合成した文の時刻表を覚えておき、
+    run_on_word(text, fragment, samplerate, action) で言葉が鳴る時刻まで待ってから action() を呼ぶ。
+    """
+
+    def __init__(self, words, category="good", lead_sec=LEAD_SEC, late_sec=LATE_SEC,
+                 output_latency=None, max_timelines=MAX_TIMELINES):
+        self.words = words
+        self.category = category
+        self.lead_sec = lead_sec
+        self.late_sec = late_sec
+        self.output_latency = output_latency or (lambda: 0.0)
+        self.max_timelines = max_timelines
+        self._timelines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def remember(self, text, query):
+        timeline = mora_timeline(query)
+        with self._lock:
+            self._timelines[text] = timeline
+            self._timelines.move_to_end(text)
+            while len(self._timelines) > self.max_timelines:
+                self._timelines.popitem(last=False)
+
+    def word_offset(self, text, audio_sec=None):
+        """
+        (言葉が鳴り始める秒（音声の先頭から）, 見つけた単語)。見つからなければ (None, None)。
+        時刻表が無ければ audio_sec（音声の長さ）に比例させて見積もる。
+        """
+        with self._lock:
+            timeline = self._timelines.get(text)
+        if timeline:
+            reading, starts = "", []
+            for kana, start, _ in timeline:
+                reading += kana
+                starts.extend([start] * len(kana))
+            match = self.words.first(reading, self.category)
+            if match is not None:
+                return starts[match.start], match.word
+
+        match = self.words.first(text, self.category)
+        if match is None:
+            return None, None
+        if audio_sec is None:
+            return 0.0, match.word
+        return audio_sec * match.start / max(1, len(text)), match.word
+
+    def run_on_word(self, text, fragment, samplerate, action):
+        """
+        fragment（audio_output.Fragment）の中で言葉が鳴る時刻まで待って action() を呼ぶ（呼び出し元をブロックする）。
+        その前に再生が止められた・もう遅すぎるときは呼ばずに False を返す。
+        """
+        offset, word = self.word_offset(text, (fragment.length - fragment.lead_in) / samplerate)
+        if offset is None:
+            return False
+        if not fragment.started.wait(timeout=10.0) or fragment.started_at is None:
+            return False
+        at = (
+            fragment.started_at + fragment.lead_in / samplerate + self.output_latency()
+            + offset - self.lead_sec
+        )
+        delay = at - time.monotonic()
+        if delay < -self.late_sec:
+            print(f"(動きが間に合いませんでした: {word} {-delay:.2f}秒遅れ)")
+            return False
+        if delay > 0 and fragment.done.wait(timeout=delay) and fragment.finished_at is None:
+            # 割り込みで再生が止められた
+            return False
+        print(f"💃 「{word}」に合わせて動きます（音声の {offset:.2f}秒目）")
+        action()
+        return True
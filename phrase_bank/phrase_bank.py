@@ -0,0 +1,143 @@
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import scipy.io.wavfile as wav
+
+from tts_cache import cache_key
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+BUILD_WORKERS = 4
+MANIFEST_NAME = "manifest.json"
+
+
+def voice_key(speaker, params):
+    """話者ID + 合成パラメータの組み合わせを表すキー（パラメータを変えたら別セット）"""
+    return cache_key("", speaker, params)[:16]
+
+
+def wav_to_pcm(wav_bytes):
+    """VoiceVoxのWAVをヘッダ無しのint16 PCMにする（再生時にそのまま流せる形）"""
+    samplerate, samples = wav.read(io.BytesIO(wav_bytes))
+    if samples.ndim > 1:
+        samples = samples[:, 0]
+    return samplerate, samples.astype("<i2", copy=False).tobytes()
+
+
+class PhraseBank:
+    """
+    あいさつ・定型文を前もって合成しておく「フレーズバンク」。
+    ・音声は再生できる形（int16 PCM）で root/<voice_key>/<phrase_key>.pcm に置く
+    ・manifest.json に「話者+パラメータ → 文 → ファイル」の対応を持つ
+    ・build() で足りない分だけ並列に合成する
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.manifest = self._load_manifest()
+
+    # ---------- manifest ----------
+    def _manifest_path(self):
+        return self.root / MANIFEST_NAME
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"⚠ フレーズバンクの manifest が読めません（作り直します）: {e}")
+            return {}
+
+    def _save_manifest(self):
+        path = self._manifest_path()
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+    # ---------- 参照 ----------
+    def _entry(self, text, speaker, params):
+        voice = self.manifest.get(voice_key(speaker, params))
+        if not voice:
+            return None
+        return voice["phrases"].get(text)
+
+    def get(self, text, speaker, params):
+        """合成済みならPCMのbytesを返す。無ければNone"""
+        with self._lock:
+            entry = self._entry(text, speaker, params)
+        if entry is None:
+            return None
+        try:
+            return (self.root / entry["file"]).read_bytes()
+        except OSError:
+            return None
+
+    def available(self, texts, speaker, params):
+        """texts のうち合成済みのものだけを返す"""
+        with self._lock:
+            return [t for t in texts if self._entry(t, speaker, params)]
+
+    # ---------- 作成 ----------
+    def build(self, texts, speaker, params, synthesize, workers=BUILD_WORKERS):
+        """
+        texts のうち未合成のものを並列に合成して保存する。
+
+        synthesize(text) -> VoiceVoxのWAV bytes
+        戻り値: 新しく合成した数
+        """
+        vkey = voice_key(speaker, params)
+        missing = [t for t in dict.fromkeys(texts) if t not in self.available([t], speaker, params)]
+        if not missing:
+            return 0
+
+        voice_dir = self.root / vkey
+        voice_dir.mkdir(exist_ok=True)
+
+        def render(text):
+            try:
+                samplerate, pcm = wav_to_pcm(synthesize(text))
+            except Exception as e:
+                print(f"⚠ フレーズ合成失敗: {text} / {e}")
+                return None
+            name = f"{vkey}/{cache_key(text, speaker, params)[:24]}.pcm"
+            (self.root / name).write_bytes(pcm)
+            return text, {"file": name, "samplerate": samplerate, "bytes": len(pcm)}
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = [r for r in pool.map(render, missing) if r]
+
+        with self._lock:
+            voice = self.manifest.setdefault(
+                vkey, {"speaker": speaker, "params": params, "phrases": {}}
+            )
+            for text, entry in results:
+                voice["phrases"][text] = entry
+            self._save_manifest()
+
+        print(
+            f"🗂 フレーズバンク: {len(results)}/{len(missing)}件を合成 "
+            f"({(time.perf_counter() - t0) * 1000:.0f}ms)"
+        )
+        return len(results)
+
+    def build_in_background(self, texts, speaker, params, synthesize, workers=BUILD_WORKERS):
+        thread = threading.Thread(
+            target=self.build,
+            args=(texts, speaker, params, synthesize, workers),
+            daemon=True,
+        )
+        thread.start()
+        return thread
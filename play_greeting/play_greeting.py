@@ -1,12 +1,12 @@
-import requests
 import random
 import sys
-import os
 import time
-import subprocess
-import tempfile
-import numpy as np
+from pathlib import Path
 from config import VOICEVOX_URL, SPEAKER_ID
+from audio_dsp import apply_gain
+from audio_output import PlaybackEngine, to_pcm
+from phrase_bank import PhraseBank
+from voicevox_client import get_client
 
 greetings = [
     "あそぼ！あそぼー！",
@@ -22,48 +22,37 @@ greetings = [
 ]
 
 def amplify_audio(audio_data, amplification_factor):
-    """音声データの音量を増幅"""
-    audio_array = np.frombuffer(audio_data, dtype=np.int16)
-    amplified_audio = (audio_array * amplification_factor).clip(-32768, 32767).astype(np.int16)
-    return amplified_audio.tobytes()
+    """音声データの音量を増幅（ソフトリミッター付き）"""
+    return apply_gain(to_pcm(audio_data), amplification_factor).tobytes()
 
 def play_audio(audio_data, amplification_factor=4.5):
-    """音量調整した音声を一時WAVとして保存して再生（Bluetooth対応）"""
-    amplified_data = amplify_audio(audio_data, amplification_factor)
+    """音量調整した音声をメモリから直接再生（一時ファイル・aplay無し）"""
+    # 増幅は再生コールバックの中でチャンクごとに行う（配列のコピーを作らない）
+    engine = PlaybackEngine(samplerate=24000)
+    try:
+        engine.play(to_pcm(audio_data), gain=amplification_factor)
+    finally:
+        engine.close()
 
-    # 一時ファイルを作成
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        tmp.write(amplified_data)
-        tmp_path = tmp.name
+# 幼児っぽい話し方にチューニング
+VOICE_PARAMS = {
+    "speedScale": 1.1,
+    "intonationScale": 2.0,
+    "pitchScale": 0,
+    "volumeScale": 1.2,
+    "prePhonemeLength": 0,
+    "postPhonemeLength": 0,
+}
 
-    # フォーマット指定で再生（PulseAudio変換を回避）
-    subprocess.run(["aplay", "-r", "24000", "-f", "S16_LE", "-c", "1", tmp_path])
+BASE_DIR = Path(__file__).resolve().parent
+PHRASE_BANK_DIR = BASE_DIR / "phrase_bank_data"
 
-def speak(text):
-    # クエリ作成
-    res = requests.post(
-        f"{VOICEVOX_URL}/audio_query",
-        params={"text": text, "speaker": SPEAKER_ID}
-    )
-    res.raise_for_status()
-    query = res.json()
-
-    # 幼児っぽい話し方にチューニング
-    query["speedScale"] = 1.1
-    query["intonationScale"] = 2.0
-    query["pitchScale"] = 0
-    query["volumeScale"] = 1.2
-    query["prePhonemeLength"] = 0
-    query["postPhonemeLength"] = 0
+def synthesize(text):
+    return get_client(VOICEVOX_URL).synthesize(text, SPEAKER_ID, VOICE_PARAMS)
 
-    # 音声合成
-    res = requests.post(
-        f"{VOICEVOX_URL}/synthesis",
-        params={"speaker": SPEAKER_ID},
-        json=query
-    )
-    res.raise_for_status()
-    audio_data = res.content
+def speak(text):
+    # クエリ作成 → 音声合成（keep-alive接続・タイムアウト付き）
+    audio_data = synthesize(text)
 
     # 再生
     play_audio(audio_data)
@@ -74,9 +63,20 @@ def main():
         return
     time.sleep(1)  # EC2起動後のVoicevox安定待ち
 
-    greeting = random.choice(greetings)
-    print(f"🎙️ 再生メッセージ: {greeting}")
-    speak(greeting)
+    # 合成済みのあいさつがあれば、VoiceVoxを待たずにそれを再生する
+    bank = PhraseBank(PHRASE_BANK_DIR)
+    ready = bank.available(greetings, SPEAKER_ID, VOICE_PARAMS)
+    if ready:
+        greeting = random.choice(ready)
+        print(f"🎙️ 再生メッセージ: {greeting}")
+        play_audio(bank.get(greeting, SPEAKER_ID, VOICE_PARAMS))
+    else:
+        greeting = random.choice(greetings)
+        print(f"🎙️ 再生メッセージ: {greeting}")
+        speak(greeting)
+
+    # 次回のために、まだ無いあいさつを並列に合成しておく
+    bank.build(greetings, SPEAKER_ID, VOICE_PARAMS, synthesize)
 
 if __name__ == "__main__":
     main()
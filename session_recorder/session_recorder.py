@@ -0,0 +1,361 @@
+"""
+会話1回分をまるごと記録して、1つの zip（セッションアーカイブ）にまとめる。
+
+記録するもの:
+・マイクの生音（常時録音ならマイクを開いている間ずっと。それ以外の方式では切り出した発話だけをつなげたもの）
+・発話の位置、文字起こし、返答、合成した音声（同じ文は1回だけ）
+・turn_trace のスパン（各段の時刻と処理時間）
+
+アーカイブの中身:
+    session.json       出来事とスパン（時刻は UNIX 秒）
+    mic.flac           マイク（16kHz モノラル。soundfile が無ければ mic.wav）
+    speech/0001.flac   合成音声（同上）
+
+録音中はマイクの生音を作業ディレクトリに少しずつ書き、close() でまとめて圧縮する。
+子どもの声がそのまま残るので、既定では記録しない（SESSION_RECORD_DIR を設定したときだけ）。
+
+再生（リプレイ）: benchmarks/bench_e2e.py --replay session-xxxx.zip
+中身の確認:       python session_recorder.py session-xxxx.zip
+"""
+import argparse
+import io
+import json
+import queue
+import shutil
+import threading
+import time
+import wave
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import scipy.io.wavfile as wav
+
+from audio_codec import StreamResampler
+from turn_trace import current_turn, tracer
+
+try:
+    import soundfile as sf
+except ImportError:  # libsndfile が無い環境では WAV で保存する
+    sf = None
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+ARCHIVE_RATE = 16000         # マイクは STT と同じ 16kHz に落として保存する
+CHUNK_SEC = 60               # 圧縮するときに一度に読む長さ（長い録音でもメモリを食わない）
+FORMAT_VERSION = 1
+
+_TTS_STAGES = ("tts_query", "tts_synth")
+
+
+# =========================
+# 音声の読み書き
+# =========================
+def encode_audio(samples, samplerate):
+    """int16 モノラル → (bytes, 拡張子)。FLAC にできなければ WAV"""
+    buf = io.BytesIO()
+    if sf is not None:
+        sf.write(buf, samples, samplerate, format="FLAC", subtype="PCM_16")
+        return buf.getvalue(), "flac"
+    wav.write(buf, samplerate, samples)
+    return buf.getvalue(), "wav"
+
+
+def decode_audio(data, name):
+    """encode_audio の逆 → (samplerate, int16 配列)"""
+    if name.endswith(".flac"):
+        if sf is None:
+            raise RuntimeError("FLAC を読むには soundfile が必要です")
+        samples, samplerate = sf.read(io.BytesIO(data), dtype="int16")
+    else:
+        samplerate, samples = wav.read(io.BytesIO(data))
+    return samplerate, samples.reshape(-1) if samples.ndim == 1 else samples[:, 0]
+
+
+def _to_samples(audio, samplerate):
+    """VoiceVox の WAV bytes / ヘッダ無しPCM bytes / int16 配列 → (samplerate, int16 配列)"""
+    if isinstance(audio, np.ndarray):
+        return samplerate, audio.reshape(-1).astype(np.int16, copy=False)
+    if audio[:4] == b"RIFF":
+        rate, samples = wav.read(io.BytesIO(audio))
+        return rate, samples.reshape(-1) if samples.ndim == 1 else samples[:, 0]
+    return samplerate, np.frombuffer(audio, dtype=np.int16)
+
+
+def _compress_mic(raw_path, samplerate, out_dir):
+    """作業ディレクトリの生の録音（int16）を ARCHIVE_RATE に落として保存する"""
+    size = raw_path.stat().st_size // 2
+    samples = np.memmap(raw_path, dtype=np.int16, mode="r") if size else np.zeros(0, np.int16)
+    step = int(samplerate * CHUNK_SEC)
+
+    if sf is not None:
+        out = out_dir / "mic.flac"
+        writer = sf.SoundFile(out, "w", ARCHIVE_RATE, 1, format="FLAC", subtype="PCM_16")
+        write = writer.write
+    else:
+        out = out_dir / "mic.wav"
+        writer = wave.open(str(out), "wb")
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(ARCHIVE_RATE)
+        write = lambda chunk: writer.writeframes(chunk.tobytes())  # noqa: E731
+
+    # 切れ目でノイズが入らないよう、CHUNK_SEC ごとに読みつつ1本の信号として変換する
+    resampler = StreamResampler(samplerate, ARCHIVE_RATE)
+    with writer:
+        for i in range(0, size, step):
+            write(resampler.push(np.asarray(samples[i:i + step])))
+    return out
+
+
+# =========================
+# 記録
+# =========================
+class SessionRecorder:
+    """
+    start() してから close() するまでの会話を記録する。start() していなければ何もしない。
+
+    recorder.start("sessions", 48000, capture=mic_capture)
+    recorder.utterance(audio, mic_capture.last_span)
+    recorder.transcript(text)
+    recorder.reply(user_input, reply)
+    recorder.speech(text, wav_bytes)
+    recorder.close()  -> アーカイブのパス
+    """
+
+    def __init__(self):
+        self._dir = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return self._dir is not None
+
+    def start(self, directory, samplerate, capture=None, speech_samplerate=24000):
+        """
+        capture: ContinuousCapture。渡すとマイクの生音をすべて記録する（常時録音のとき）。
+                 渡さなければ utterance() で受け取った発話だけをつなげて記録する。
+        """
+        self.close()
+        directory = Path(directory)
+        self.name = "session-" + time.strftime("%Y%m%d-%H%M%S")
+        self._dir = directory / f".{self.name}"
+        (self._dir / "speech").mkdir(parents=True, exist_ok=True)
+        self.archive = directory / f"{self.name}.zip"
+
+        self.samplerate = samplerate
+        self.speech_samplerate = speech_samplerate
+        self.started_at = time.time()
+        self.events = []
+        self.spans = []
+        self._speech_files = {}       # 文 → アーカイブ内のファイル名
+
+        self._mic_samples = 0         # 記録したマイクの通算サンプル数
+        self._mic_offset = 0          # capture の通算位置 → 記録の位置
+        self._mic_queue = queue.SimpleQueue()
+        self._mic_file = open(self._dir / "mic.raw", "wb")
+        self._writer = threading.Thread(target=self._write_mic, daemon=True)
+        self._writer.start()
+
+        self._capture = capture
+        if capture is not None:
+            self._mic_offset = capture.ring.written
+            capture.tap = self.mic
+        tracer.listeners.append(self._on_span)
+        print(f"📼 セッションを記録します: {self.archive}")
+
+    # ---------- マイク ----------
+    def mic(self, block):
+        """マイクの生音（int16）。録音スレッドから呼ばれるので、コピーしてキューに積むだけ"""
+        if self._dir is None:
+            return
+        self._mic_queue.put(np.array(block, dtype=np.int16))
+        self._mic_samples += len(block)
+
+    def _write_mic(self):
+        while True:
+            block = self._mic_queue.get()
+            if block is None:
+                return
+            self._mic_file.write(block.tobytes())
+
+    # ---------- 出来事 ----------
+    def _event(self, kind, **fields):
+        entry = {"kind": kind, "turn": current_turn(), "t": round(time.time(), 3)}
+        entry.update(fields)
+        with self._lock:
+            self.events.append(entry)
+
+    def utterance(self, audio, span=None):
+        """
+        切り出した発話。span は capture 上の (開始位置, 終了位置)。
+        capture を渡していないときは、発話そのものをマイクの記録に足す。
+        """
+        if self._dir is None or audio is None or not audio.size:
+            return
+        if span is None or self._capture is None:
+            start = self._mic_samples
+            self.mic(audio.reshape(-1))
+            end = start + audio.size
+        else:
+            start, end = (p - self._mic_offset for p in span)
+        now = time.time()
+        self._event(
+            "utterance",
+            start_sec=round(start / self.samplerate, 3),
+            end_sec=round(end / self.samplerate, 3),
+            spoken_at=round(now - audio.size / self.samplerate, 3),
+        )
+
+    def transcript(self, text):
+        if self._dir is not None:
+            self._event("transcript", text=text)
+
+    def reply(self, user_input, text):
+        if self._dir is not None:
+            self._event("reply", input=user_input, text=text)
+
+    def speech(self, text, audio):
+        """
+        合成した音声。同じスレッドで直前に VoiceVox を呼んでいれば、その時間も一緒に残す
+        （キャッシュやフレーズバンクから出したときは None）。
+        """
+        if self._dir is None:
+            return
+        timings = getattr(self._local, "tts", {})
+        self._local.tts = {}
+        if audio is None:
+            return
+        with self._lock:
+            file = self._speech_files.get(text)
+            if file is None:
+                rate, samples = _to_samples(audio, self.speech_samplerate)
+                data, ext = encode_audio(samples, rate)
+                file = self._speech_files[text] = f"speech/{len(self._speech_files) + 1:04d}.{ext}"
+                (self._dir / file).write_bytes(data)
+        self._event(
+            "speech", text=text, file=file,
+            query_ms=timings.get("tts_query"), synth_ms=timings.get("tts_synth"),
+        )
+
+    def _on_span(self, entry):
+        if entry["stage"] in _TTS_STAGES:
+            if not hasattr(self._local, "tts"):
+                self._local.tts = {}
+            self._local.tts[entry["stage"]] = entry["ms"]
+        with self._lock:
+            self.spans.append(dict(entry))
+
+    # ---------- まとめる ----------
+    def close(self):
+        """記録をやめて zip にまとめる。戻り値はアーカイブのパス（記録していなければ None）"""
+        if self._dir is None:
+            return None
+        work, self._dir = self._dir, None
+        if self._capture is not None and self._capture.tap == self.mic:
+            self._capture.tap = None
+        if self._on_span in tracer.listeners:
+            tracer.listeners.remove(self._on_span)
+        self._mic_queue.put(None)
+        self._writer.join()
+        self._mic_file.close()
+
+        mic = _compress_mic(work / "mic.raw", self.samplerate, work)
+        session = {
+            "version": FORMAT_VERSION,
+            "name": self.name,
+            "started_at": round(self.started_at, 3),
+            "mic": {
+                "file": mic.name,
+                "samplerate": ARCHIVE_RATE,
+                "source_samplerate": self.samplerate,
+                "continuous": self._capture is not None,
+            },
+            "events": self.events,
+            "spans": self.spans,
+        }
+        with zipfile.ZipFile(self.archive, "w") as zf:
+            zf.writestr("session.json", json.dumps(session, ensure_ascii=False), zipfile.ZIP_DEFLATED)
+            zf.write(mic, mic.name, zipfile.ZIP_STORED)
+            for file in sorted(self._speech_files.values()):
+                zf.write(work / file, file, zipfile.ZIP_STORED)
+        shutil.rmtree(work, ignore_errors=True)
+        print(f"📼 セッションを保存しました: {self.archive} ({self.archive.stat().st_size / 1024:.0f}KB)")
+        return self.archive
+
+
+# =========================
+# 読み出し
+# =========================
+class SessionArchive:
+    """記録したセッションを読む（リプレイ・確認用）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._zip = zipfile.ZipFile(self.path)
+        self.session = json.loads(self._zip.read("session.json"))
+        if self.session.get("version") != FORMAT_VERSION:
+            raise ValueError(f"対応していない形式です: version={self.session.get('version')}")
+        self.events = self.session["events"]
+        self.spans = self.session["spans"]
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def of_kind(self, kind):
+        return [e for e in self.events if e["kind"] == kind]
+
+    def mic(self):
+        """(samplerate, int16 配列)"""
+        name = self.session["mic"]["file"]
+        return decode_audio(self._zip.read(name), name)
+
+    def speech(self, file):
+        """合成音声の WAV bytes（VoiceVox が返すのと同じ形）"""
+        rate, samples = decode_audio(self._zip.read(file), file)
+        buf = io.BytesIO()
+        wav.write(buf, rate, samples)
+        return buf.getvalue()
+
+    def span_ms(self, stage):
+        """ターン番号 → その段の処理時間（ms）。同じターンに複数あれば最初のもの"""
+        result = {}
+        for s in self.spans:
+            if s["stage"] == stage and not s.get("error"):
+                result.setdefault(s.get("turn"), s["ms"])
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="記録したセッションの中身を表示する")
+    parser.add_argument("archive", help="session-xxxx.zip")
+    args = parser.parse_args()
+
+    with SessionArchive(args.archive) as archive:
+        s = archive.session
+        rate, mic = archive.mic()
+        print(f"📼 {s['name']}  マイク {mic.size / rate:.0f}秒 / {archive.path.stat().st_size / 1024:.0f}KB")
+        texts = {e["turn"]: e["text"] for e in archive.of_kind("transcript")}
+        replies = {e["turn"]: e["text"] for e in archive.of_kind("reply")}
+        stt = archive.span_ms("stt")
+        ttft = archive.span_ms("llm_ttft")
+        for u in archive.of_kind("utterance"):
+            turn = u["turn"]
+            print(
+                f"  #{turn} {u['end_sec'] - u['start_sec']:4.1f}秒  stt {stt.get(turn, 0):5.0f}ms  "
+                f"ttft {ttft.get(turn, 0):5.0f}ms  {texts.get(turn, '')} → {replies.get(turn, '')}"
+            )
+        print(f"🔊 合成音声 {len(archive.of_kind('speech'))} 回 / スパン {len(archive.spans)} 件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# =========================
+# 文の区切り
+# =========================
+SENTENCE_BOUNDARIES = "。！？、!?"
+MIN_FRAGMENT_CHARS = 2      # 句読点を除いてこれより短い断片（「ね、」など）は次とくっつける
+
+
+class SentenceChunker:
+    """
+    ストリーミングで届くテキスト差分を、日本語の句読点で区切った断片にする。
+    max_chars を超えた分は捨てる（50文字制限の安全対策）。
+    """
+
+    def __init__(self, boundaries=SENTENCE_BOUNDARIES, min_chars=MIN_FRAGMENT_CHARS, max_chars=None):
+        self.boundaries = boundaries
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.buffer = ""
+        self.total = 0
+
+    def feed(self, delta):
+        """差分を追加し、確定した断片のリストを返す"""
+        if self.max_chars is not None:
+            delta = delta[:max(0, self.max_chars - self.total)]
+        self.total += len(delta)
+        self.buffer += delta
+
+        fragments = []
+        start = 0
+        for i, ch in enumerate(self.buffer):
+            # 長さは句読点を数えない（「ね、」は1文字）
+            if ch in self.boundaries and i - start >= self.min_chars:
+                fragments.append(self.buffer[start:i + 1])
+                start = i + 1
+        self.buffer = self.buffer[start:]
+        return [f for f in (f.strip() for f in fragments) if f]
+
+    def flush(self):
+        """残り（句読点で終わらなかった末尾）を返す"""
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest or None
+
@@ -0,0 +1,344 @@
+import json
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from audio_codec import StreamResampler, encode_for_upload
+from turn_trace import tracer
+
+
+# =========================
+# ストリーミングSTTのワイヤプロトコル
+# =========================
+# クライアント → サーバ : [種別 1byte][長さ 4byte big-endian][本体]
+#   b"S" 開始。本体は JSON {"samplerate": 16000, "language": "ja"}
+#   b"A" 音声。本体は 16bit little-endian モノラルPCM
+#   b"E" 発話終了。本体なし
+# サーバ → クライアント : 1行1JSON
+#   {"type": "partial", "text": "..."} / {"type": "final", "text": "..."}
+STREAM_SAMPLERATE = 16000
+
+
+def pack_message(kind, payload=b""):
+    return kind + struct.pack(">I", len(payload)) + payload
+
+
+def read_message(sock_file):
+    """pack_message の逆。接続が切れたら (None, b"") を返す"""
+    header = sock_file.read(5)
+    if len(header) < 5:
+        return None, b""
+    kind, length = header[:1], struct.unpack(">I", header[1:])[0]
+    payload = sock_file.read(length) if length else b""
+    return kind, payload
+
+
+class SttStream:
+    """
+    1発話分のストリーミング文字起こし。
+    push() で話している最中から音声を流し込み、finish() で最終結果を受け取る。
+    途中結果は on_partial(text)、最終結果は on_final(text) でも通知する。
+    """
+
+    def __init__(self, on_partial=None, on_final=None):
+        self.on_partial = on_partial
+        self.on_final = on_final
+
+    def push(self, chunk):
+        raise NotImplementedError
+
+    def finish(self, timeout=None):
+        raise NotImplementedError
+
+    def cancel(self):
+        pass
+
+
+class SttBackend:
+    """STTの差し替え口。streaming=True のものは話している最中に送信できる"""
+
+    streaming = False
+
+    def transcribe(self, audio, samplerate):
+        raise NotImplementedError
+
+    def open_stream(self, samplerate, on_partial=None, on_final=None):
+        raise NotImplementedError
+
+
+# =========================
+# 文字起こしのふるい（Whisper の「幻聴」よけ）
+# =========================
+# 無音や雑音だけのクリップでも、Whisper は「ご視聴ありがとうございました」などをでっち上げる。
+# 送る前に音の大きさで、返ってきたら区間（segment）ごとの確からしさでふるい落とす。
+# 「無音」の判定は Whisper 本体と同じく、no_speech_prob が高く「かつ」avg_logprob が低い区間だけ。
+# 小さい子のはっきりしない声は avg_logprob が低くなりがちなので、avg_logprob だけでは捨てない
+# （MIN_LOGPROB を設定したときだけ）。None にするとそのふるいは使わない。
+SILENCE_DBFS = -50.0          # 一番大きい 20ms の音量がこれ未満なら、アップロードしない
+NO_SPEECH_PROB = 0.6          # 「話していない」確率がこれを超え、
+LOGPROB_THRESHOLD = -1.0      #   かつ平均対数確率がこれ未満の区間は捨てる（Whisper の無音判定）
+MIN_LOGPROB = None            # 平均対数確率がこれ未満の区間は、それだけで捨てる（使うなら -2.0 くらいに）
+COMPRESSION_RATIO = 2.4       # 圧縮率がこれを超える区間は捨てる（同じ言葉の繰り返し。Whisper は捨てずに温度を上げて再試行する）
+GATE_FRAME_MS = 20
+
+
+def peak_dbfs(audio, samplerate, frame_ms=GATE_FRAME_MS):
+    """frame_ms ごとの RMS のうち一番大きいもの（dBFS）。無音なら -inf"""
+    audio = np.asarray(audio).reshape(-1)
+    frame = max(1, int(samplerate * frame_ms / 1000))
+    n = max(1, audio.size // frame)
+    frames = np.resize(audio.astype(np.float32), n * frame).reshape(n, frame)
+    power = float(np.max(np.mean(frames * frames, axis=1))) if audio.size else 0.0
+    if power <= 0.0:
+        return float("-inf")
+    return 10.0 * np.log10(power / (32768.0 * 32768.0))
+
+
+class TranscriptFilter:
+    """
+    Whisper の結果を区間ごとにふるいにかける。
+    counters: silent_skipped=送らなかった / accepted=通した / rejected=全部捨てた（1発話単位）
+              no_speech・low_logprob・repetitive=捨てた区間の数（理由別）
+    """
+
+    def __init__(self, silence_dbfs=SILENCE_DBFS, no_speech_prob=NO_SPEECH_PROB,
+                 logprob_threshold=LOGPROB_THRESHOLD, min_logprob=MIN_LOGPROB,
+                 compression_ratio=COMPRESSION_RATIO):
+        self.silence_dbfs = silence_dbfs
+        self.no_speech_prob = no_speech_prob
+        self.logprob_threshold = logprob_threshold
+        self.min_logprob = min_logprob
+        self.compression_ratio = compression_ratio
+        self._lock = threading.Lock()
+        self.counters = {
+            "silent_skipped": 0, "accepted": 0, "rejected": 0,
+            "no_speech": 0, "low_logprob": 0, "repetitive": 0,
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def is_silent(self, audio, samplerate):
+        if self.silence_dbfs is None:
+            return False
+        level = peak_dbfs(audio, samplerate)
+        if level >= self.silence_dbfs:
+            return False
+        print(f"🔇 無音なのでアップロードしません（最大 {level:.0f}dBFS）")
+        self._count("silent_skipped")
+        return True
+
+    def reason(self, segment):
+        """区間を捨てる理由（通すなら None）"""
+        def value(name):
+            v = segment.get(name) if isinstance(segment, dict) else getattr(segment, name, None)
+            return None if v is None else float(v)
+
+        ratio = value("compression_ratio")
+        if self.compression_ratio is not None and ratio is not None and ratio > self.compression_ratio:
+            return "repetitive"
+        prob = value("no_speech_prob")
+        logprob = value("avg_logprob")
+        if (
+            self.no_speech_prob is not None and prob is not None and prob > self.no_speech_prob
+            and (self.logprob_threshold is None or (logprob is not None and logprob < self.logprob_threshold))
+        ):
+            return "no_speech"
+        if self.min_logprob is not None and logprob is not None and logprob < self.min_logprob:
+            return "low_logprob"
+        return None
+
+    def apply(self, text, segments):
+        """(通した文, 捨てた理由のリスト)。区間の情報が無ければ文をそのまま通す"""
+        if not segments:
+            kept, reasons = text.strip(), []
+        else:
+            parts, reasons = [], []
+            for segment in segments:
+                why = self.reason(segment)
+                if why is None:
+                    seg_text = segment.get("text") if isinstance(segment, dict) else segment.text
+                    parts.append(seg_text.strip())
+                else:
+                    reasons.append(why)
+                    self._count(why)
+            kept = "".join(parts)
+            if reasons:
+                print(f"🙉 聞き取りを捨てました: {text.strip()!r} → {kept!r}（{', '.join(reasons)}）")
+        if kept:
+            self._count("accepted")
+        elif text.strip():
+            self._count("rejected")
+        return kept, reasons
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+# =========================
+# Whisper（一括アップロード）
+# =========================
+class _BufferedStream(SttStream):
+    """ストリーミング非対応のバックエンド用：ためておいて finish() で一括送信"""
+
+    def __init__(self, backend, samplerate, on_partial=None, on_final=None):
+        super().__init__(on_partial, on_final)
+        self.backend = backend
+        self.samplerate = samplerate
+        self.chunks = []
+
+    def push(self, chunk):
+        self.chunks.append(np.asarray(chunk, dtype=np.int16).reshape(-1))
+
+    def finish(self, timeout=None):
+        audio = np.concatenate(self.chunks) if self.chunks else np.zeros(0, dtype=np.int16)
+        text = self.backend.transcribe(audio, self.samplerate) if audio.size else ""
+        if self.on_final:
+            self.on_final(text)
+        return text
+
+
+class WhisperBackend(SttBackend):
+    def __init__(self, client, model="whisper-1", language="ja", fmt="flac", target_rate=16000,
+                 transcript_filter=None):
+        self.client = client
+        self.model = model
+        self.language = language
+        self.fmt = fmt
+        self.target_rate = target_rate
+        # None なら従来どおり文だけ受け取る。渡すと区間つき（verbose_json）で受け取ってふるう
+        self.transcript_filter = transcript_filter
+
+    def transcribe(self, audio, samplerate):
+        if self.transcript_filter and self.transcript_filter.is_silent(audio, samplerate):
+            return ""
+        with tracer.span("encode", fmt=self.fmt) as span:
+            upload, stats = encode_for_upload(
+                audio, samplerate, fmt=self.fmt, target_rate=self.target_rate
+            )
+            span["bytes"] = stats["bytes"]
+        print(
+            f"📦 音声アップロード: {stats['bytes'] / 1024:.1f}KB "
+            f"({stats['format']}, {stats['duration_sec']:.1f}秒, "
+            f"エンコード {stats['encode_ms']:.0f}ms)"
+        )
+        with tracer.span("stt", backend="whisper", audio_sec=round(stats["duration_sec"], 2)) as span:
+            if self.transcript_filter is None:
+                response = self.client.audio.transcriptions.create(
+                    model=self.model, file=upload, language=self.language, temperature=0.0
+                )
+                return response.text.strip()
+            response = self.client.audio.transcriptions.create(
+                model=self.model, file=upload, language=self.language, temperature=0.0,
+                response_format="verbose_json",
+            )
+            text, reasons = self.transcript_filter.apply(
+                response.text, getattr(response, "segments", None)
+            )
+            if reasons:
+                span["rejected"] = reasons
+        return text
+
+    def open_stream(self, samplerate, on_partial=None, on_final=None):
+        return _BufferedStream(self, samplerate, on_partial, on_final)
+
+
+# =========================
+# ソケット経由のストリーミングSTT
+# =========================
+class _SocketStream(SttStream):
+    def __init__(self, addr, samplerate, language, connect_timeout, on_partial=None, on_final=None):
+        super().__init__(on_partial, on_final)
+        self.samplerate = samplerate
+        self.resampler = StreamResampler(samplerate, STREAM_SAMPLERATE)
+        self.final_text = ""
+        self._done = threading.Event()
+        self._closed = False
+
+        self.sock = socket.create_connection(addr, timeout=connect_timeout)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        header = json.dumps({"samplerate": STREAM_SAMPLERATE, "language": language})
+        self.sock.sendall(pack_message(b"S", header.encode("utf-8")))
+
+        self._reader = threading.Thread(target=self._read_events, daemon=True)
+        self._reader.start()
+
+    def _read_events(self):
+        try:
+            with self.sock.makefile("r", encoding="utf-8") as f:
+                for line in f:
+                    event = json.loads(line)
+                    if event.get("type") == "partial":
+                        if self.on_partial:
+                            self.on_partial(event.get("text", ""))
+                    elif event.get("type") == "final":
+                        self.final_text = event.get("text", "").strip()
+                        if self.on_final:
+                            self.on_final(self.final_text)
+                        break
+        except Exception as e:
+            if not self._closed:
+                print("⚠ ストリーミングSTT受信エラー:", e)
+        finally:
+            self._done.set()
+
+    def push(self, chunk):
+        # 断片ごとに変換すると切れ目ごとにノイズが入るので、前の入力を覚えている resampler を通す
+        pcm = self.resampler.push(chunk)
+        if not pcm.size:
+            return
+        self.sock.sendall(pack_message(b"A", pcm.astype("<i2").tobytes()))
+
+    def finish(self, timeout=10.0):
+        # 話し終わってから最終結果が返るまで（ストリーミングなので encode は無い）
+        with tracer.span("stt", backend="stream") as span:
+            try:
+                self.sock.sendall(pack_message(b"E"))
+                if not self._done.wait(timeout):
+                    print("⏰ ストリーミングSTTの最終結果がタイムアウトしました")
+                    span["timeout"] = True
+            finally:
+                self._close()
+        return self.final_text
+
+    def cancel(self):
+        self._close()
+
+    def _close(self):
+        self._closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class SocketStreamingBackend(SttBackend):
+    """
+    上のワイヤプロトコルを話すSTTサーバにつなぐバックエンド。
+    開発中は stt_standin_server.py（台本どおりに途中結果を返す）を相手にできる。
+    """
+
+    streaming = True
+
+    def __init__(self, addr, language="ja", connect_timeout=3.0):
+        if isinstance(addr, str):
+            host, port = addr.rsplit(":", 1)
+            addr = (host, int(port))
+        self.addr = addr
+        self.language = language
+        self.connect_timeout = connect_timeout
+
+    def open_stream(self, samplerate, on_partial=None, on_final=None):
+        return _SocketStream(
+            self.addr, samplerate, self.language, self.connect_timeout, on_partial, on_final
+        )
+
+    def transcribe(self, audio, samplerate):
+        stream = self.open_stream(samplerate)
+        stream.push(audio)
+        return stream.finish()
@@ -0,0 +1,105 @@
+"""
+ストリーミングSTTの代役サーバ（オフライン開発・テスト用）。
+
+stt_backend.py のワイヤプロトコルを話し、受け取った音声の長さに合わせて
+台本の文章を少しずつ「途中結果」として返し、発話終了で「最終結果」を返す。
+音声認識はしない。
+
+使い方:
+    python stt_standin_server.py --port 8765 --script script.txt
+    （script.txt は1行1発話。接続ごとに順番に使い、最後まで行ったら先頭に戻る）
+"""
+import argparse
+import itertools
+import json
+import socketserver
+import threading
+import time
+
+from stt_backend import STREAM_SAMPLERATE, read_message
+
+DEFAULT_SCRIPT = ["こんにちは", "ニコちゃん大好き", "きょうはなにしてあそぶ？", "ストップ"]
+
+
+class StandinHandler(socketserver.StreamRequestHandler):
+    def _send(self, kind, text):
+        line = json.dumps({"type": kind, "text": text}, ensure_ascii=False) + "\n"
+        self.wfile.write(line.encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        text = server.next_line()
+        bytes_per_ms = STREAM_SAMPLERATE * 2 / 1000
+        received_ms = 0.0
+        shown = 0
+
+        while True:
+            kind, payload = read_message(self.rfile)
+            if kind is None:
+                return
+            if kind == b"A":
+                received_ms += len(payload) / bytes_per_ms
+                # partial_every_ms ごとに1文字ずつ見せていく（最後の1文字は final まで取っておく）
+                target = min(len(text) - 1, int(received_ms // server.partial_every_ms))
+                if target > shown:
+                    shown = target
+                    self._send("partial", text[:shown])
+            elif kind == b"E":
+                time.sleep(server.final_delay_ms / 1000)
+                self._send("final", text)
+                return
+
+
+class StandinServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, addr, script=None, partial_every_ms=150, final_delay_ms=80):
+        super().__init__(addr, StandinHandler)
+        self._lines = itertools.cycle(script or DEFAULT_SCRIPT)
+        self._lock = threading.Lock()
+        self.partial_every_ms = partial_every_ms
+        self.final_delay_ms = final_delay_ms
+
+    def next_line(self):
+        with self._lock:
+            return next(self._lines)
+
+
+def start_in_background(port=0, **kwargs):
+    """テストやベンチマークから使う用。起動したサーバを返す（server.server_address で番号がわかる）"""
+    server = StandinServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ストリーミングSTTの代役サーバ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--script", help="1行1発話の台本ファイル")
+    parser.add_argument("--partial-every-ms", type=float, default=150)
+    parser.add_argument("--final-delay-ms", type=float, default=80)
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            script = [line.strip() for line in f if line.strip()]
+
+    server = StandinServer(
+        (args.host, args.port),
+        script=script,
+        partial_every_ms=args.partial_every_ms,
+        final_delay_ms=args.final_delay_ms,
+    )
+    print(f"🧪 STT代役サーバ起動: {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("🛑 終了")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+MEMORY_MAX_BYTES = 8 * 1024 * 1024     # メモリに置く合成音声の上限
+DISK_MAX_BYTES = 200 * 1024 * 1024     # SDカードに置く合成音声の上限
+DISK_MIN_USES = 2                      # この回数使われた文だけSDカードに書く（1回きりの返事は書かない）
+USE_TRACK_MAX = 4096                   # 使われた回数を覚えておく文の数
+
+
+def normalize_text(text):
+    """全角/半角・前後の空白のゆれをそろえる（キー計算用。合成には元の文を使う）"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(text, speaker, params=None):
+    """文・話者ID・パラメータ上書き（speedScale など）から決まるキー"""
+    payload = json.dumps(
+        {"text": normalize_text(text), "speaker": speaker, "params": params or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TtsCache:
+    """
+    VoiceVoxの合成結果キャッシュ（内容アドレス方式）。
+    ・1段目: メモリ上のLRU（バイト数で上限）
+    ・2段目: ディスク上のLRU（再起動しても残る）。LLMの返事はほとんど1回きりなので、
+             disk_min_uses 回使われた文だけ書く。読むときはファイルに触らない
+             （再起動のときは書いた時刻の古い順に消す）
+    """
+
+    def __init__(self, disk_dir=None, memory_max_bytes=MEMORY_MAX_BYTES, disk_max_bytes=DISK_MAX_BYTES,
+                 disk_min_uses=DISK_MIN_USES):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_min_uses = disk_min_uses
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()       # key -> サイズ（古い順）
+        self._disk_bytes = 0
+        self._uses = OrderedDict()       # key -> このセッションで使われた回数（古い順）
+
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "disk_writes": 0,
+        }
+
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._scan_disk()
+
+    # ---------- ディスク ----------
+    def _path(self, key):
+        return self.disk_dir / f"{key}.wav"
+
+    def _scan_disk(self):
+        entries = []
+        for p in self.disk_dir.glob("*.wav"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, p.stem, st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.counters["disk_evictions"] += 1
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    def _read_disk(self, key):
+        if key not in self._disk:
+            return None
+        try:
+            data = self._path(key).read_bytes()
+        except OSError:
+            self._disk_bytes -= self._disk.pop(key)
+            return None
+        self._disk.move_to_end(key)
+        return data
+
+    def _write_disk(self, key, data):
+        path = self._path(key)
+        tmp = path.with_suffix(".tmp")
+        try:
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠ TTSキャッシュ書き込み失敗: {e}")
+            return
+        if key in self._disk:
+            self._disk_bytes -= self._disk.pop(key)
+        self._disk[key] = len(data)
+        self._disk_bytes += len(data)
+        self.counters["disk_writes"] += 1
+        self._evict_disk()
+
+    def _use(self, key, data):
+        """使われた回数を数え、disk_min_uses 回に達したらディスクに書く"""
+        if not self.disk_dir or key in self._disk:
+            return
+        count = self._uses.pop(key, 0) + 1
+        if count >= self.disk_min_uses:
+            self._write_disk(key, data)
+            return
+        self._uses[key] = count
+        while len(self._uses) > USE_TRACK_MAX:
+            self._uses.popitem(last=False)
+
+    # ---------- メモリ ----------
+    def _put_memory(self, key, data):
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        if len(data) > self.memory_max_bytes:
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+            self.counters["memory_evictions"] += 1
+
+    # ---------- 公開API ----------
+    def get(self, text, speaker, params=None):
+        key = cache_key(text, speaker, params)
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                self._use(key, data)
+                return data
+            if self.disk_dir:
+                data = self._read_disk(key)
+                if data is not None:
+                    self._put_memory(key, data)
+                    self.counters["disk_hits"] += 1
+                    return data
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, text, speaker, params, data):
+        key = cache_key(text, speaker, params)
+        with self._lock:
+            self._put_memory(key, data)
+            self._use(key, data)
+
+    def get_or_synthesize(self, text, speaker, params, synthesize):
+        """キャッシュになければ synthesize() を呼んで結果を入れる"""
+        data = self.get(text, speaker, params)
+        if data is None:
+            data = synthesize()
+            if data:
+                self.put(text, speaker, params, data)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self.counters,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                disk_entries=len(self._disk),
+                disk_bytes=self._disk_bytes,
+            )
@@ -0,0 +1,251 @@
+"""
+ターンごとの処理時間（スパン）を JSONL に記録し、段ごとに集計する。
+
+記録する側:
+    from turn_trace import tracer
+    tracer.configure("turn_trace.jsonl")
+    with tracer.span("stt"):
+        ...
+    tracer.record("llm_ttft", t0, time.monotonic())
+
+書き込みは別スレッド（QueueListener）が行うので、呼び出し側はファイルI/Oで待たない。
+ファイルが max_bytes を超えたら turn_trace.jsonl.1, .2 … に回す。
+
+集計:
+    python turn_trace.py turn_trace.jsonl          # 最新セッションの段ごとの p50/p95/p99
+    python turn_trace.py turn_trace.jsonl --all    # ファイル内の全セッション
+"""
+import argparse
+import json
+import logging
+import logging.handlers
+import math
+import queue
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+MAX_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 3
+
+# 集計表に並べる順番（ここに無い段は後ろに付く）
+STAGES = [
+    "capture",          # 発話の切り出し（話し始め〜話し終わり判定まで）
+    "encode",           # アップロード用の圧縮
+    "stt",              # 文字起こしリクエスト
+    "llm_ttft",         # 返答リクエスト → 最初の文字
+    "llm",              # 返答リクエスト全体
+    "tts_query",        # VoiceVox audio_query
+    "tts_synth",        # VoiceVox synthesis
+    "fragment",         # 返答の断片: 合成段に届いてから再生に渡すまで（wait_ms / synth_ms / stall_ms 付き）
+    "playback_start",   # 再生エンジンに積んでから鳴り始めるまで
+    "playback",         # 鳴り始め〜鳴り終わり
+    "first_audio",      # 話し終わり → 最初の返答音声が鳴り始めるまで
+    "ble",              # BLEコマンドをキューに積んでから書き込み完了まで
+]
+
+# いま処理しているターンの番号。asyncio.to_thread やタスクには自動で引き継がれる
+_turn = ContextVar("turn_trace_turn", default=None)
+
+
+def set_turn(turn_id):
+    """以降このスレッド（タスク）で記録するスパンにターン番号を付ける"""
+    _turn.set(turn_id)
+
+
+def current_turn():
+    return _turn.get()
+
+
+class Tracer:
+    """
+    スパンを1行1JSONで書き出す。configure() するまでは何もしない（計測コストもほぼゼロ）。
+
+    1行の形:
+        {"session": "20261017-101500", "turn": 3, "stage": "stt",
+         "t": 開始時刻(UNIX秒), "ms": かかった時間, ...追加の属性}
+    """
+
+    def __init__(self):
+        self.session = None
+        self._logger = None
+        self._listener = None
+        self._handler = None
+        # 記録したスパンを受け取る関数（セッション記録など）。ファイルに書かなくても呼ばれる
+        self.listeners = []
+
+    @property
+    def enabled(self):
+        return self._logger is not None
+
+    def configure(self, path, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        self.close()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+        records = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(records, self._handler)
+        self._listener.start()
+
+        logger = logging.getLogger(f"turn_trace.{id(self)}")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.handlers[:] = [logging.handlers.QueueHandler(records)]
+        self._logger = logger
+        self.session = time.strftime("%Y%m%d-%H%M%S")
+        print(f"📈 スパンを記録します: {path}")
+
+    def close(self):
+        """残っている行を書き出してから止める"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._handler.close()
+        self._logger = None
+        self._listener = None
+        self._handler = None
+
+    def record(self, stage, start, end, turn=None, **attrs):
+        """
+        start, end は time.monotonic() の値。
+        turn を省略すると、いまのターン番号（set_turn）を使う。
+        """
+        if (self._logger is None and not self.listeners) or start is None or end is None:
+            return
+        entry = {
+            "session": self.session,
+            "turn": current_turn() if turn is None else turn,
+            "stage": stage,
+            "t": round(time.time() - (time.monotonic() - start), 3),
+            "ms": round((end - start) * 1000, 1),
+        }
+        entry.update(attrs)
+        for listener in self.listeners:
+            listener(entry)
+        if self._logger is not None:
+            self._logger.info(json.dumps(entry, ensure_ascii=False))
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """
+        with の中の時間を記録する。yield される dict に属性を足せる。
+        例外で抜けたときは "error" に例外名が入る。
+        """
+        start = time.monotonic()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(stage, start, time.monotonic(), **attrs)
+
+
+tracer = Tracer()
+
+
+# =========================
+# 集計
+# =========================
+def trace_files(path):
+    """ローテーション済みのファイルも含めて、古い順に返す"""
+    path = Path(path)
+    rotated = sorted(
+        path.parent.glob(path.name + ".*"),
+        key=lambda p: int(p.suffix[1:]) if p.suffix[1:].isdigit() else 0,
+        reverse=True,
+    )
+    return [p for p in rotated if p.suffix[1:].isdigit()] + ([path] if path.exists() else [])
+
+
+def load_records(path):
+    records = []
+    for file in trace_files(path):
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue    # 書きかけの行など
+    return records
+
+
+def percentile(sorted_values, p):
+    """最近傍順位法（p は 0〜100）"""
+    if not sorted_values:
+        return None
+    k = math.ceil(p / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, k))]
+
+
+def summarize(records, session=None):
+    """
+    段ごとの {count, p50, p95, p99, max}（ms）を返す。
+    session=None なら全レコード。
+    """
+    by_stage = {}
+    for r in records:
+        if session is not None and r.get("session") != session:
+            continue
+        if r.get("error"):
+            continue
+        by_stage.setdefault(r["stage"], []).append(r["ms"])
+
+    order = {name: i for i, name in enumerate(STAGES)}
+    summary = {}
+    for stage in sorted(by_stage, key=lambda s: (order.get(s, len(STAGES)), s)):
+        values = sorted(by_stage[stage])
+        summary[stage] = {
+            "count": len(values),
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "max": values[-1],
+        }
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'stage':16s} {'count':>6s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}  (ms)")
+    for stage, s in summary.items():
+        print(
+            f"{stage:16s} {s['count']:6d} {s['p50']:9.1f} {s['p95']:9.1f} "
+            f"{s['p99']:9.1f} {s['max']:9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ターンごとのスパンを段ごとに集計する")
+    parser.add_argument("trace", help="スパンを記録した JSONL（ローテーション済みの .1, .2 … も読む）")
+    parser.add_argument("--session", help="集計するセッション（既定: 最新）")
+    parser.add_argument("--all", action="store_true", help="全セッションをまとめて集計する")
+    parser.add_argument("--json", action="store_true", help="集計結果を JSON で出す")
+    args = parser.parse_args()
+
+    records = load_records(args.trace)
+    if not records:
+        print("⚠ スパンがありません:", args.trace)
+        return
+
+    session = None
+    if not args.all:
+        session = args.session or max(r.get("session") or "" for r in records)
+    summary = summarize(records, session)
+
+    if args.json:
+        print(json.dumps({"session": session, "stages": summary}, ensure_ascii=False, indent=1))
+        return
+    turns = {r.get("turn") for r in records if session is None or r.get("session") == session}
+    print(f"📊 セッション: {session or '全部'} / ターン数: {len(turns - {None})}")
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from turn_trace import tracer
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+CONNECT_TIMEOUT = 3.05     # TCP接続のタイムアウト（秒）
+READ_TIMEOUT = 20.0        # 応答待ちのタイムアウト（長文の合成を考えて長め）
+POOL_SIZE = 4              # 同時に張っておく keep-alive 接続数（並列合成ワーカー数以上）
+CONNECT_RETRIES = 2        # 接続できなかったときだけ再試行する（送信後の再試行はしない）
+
+
+class VoiceVoxClient:
+    """
+    VoiceVox への HTTP 呼び出しをまとめたクライアント。
+    ・requests.Session で keep-alive 接続を使い回す（毎回のTCPハンドシェイクを省く）
+    ・接続/読み込みタイムアウトを必ず付ける
+    ・gzip=True なら圧縮レスポンスを受け付ける（requests が自動で展開する）
+    """
+
+    def __init__(
+        self,
+        base_url,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        pool_size=POOL_SIZE,
+        gzip=True,
+        retries=CONNECT_RETRIES,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=0,
+            backoff_factor=0.1,
+            allowed_methods=None,   # 接続前の失敗だけなので POST も再試行してよい
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate" if gzip else "identity"
+
+    def _post(self, path, **kwargs):
+        res = self.session.post(f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        res.raise_for_status()
+        return res
+
+    def audio_query(self, text, speaker):
+        return self._post("/audio_query", params={"text": text, "speaker": speaker}).json()
+
+    def synthesis(self, query, speaker):
+        return self._post("/synthesis", params={"speaker": speaker}, json=query).content
+
+    def synthesize(self, text, speaker, overrides=None, on_query=None):
+        """
+        audio_query → パラメータ上書き → synthesis をまとめて行い、WAVのbytesを返す。
+        on_query があれば、上書きしたあとのクエリ（モーラの長さ入り）を渡して呼ぶ。
+        """
+        with tracer.span("tts_query", chars=len(text)):
+            query = self.audio_query(text, speaker)
+        if overrides:
+            query.update(overrides)
+        if on_query is not None:
+            on_query(query)
+        with tracer.span("tts_synth", chars=len(text)) as span:
+            wav = self.synthesis(query, speaker)
+            span["bytes"] = len(wav)
+        return wav
+
+    def is_ready(self, timeout=3):
+        """エンジンが起動していて、話者一覧まで返せる状態か"""
+        try:
+            for path in ("/", "/speakers"):
+                res = self.session.get(f"{self.base_url}{path}", timeout=timeout)
+                if res.status_code != 200:
+                    return False
+            return True
+        except requests.RequestException:
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url, **kwargs):
+    """同じURLには同じクライアント（＝同じ接続プール）を返す"""
+    key = base_url.rstrip("/")
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = VoiceVoxClient(key, **kwargs)
+        return client
@@ -0,0 +1,236 @@
+"""
+GOOD / IGNORE / STOP などの単語リストを、1回の走査でまとめて探す（Aho–Corasick）。
+
+探す前に、単語と入力の両方を同じ形にそろえる（normalize）:
+  ・全角/半角・大文字/小文字      "Ｓｔｏｐ" "STOP" → "stop"、"ｽﾄｯﾌﾟ" → "すとっぷ"
+  ・カタカナ → ひらがな           "ストップ" → "すとっぷ"
+  ・空白は消す                     Whisper はときどき文の途中に空白を入れる
+  ・のばし                         "～" "〜" や、前の文字の母音をのばす「あいうえお」（小さいものも）を
+                                   "ー" 1つにまとめる
+                                   "ありがとう" "ありがと～" "ありがとー" → "ありがとー"
+見つかった位置は元の文の位置（start, end）で返すので、その言葉に合わせて動かすこともできる。
+
+単語リストは JSON（{"カテゴリ": ["単語", ...]}）。ファイルが書き換わったら次の find() で読み直す。
+"""
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+
+
+# =========================
+# 設定（デフォルト値）
+# =========================
+RELOAD_CHECK_SEC = 1.0        # ファイルが書き換わったかを見る間隔
+
+LONG_MARK = "ー"
+LONG_MARKS = set("ー－―‐~〜～")
+VOWELS = {"あ": "a", "い": "i", "う": "u", "え": "e", "お": "o",
+          "ぁ": "a", "ぃ": "i", "ぅ": "u", "ぇ": "e", "ぉ": "o"}
+_VOWEL_ROWS = {
+    "a": "あかさたなはまやらわがざだばぱゃぁ",
+    "i": "いきしちにひみりぎじぢびぴぃ",
+    "u": "うくすつぬふむゆるぐずづぶぷゅぅ",
+    "e": "えけせてねへめれげぜでべぺぇ",
+    "o": "おこそとのほもよろをごぞどぼぽょぉ",
+}
+VOWEL_OF = {kana: vowel for vowel, row in _VOWEL_ROWS.items() for kana in row}
+# 前の母音がこれなら、この文字は「のばし」とみなす（"とう" "せい" も）
+EXTENDS = {"a": "a", "i": "i", "u": "u", "e": "ei", "o": "ou"}
+_COMBINING_MARKS = ("\u3099", "\u309a")   # 半角の濁点・半濁点を NFKC にかけたもの
+
+Match = namedtuple("Match", "category word start end")
+
+
+# =========================
+# 正規化
+# =========================
+_folded = {}
+
+
+def _fold_char(ch):
+    """1文字を全角/半角・大文字/小文字・カタカナ/ひらがなをそろえた文字列に（一度そろえた文字は覚えておく）"""
+    folded = _folded.get(ch)
+    if folded is None:
+        folded = "".join(
+            chr(ord(c) - 0x60) if "ァ" <= c <= "ヶ" else c
+            for c in unicodedata.normalize("NFKC", ch).casefold()
+        )
+        if len(_folded) < 65536:
+            _folded[ch] = folded
+    return folded
+
+
+def normalize(text):
+    """
+    (そろえた文字列, 各文字の元の位置のリスト)。
+    まとめた文字は前の文字に含めるので、元の位置は増える一方になる。
+    """
+    out, origin = [], []
+    vowel = None          # いまの文字の母音（のばしが続いている間も持ち越す）
+    for i, ch in enumerate(text):
+        for c in _fold_char(ch):
+            if c.isspace():
+                continue
+            if c in _COMBINING_MARKS:
+                # 半角の "ｶﾞ" は2文字で1文字（前の文字と合成する）
+                if out:
+                    out[-1] = unicodedata.normalize("NFC", out[-1] + c)
+                continue
+            if c in LONG_MARKS or (vowel and c in VOWELS and VOWELS[c] in EXTENDS[vowel]):
+                if out and out[-1] != LONG_MARK and vowel:
+                    out.append(LONG_MARK)
+                    origin.append(i)
+                continue
+            vowel = VOWEL_OF.get(c)
+            out.append(c)
+            origin.append(i)
+    return "".join(out), origin
+
+
+# =========================
+# オートマトン
+# =========================
+class _Automaton:
+    """単語 → (カテゴリ, 元の単語) の Aho–Corasick。作ったあとは変更しない（読むだけなら並行してよい）"""
+
+    def __init__(self, lists):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]       # 状態 → [(カテゴリ, 元の単語, そろえた単語の長さ)]
+        self.size = 0
+        seen = set()
+        for category, words in lists.items():
+            for word in words:
+                key, _ = normalize(word)
+                # そろえると同じになる書き方（"ありがとう" と "ありがと～"）は1つだけ登録する
+                if key and (category, key) not in seen:
+                    seen.add((category, key))
+                    self._add(key, (category, word, len(key)))
+                    self.size += 1
+        self._link()
+
+    def _add(self, key, entry):
+        state = 0
+        for c in key:
+            nxt = self.goto[state].get(c)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][c] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            state = nxt
+        self.out[state].append(entry)
+
+    def _link(self):
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for c, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(c, 0)
+                # 短い単語の一致も、長い単語の状態からたどれるようにまとめておく
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def scan(self, key):
+        """そろえた文字列の中の一致 (終わりの位置, エントリ) を順に"""
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for pos, c in enumerate(key):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            for entry in out[state]:
+                yield pos, entry
+
+
+# =========================
+# 単語リスト
+# =========================
+class WordMatcher:
+    """
+    全カテゴリの単語を1つのオートマトンにまとめたもの。
+    path を渡すとそのファイルから読み、書き換わったら find() のときに読み直す
+    （読めなかったら前のリストのまま使う）。
+    """
+
+    def __init__(self, path=None, lists=None, reload_check_sec=RELOAD_CHECK_SEC):
+        self.path = path
+        self.reload_check_sec = reload_check_sec
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        if path is not None:
+            lists, self._mtime = self._read()
+        self.lists = {category: list(words) for category, words in (lists or {}).items()}
+        self._automaton = _Automaton(self.lists)
+
+    @classmethod
+    def from_lists(cls, **lists):
+        return cls(lists=lists)
+
+    def _read(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, encoding="utf-8") as f:
+            lists = json.load(f)
+        if not isinstance(lists, dict) or not all(isinstance(v, list) for v in lists.values()):
+            raise ValueError("単語リストは {\"カテゴリ\": [\"単語\", ...]} の形にしてください")
+        return lists, mtime
+
+    def reload_if_changed(self):
+        """ファイルが書き換わっていたら読み直す。読み直したら True"""
+        if self.path is None:
+            return False
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_check_sec:
+            return False
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            # 壊れたファイルでも、同じ書き換えについての警告は1回だけにする
+            self._mtime = mtime
+            try:
+                lists, _ = self._read()
+                automaton = _Automaton(lists)
+            except (OSError, ValueError) as e:
+                print(f"⚠ 単語リストを読み直せませんでした（前のまま使います）: {e}")
+                return False
+            self.lists = lists
+            self._automaton = automaton
+        print(f"🔄 単語リストを読み直しました: {self.path}（{automaton.size} 語）")
+        return True
+
+    def find(self, text):
+        """text の中で見つかった単語（Match のリスト。見つかった順）"""
+        if not text:
+            return []
+        self.reload_if_changed()
+        key, origin = normalize(text)
+        matches = []
+        for pos, (category, word, length) in self._automaton.scan(key):
+            start = origin[pos - length + 1]
+            end = origin[pos + 1] if pos + 1 < len(origin) else len(text)
+            matches.append(Match(category, word, start, end))
+        return matches
+
+    def categories(self, text):
+        """text に含まれる単語のカテゴリの集合"""
+        return {m.category for m in self.find(text)}
+
+    def first(self, text, category):
+        """text の中で最初に見つかった category の単語（無ければ None）"""
+        return next((m for m in self.find(text) if m.category == category), None)
+
+    def has(self, text, category):
+        return self.first(text, category) is not None
+